@@ -7,12 +7,40 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object('config.Config')
 
+    from . import pool
+    pool.init_app(app)
+
     db.init_app(app)
 
+    from . import cache
+    cache.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
+
     # 延迟导入蓝图和创建表
     with app.app_context():
 
         from .routes import main
         app.register_blueprint(main)
 
+        # 调度器在处理第一个请求时才启动，各进程的任务由 init_scheduler 统一注册
+        from .scheduler import init_scheduler, scheduler
+        init_scheduler(app)
+
+        from .alerts import init_alerts
+        init_alerts(app, scheduler)
+
+        from .search import init_search
+        init_search(app)
+
+        from .safety import init_safety
+        init_safety(app)
+
+        from .inventory import init_inventory
+        init_inventory(app)
+
+        from .schema import register_commands
+        register_commands(app)
+
     return app
@@ -0,0 +1,219 @@
+import datetime
+import threading
+
+from flask import current_app
+from sqlalchemy import func
+
+from . import db
+from .cache import table_versions
+from .models import Medicine, MedicineCabinet
+
+# 即将过期提醒的天数窗口；未配置 LOW_STOCK_THRESHOLD 时使用的全局库存提醒阈值
+EXPIRY_WARNING_DAYS = 30
+LOW_STOCK_THRESHOLD = 3
+
+ALERT_SECTIONS = ['expiring_medicines', 'low_stock_medicines', 'expired_medicines']
+# 这些表的写入会影响提醒结果
+_WATCHED_TABLES = {Medicine.__tablename__, MedicineCabinet.__tablename__}
+_WATCHED_TOKEN_TABLES = sorted(_WATCHED_TABLES)
+
+
+class AlertSnapshot:
+    """药品提醒快照：由定时任务生成，接口直接读取"""
+
+    def __init__(self):
+        self.data = None
+        self.generated_at = None
+        self.token = None
+        self.stale = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+
+    def request_refresh(self):
+        """登记一次刷新请求；返回 True 表示当前没有刷新任务在执行，需要安排一个"""
+        with self._state_lock:
+            self.stale = True
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def refresh_pending(self):
+        """持续刷新，直到刷新期间没有新的写入提交"""
+        try:
+            while True:
+                with self._state_lock:
+                    if not self.stale:
+                        self._refreshing = False
+                        return
+                    self.stale = False
+                # 结束上一次刷新的读事务，使本次刷新读到期间提交的写入
+                db.session.rollback()
+                self.refresh()
+        except Exception:
+            with self._state_lock:
+                self._refreshing = False
+            raise
+
+    def refresh(self):
+        # 串行刷新，避免较早开始的计算覆盖较新的结果
+        with self._lock:
+            # 先取版本号再计算：计算期间的写入会使版本号变化，快照随之过期
+            token = table_versions.token(_WATCHED_TOKEN_TABLES)
+            data = compute_alerts()
+            self.data = data
+            self.token = token
+            self.generated_at = datetime.datetime.now()
+
+    def invalidate(self):
+        """标记快照已过期，下次读取时重新计算（当前进程没有运行调度器、无法安排刷新任务时使用）"""
+        with self._state_lock:
+            self.stale = True
+
+    def _refresh_if_stale(self):
+        with self._state_lock:
+            # 跨过零点而每日刷新任务没有执行（调度器未启动）时，到期天数已经变化
+            if self.generated_at is not None and self.generated_at.date() != datetime.date.today():
+                self.stale = True
+            # 有刷新任务在执行时由该任务负责
+            if not self.stale or self._refreshing:
+                return
+            self.stale = False
+        try:
+            self.refresh()
+        except Exception:
+            with self._state_lock:
+                self.stale = True
+            raise
+
+    def get(self):
+        # 读取其他进程的变更记录，其写入会使快照过期
+        table_versions.sync()
+        if self.data is None:
+            self.refresh()
+        else:
+            self._refresh_if_stale()
+        return self.data
+
+    def etag_version(self):
+        """快照的版本（用于 ETag）：计算快照时各表的版本号与生成日期；
+        快照已过期时先重新计算；计算失败时返回 None，由接口读取快照时报告错误"""
+        try:
+            self.get()
+        except Exception:
+            return None
+        return self.token, self.generated_at.date().isoformat()
+
+
+snapshot = AlertSnapshot()
+
+
+def low_stock_threshold_expression(default):
+    """生效的库存提醒阈值：药品自身设置 > 所在药箱设置 > 全局默认值（需外连接药箱表）"""
+    return func.coalesce(Medicine.low_stock_threshold, MedicineCabinet.low_stock_threshold, default)
+
+
+def low_stock_query(default=None, limit=None):
+    """在一条连接查询中按阈值筛选库存不足的药品，并在 SQL 中排序、截取"""
+    if default is None:
+        default = current_app.config.get('LOW_STOCK_THRESHOLD', LOW_STOCK_THRESHOLD)
+    threshold = low_stock_threshold_expression(default)
+    query = db.session.query(
+        Medicine.national_code,
+        Medicine.name,
+        Medicine.remaining_quantity,
+        threshold.label('low_stock_threshold'),
+        MedicineCabinet.location
+    ).outerjoin(MedicineCabinet, MedicineCabinet.cabinet_id == Medicine.cabinet_id) \
+        .filter(Medicine.remaining_quantity > 0, Medicine.remaining_quantity < threshold) \
+        .order_by(Medicine.remaining_quantity, Medicine.national_code)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def low_stock_items(rows):
+    return [{
+        'national_code': national_code,
+        'name': name,
+        'remaining_quantity': remaining_quantity,
+        'low_stock_threshold': threshold,
+        'cabinet_location': cabinet_location or '未知'
+    } for national_code, name, remaining_quantity, threshold, cabinet_location in rows]
+
+
+def compute_alerts(today=None):
+    """计算即将过期、库存不足、已过期三类提醒：过期类走 expiry_date 索引的范围查询，库存类按阈值在 SQL 中筛选"""
+    today = today or datetime.date.today()
+    rows = db.session.query(Medicine, MedicineCabinet.location) \
+        .outerjoin(MedicineCabinet, MedicineCabinet.cabinet_id == Medicine.cabinet_id) \
+        .filter(Medicine.expiry_date <= today + datetime.timedelta(days=EXPIRY_WARNING_DAYS),
+                Medicine.remaining_quantity > 0) \
+        .order_by(Medicine.expiry_date, Medicine.national_code) \
+        .all()
+
+    expiring, expired = [], []
+    for medicine, cabinet_location in rows:
+        days = (medicine.expiry_date - today).days
+        if days < 0:
+            expired.append({
+                'national_code': medicine.national_code,
+                'name': medicine.name,
+                'expiry_date': medicine.expiry_date.strftime('%Y-%m-%d'),
+                'days_expired': -days,
+                'remaining_quantity': medicine.remaining_quantity,
+                'cabinet_location': cabinet_location or '未知'
+            })
+        else:
+            expiring.append({
+                'national_code': medicine.national_code,
+                'name': medicine.name,
+                'expiry_date': medicine.expiry_date.strftime('%Y-%m-%d'),
+                'days_until_expiry': days,
+                'remaining_quantity': medicine.remaining_quantity,
+                'cabinet_location': cabinet_location or '未知'
+            })
+
+    # 最近过期的排在前面
+    expired.reverse()
+    return {
+        'expiring_medicines': expiring,
+        'low_stock_medicines': low_stock_items(low_stock_query()),
+        'expired_medicines': expired
+    }
+
+
+def _refresh_job(app, on_write=False):
+    with app.app_context():
+        try:
+            if on_write:
+                snapshot.refresh_pending()
+            else:
+                snapshot.refresh()
+        except Exception as e:
+            # 刷新失败时保留旧快照
+            app.logger.error(f'刷新药品提醒快照失败：{str(e)}')
+        finally:
+            db.session.remove()
+
+
+def init_alerts(app, scheduler):
+    """注册每天零点的刷新任务，并在药品、药箱写入提交后立即安排一次刷新"""
+    scheduler.add_job(_refresh_job, 'cron', hour=0, minute=0, args=[app],
+                      id='refresh_alerts_daily', replace_existing=True)
+
+    def on_commit(changes):
+        if not _WATCHED_TABLES & set(changes):
+            return
+        if not scheduler.running:
+            # 调度器未启动（如 SCHEDULER_ENABLED=false）时任务不会执行，改为下次读取时重新计算
+            snapshot.invalidate()
+            return
+        # 刷新任务执行中时只做标记，由该任务继续刷新，连续写入合并处理
+        if snapshot.request_refresh():
+            # 上一个任务可能刚退出循环、尚未结束，允许两个实例同时存在，避免本次被跳过
+            scheduler.add_job(_refresh_job, 'date', args=[app], kwargs={'on_write': True},
+                              id='refresh_alerts_now', replace_existing=True, max_instances=2)
+
+    table_versions.subscribe(on_commit)
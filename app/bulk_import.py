@@ -0,0 +1,335 @@
+import abc
+import csv
+import datetime
+import io
+import json
+
+from . import db
+from .models import Manufacture, Medicine, MedicineCabinet, Member, OTC, Prescription, PrescriptionMedicine
+from .stock import create_consumptions, record_movements
+
+# 错误明细最多返回的条数，避免错误很多时响应过大
+MAX_REPORTED_ERRORS = 1000
+
+
+class RowError(ValueError):
+    """单行数据校验失败"""
+
+
+def read_rows(stream, data_format):
+    """从请求体流式读取行，逐行产出 (行号, dict)；支持 csv 与 ndjson"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if data_format == 'csv':
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            # 行号从 2 开始（第 1 行为表头）
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(text_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_num, RowError('不是有效的 JSON')
+                continue
+            if not isinstance(row, dict):
+                yield line_num, RowError('每行必须是 JSON 对象')
+                continue
+            yield line_num, row
+
+
+def _text(row, field, required=False):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'字段 {field} 不能为空')
+    return value or None
+
+
+def _date(row, field):
+    value = _text(row, field)
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise RowError(f'{field} 日期格式不正确')
+
+
+def _number(row, field, cast, default=None):
+    value = _text(row, field)
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise RowError(f'{field} 必须是数字')
+
+
+class BulkImporter(abc.ABC):
+    """按批次 executemany 写入，校验所需的参考数据在导入开始时一次性加载
+
+    子类须实现 prepare（校验一行并转换为待写入的数据）与 write（写入一批数据），未实现时无法创建导入器。
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.updated = 0
+        self.manufactures_created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line_num, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_num, 'error': message})
+
+    def run(self, rows):
+        batch = []
+        for line_num, row in rows:
+            if isinstance(row, RowError):
+                self.error(line_num, str(row))
+                continue
+            try:
+                batch.append((line_num, self.prepare(row)))
+            except RowError as e:
+                self.error(line_num, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+        if batch:
+            self.flush(batch)
+        return self.report()
+
+    def flush(self, batch):
+        """写入一批数据并提交；整批写入失败时回滚到保存点逐行重试，只有出错的行报告错误，其余行照常写入"""
+        counts = (self.inserted, self.updated, self.manufactures_created)
+        failed = set()
+        try:
+            if self._write_in_savepoint([item for _, item in batch]) is not None:
+                for line_num, item in batch:
+                    error = self._write_in_savepoint([item])
+                    if error is not None:
+                        failed.add(line_num)
+                        self.rollback_batch([item])
+                        self.error(line_num, f'写入数据库失败：{str(error)}')
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.inserted, self.updated, self.manufactures_created = counts
+            remaining = [(line_num, item) for line_num, item in batch if line_num not in failed]
+            self.rollback_batch([item for _, item in remaining])
+            for line_num, _ in remaining:
+                self.error(line_num, f'写入数据库失败：{str(e)}')
+
+    def _write_in_savepoint(self, items):
+        """在保存点中写入，失败时只回滚到保存点（本事务中已写入的其他行保留）并返回异常，成功时返回 None"""
+        savepoint = db.session.begin_nested()
+        try:
+            self.write(items)
+            savepoint.commit()
+        except Exception as e:
+            savepoint.rollback()
+            return e
+        return None
+
+    def report(self):
+        return {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'manufactures_created': self.manufactures_created,
+            'error_count': self.error_count,
+            'errors': self.errors
+        }
+
+    @abc.abstractmethod
+    def prepare(self, row):
+        """校验一行数据并返回待写入的数据，校验失败时抛出 RowError"""
+
+    @abc.abstractmethod
+    def write(self, items):
+        """在当前事务中写入一批 prepare 返回的数据，由 flush 提交"""
+
+    def rollback_batch(self, items):
+        """批次写入失败时撤销对预加载集合的修改"""
+
+
+class MedicineImporter(BulkImporter):
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.existing_codes = {code for code, in db.session.query(Medicine.national_code)}
+        self.manufactures = {name for name, in db.session.query(Manufacture.manufacture_name)}
+        self.prescriptions = {pid for pid, in db.session.query(Prescription.prescription_id)}
+        self.cabinets = {cabinet_id for cabinet_id, in db.session.query(MedicineCabinet.cabinet_id)}
+
+    def prepare(self, row):
+        national_code = _text(row, 'national_code', required=True)
+        name = _text(row, 'name', required=True)
+        medicine_type = _text(row, 'medicine_type')
+        if medicine_type not in ['OTC', 'Prescription']:
+            raise RowError('无效的药品类型！必须是 OTC 或 Prescription')
+        if national_code in self.existing_codes:
+            raise RowError(f'药品编码 {national_code} 已存在')
+
+        new_manufacture = None
+        manufacture_name = _text(row, 'manufacture_name')
+        if manufacture_name and manufacture_name not in self.manufactures:
+            address = _text(row, 'manufacture_address')
+            if not address:
+                raise RowError(f'生产厂家 "{manufacture_name}" 不存在于系统中，请填写厂家地址！')
+            new_manufacture = {'manufacture_name': manufacture_name, 'address': address}
+
+        prescription_id = None
+        if medicine_type == 'Prescription':
+            prescription_id = _text(row, 'prescription_id', required=True)
+            if prescription_id not in self.prescriptions:
+                raise RowError(f'处方ID "{prescription_id}" 不存在！')
+
+        cabinet_id = _number(row, 'cabinet_id', int)
+        if cabinet_id is not None and cabinet_id not in self.cabinets:
+            raise RowError(f'药箱 {cabinet_id} 不存在')
+
+        remaining_quantity = _number(row, 'remaining_quantity', int, 0)
+        if remaining_quantity < 0:
+            raise RowError('remaining_quantity 不能为负数')
+        manufacture_date = _date(row, 'manufacture_date')
+        expiry_date = _date(row, 'expiry_date')
+        price = _number(row, 'price', float, 0.0)
+
+        # 校验全部通过后再登记，同一厂家在整个导入过程中只创建一次
+        self.existing_codes.add(national_code)
+        if new_manufacture:
+            self.manufactures.add(manufacture_name)
+
+        return {
+            'manufacture': new_manufacture,
+            'medicine': {
+                'national_code': national_code,
+                'name': name,
+                'manufacture_name': manufacture_name,
+                'manufacture_date': manufacture_date,
+                'expiry_date': expiry_date,
+                'remaining_quantity': remaining_quantity,
+                'price': price,
+                'cabinet_id': cabinet_id,
+                'prescription_id': None
+            },
+            'otc': {
+                'national_code': national_code,
+                'direction': _text(row, 'direction') or '',
+                'manufacture_date': manufacture_date
+            } if medicine_type == 'OTC' else None,
+            'prescription_medicine': {
+                'national_code': national_code,
+                'prescription_id': prescription_id,
+                'manufacture_date': manufacture_date
+            } if medicine_type == 'Prescription' else None
+        }
+
+    def write(self, items):
+        manufactures = [item['manufacture'] for item in items if item['manufacture']]
+        otc_rows = [item['otc'] for item in items if item['otc']]
+        prescription_rows = [item['prescription_medicine'] for item in items if item['prescription_medicine']]
+        if manufactures:
+            db.session.execute(Manufacture.__table__.insert(), manufactures)
+        db.session.execute(Medicine.__table__.insert(), [item['medicine'] for item in items])
+        now = datetime.datetime.now()
+        create_consumptions([item['medicine']['national_code'] for item in items], now)
+        record_movements([{
+            'national_code': item['medicine']['national_code'],
+            'movement_type': 'add',
+            'quantity_change': item['medicine']['remaining_quantity'],
+            'quantity_after': item['medicine']['remaining_quantity'],
+            'created_at': now
+        } for item in items if item['medicine']['remaining_quantity']])
+        if otc_rows:
+            db.session.execute(OTC.__table__.insert(), otc_rows)
+        if prescription_rows:
+            db.session.execute(PrescriptionMedicine.__table__.insert(), prescription_rows)
+        self.inserted += len(items)
+        self.manufactures_created += len(manufactures)
+
+    def rollback_batch(self, items):
+        for item in items:
+            self.existing_codes.discard(item['medicine']['national_code'])
+            if item['manufacture']:
+                self.manufactures.discard(item['manufacture']['manufacture_name'])
+
+
+class ManufactureImporter(BulkImporter):
+    """生产厂家导入：新厂家插入，已有厂家更新地址"""
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.existing = {name for name, in db.session.query(Manufacture.manufacture_name)}
+        self.seen = set()
+
+    def prepare(self, row):
+        manufacture_name = _text(row, 'manufacture_name', required=True)
+        if manufacture_name in self.seen:
+            raise RowError(f'生产厂家 "{manufacture_name}" 在导入文件中重复')
+        self.seen.add(manufacture_name)
+        return {'manufacture_name': manufacture_name, 'address': _text(row, 'address') or ''}
+
+    def write(self, items):
+        new_rows = [item for item in items if item['manufacture_name'] not in self.existing]
+        update_rows = [{'b_name': item['manufacture_name'], 'b_address': item['address']}
+                       for item in items if item['manufacture_name'] in self.existing]
+        if new_rows:
+            db.session.execute(Manufacture.__table__.insert(), new_rows)
+        if update_rows:
+            table = Manufacture.__table__
+            db.session.execute(
+                table.update().where(table.c.manufacture_name == db.bindparam('b_name'))
+                .values(address=db.bindparam('b_address')),
+                update_rows
+            )
+        self.inserted += len(new_rows)
+        self.manufactures_created += len(new_rows)
+        self.updated += len(update_rows)
+        self.existing.update(item['manufacture_name'] for item in new_rows)
+
+
+class MemberImporter(BulkImporter):
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.existing_ids = {security_id for security_id, in db.session.query(Member.security_id)}
+
+    def prepare(self, row):
+        security_id = _text(row, 'security_id', required=True)
+        if security_id in self.existing_ids:
+            raise RowError(f'成员 {security_id} 已存在')
+        gender = _text(row, 'gender')
+        if gender and len(gender) > 1:
+            raise RowError('gender 只能是一个字符')
+        item = {
+            'security_id': security_id,
+            'name': _text(row, 'name', required=True),
+            'gender': gender,
+            'age': _number(row, 'age', int),
+            'weight': _number(row, 'weight', float),
+            'height': _number(row, 'height', float),
+            'underlying_disease': _text(row, 'underlying_disease'),
+            'allergen': _text(row, 'allergen')
+        }
+        self.existing_ids.add(security_id)
+        return item
+
+    def write(self, items):
+        db.session.execute(Member.__table__.insert(), items)
+        self.inserted += len(items)
+
+    def rollback_batch(self, items):
+        for item in items:
+            self.existing_ids.discard(item['security_id'])
+
+
+IMPORTERS = {
+    'medicines': MedicineImporter,
+    'manufactures': ManufactureImporter,
+    'members': MemberImporter
+}
@@ -0,0 +1,348 @@
+import datetime
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import make_response, request
+from sqlalchemy import event, func, or_, select
+from sqlalchemy.orm import Session, object_mapper
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+
+from . import db
+from .models import TableChange
+
+# session.info 中记录本事务内被修改的表
+_PENDING_KEY = 'changed_tables'
+
+# 读取变更日志的最短间隔（秒）、日志保留时间（秒）
+CHANGE_POLL_SECONDS = 1.0
+CHANGE_RETENTION_SECONDS = 3600
+# 一个事务修改同一张表的主键超过该数量时只记录一条"修改范围未知"
+CHANGE_MAX_KEYS = 100
+# 较小的 ID 晚于较大的 ID 提交时，最多等待该秒数；ID 一次跳过超过 CHANGE_MAX_GAPS 个时按修改范围未知处理
+CHANGE_GAP_SECONDS = 60
+CHANGE_MAX_GAPS = 1000
+
+# 进程标识：ETag 与变更日志中区分各进程；fork 出的子进程重新生成
+_BOOT_ID = uuid.uuid4().hex
+
+
+def _new_boot_id():
+    global _BOOT_ID
+    _BOOT_ID = uuid.uuid4().hex
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_new_boot_id)
+
+
+def _encode_key(key):
+    return json.dumps(key, ensure_ascii=False, default=str)
+
+
+def _decode_key(value):
+    key = json.loads(value)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class TableVersions:
+    """按表名维护的进程内版本号，写入事务提交后递增，并通知订阅者（进程内的缓存与索引）
+
+    启用变更日志（配置 TABLE_CHANGE_LOG）时，写入事务在提交前把所修改的表与主键追加到 table_change 表，
+    只插入新行、不更新共享的行，写入事务之间不会因此互相等待。各进程读取版本号时每隔 poll_seconds 秒
+    最多读取一次其他进程追加的记录（sync），按记录中的主键通知订阅者并递增版本号：其他进程的写入最迟
+    poll_seconds 秒后反映到本进程的 ETag、缓存与索引，两次读取之间的版本号与 304 不执行 SQL。
+    """
+
+    def __init__(self):
+        self.shared = False
+        self.poll_seconds = CHANGE_POLL_SECONDS
+        self.retention_seconds = CHANGE_RETENTION_SECONDS
+        self._versions = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._last_id = None  # 已读取的最大记录 ID，None 表示尚未读取
+        self._gaps = {}  # 小于 _last_id 但尚未读到的 ID -> 发现时间（ID 顺序与提交顺序可能不同）
+        self._polled_at = None
+
+    def get(self, table):
+        self.sync()
+        return self._versions.get(table, 0)
+
+    def token(self, tables):
+        self.sync()
+        return tuple(self._versions.get(t, 0) for t in tables)
+
+    def bump(self, changes):
+        """changes 为 {表名: 主键集合或 None}，None 表示修改范围未知"""
+        if not changes:
+            return
+        with self._lock:
+            for table in changes:
+                self._versions[table] = self._versions.get(table, 0) + 1
+        for listener in list(self._listeners):
+            listener(changes)
+
+    def subscribe(self, listener):
+        """注册提交后的回调 listener(changes)"""
+        self._listeners.append(listener)
+        return listener
+
+    def sync(self, force=False):
+        """读取其他进程追加的变更记录（距上次读取不足 poll_seconds 秒时跳过，force 为 True 时立即读取）"""
+        if not self.shared:
+            return
+        now = time.monotonic()
+        if not force and self._polled_at is not None and now - self._polled_at < self.poll_seconds:
+            return
+        # 同一时间只由一个线程读取，其他线程沿用当前版本号
+        if not self._poll_lock.acquire(blocking=force):
+            return
+        try:
+            changes = self._poll(now)
+        finally:
+            self._poll_lock.release()
+        self.bump(changes)
+
+    def reset(self):
+        """丢弃读取位置（变更日志被清空或重建后使用），下一次读取从当时的最大 ID 开始"""
+        with self._poll_lock:
+            self._last_id = None
+            self._gaps.clear()
+            self._polled_at = None
+
+    def _poll(self, now):
+        table = TableChange.__table__
+        with db.engine.connect() as connection:
+            # 执行选项 table_change_poll 标记这些查询，供统计 SQL 条数时区分
+            conn = connection.execution_options(table_change_poll=True)
+            if self._last_id is None:
+                # 第一次读取：此前的写入已在数据库中，本进程的缓存与索引加载时会读到
+                self._last_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+                self._polled_at = now
+                return {}
+            condition = table.c.id > self._last_id
+            if self._gaps:
+                condition = or_(condition, table.c.id.in_(list(self._gaps)))
+            rows = conn.execute(select(table.c.id, table.c.table_name, table.c.primary_key, table.c.origin)
+                                .where(condition).order_by(table.c.id)).all()
+
+        changes = {}
+        if now - self._polled_at > self.retention_seconds / 2:
+            # 长时间没有读取，期间的记录可能已被清理
+            changes = {t.name: None for t in db.metadata.sorted_tables}
+        for change_id, table_name, key, origin in rows:
+            self._gaps.pop(change_id, None)
+            if change_id > self._last_id:
+                if change_id - self._last_id - 1 > CHANGE_MAX_GAPS:
+                    changes = {t.name: None for t in db.metadata.sorted_tables}
+                else:
+                    self._gaps.update(dict.fromkeys(range(self._last_id + 1, change_id), now))
+                self._last_id = change_id
+            # 本进程的写入在提交时已经通知
+            if origin == _BOOT_ID:
+                continue
+            if key is None:
+                changes[table_name] = None
+            elif changes.get(table_name, ()) is not None:
+                changes.setdefault(table_name, set()).add(_decode_key(key))
+        for change_id, noticed in list(self._gaps.items()):
+            # 回滚的插入与数据库预分配的 ID 留下的空缺不会再出现
+            if now - noticed > CHANGE_GAP_SECONDS:
+                del self._gaps[change_id]
+        self._polled_at = now
+        return changes
+
+
+table_versions = TableVersions()
+
+
+def log_changes(connection, changes, origin=None):
+    """把 {表名: 主键集合或 None} 追加到变更日志"""
+    created_at = datetime.datetime.now()
+    origin = origin or _BOOT_ID
+    rows = []
+    for table_name, keys in sorted(changes.items()):
+        if keys is None or len(keys) > CHANGE_MAX_KEYS:
+            keys = [None]
+        rows.extend({'table_name': table_name, 'primary_key': None if key is None else _encode_key(key),
+                     'origin': origin, 'created_at': created_at} for key in keys)
+    connection.execute(TableChange.__table__.insert(), rows)
+
+
+def prune_changes(retention_seconds=CHANGE_RETENTION_SECONDS):
+    """删除超过保留时间的变更记录，始终保留最新的一条（避免 ID 被重用），返回删除的行数"""
+    table = TableChange.__table__
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=retention_seconds)
+    # 不经过会话：删除变更记录本身不需要登记为修改
+    with db.engine.begin() as conn:
+        last_id = conn.execute(select(func.max(table.c.id))).scalar()
+        if last_id is None:
+            return 0
+        return conn.execute(table.delete().where(table.c.created_at < cutoff, table.c.id < last_id)).rowcount
+
+
+class VersionedLRUCache:
+    """有容量上限的 LRU 缓存，条目按所依赖表的版本号失效"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key, tables, loader):
+        # 先取版本号再加载：加载期间若有写入提交，下次读取会因版本不一致而重新加载
+        token = table_versions.token(tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == token:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader()
+        with self._lock:
+            self._entries[key] = (token, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+reference_cache = VersionedLRUCache()
+
+
+def conditional_get(*models, bucket=None, version=None):
+    """根据所读取表的版本号为 GET 接口生成 ETag，If-None-Match 命中时直接返回 304，不执行查询
+
+    bucket 用于结果还依赖当前时间的接口：'day' 表示每天变化一次，整数表示每隔多少秒变化一次。
+    version 为返回额外版本号的函数，用于数据不直接来自数据库表的接口（如提醒快照）。
+    """
+    tables = [model.__tablename__ for model in models]
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # 版本号只在进程内有效，带上进程标识避免与重启前或其他进程的 ETag 冲突
+            parts = [_BOOT_ID, request.full_path, table_versions.token(tables)]
+            if version:
+                parts.append(version())
+            if bucket == 'day':
+                parts.append(datetime.date.today().isoformat())
+            elif bucket:
+                parts.append(int(time.time() // bucket))
+            etag = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:32]
+
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # 要求浏览器每次都带 ETag 重新验证
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def mark_changed(session, table, keys=None):
+    """登记本事务修改了某张表（用于原生 SQL、存储过程等无法自动识别的写入）"""
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    if keys is None or (table in pending and pending[table] is None):
+        pending[table] = None
+    else:
+        pending.setdefault(table, set()).update(keys)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        mapper = object_mapper(obj)
+        key = mapper.primary_key_from_instance(obj)
+        mark_changed(session, mapper.local_table.name, [key[0] if len(key) == 1 else tuple(key)])
+
+
+def _statement_keys(statement, table, parameters=None):
+    """DML 的条件只是"主键 = 值"或"主键 IN (...)"时返回这些主键，否则返回 None（修改范围未知）
+
+    主键写成 bindparam 时从执行参数中取值；executemany 时 parameters 为参数列表，每组参数对应一个主键。
+    """
+    where = getattr(statement, 'whereclause', None)
+    primary_key = list(table.primary_key.columns)
+    if len(primary_key) != 1 or not isinstance(where, BinaryExpression):
+        return None
+    column, value = where.left, where.right
+    if getattr(column, 'table', None) is None or column.table.name != table.name \
+            or column.name != primary_key[0].name:
+        return None
+    if not isinstance(value, BindParameter) or value.callable is not None:
+        return None
+    parameter_sets = parameters if isinstance(parameters, (list, tuple)) else [parameters or {}]
+    if parameter_sets and all(value.key in params for params in parameter_sets):
+        bound = [params[value.key] for params in parameter_sets]
+    elif value.value is not None and not any(value.key in params for params in parameter_sets):
+        bound = [value.value]
+    else:
+        return None
+    if where.operator is operators.eq:
+        return bound
+    if where.operator is operators.in_op:
+        return [key for values in bound for key in values]
+    return None
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_write(orm_execute_state):
+    # Query.update()/delete() 以及 session.execute(insert/update/delete) 不经过 flush
+    statement = orm_execute_state.statement
+    table = getattr(statement, 'table', None)
+    if getattr(statement, 'is_dml', False) and table is not None:
+        mark_changed(orm_execute_state.session, table.name,
+                     _statement_keys(statement, table, orm_execute_state.parameters))
+
+
+@event.listens_for(Session, 'before_commit')
+def _log_changes(session):
+    if not table_versions.shared:
+        return
+    # 先 flush，使尚未 flush 的修改也登记到本事务的修改中
+    session.flush()
+    pending = session.info.get(_PENDING_KEY)
+    if pending:
+        log_changes(session.connection(), pending)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_on_commit(session):
+    table_versions.bump(session.info.pop(_PENDING_KEY, None))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_app(app):
+    reference_cache.maxsize = app.config.get('REFERENCE_CACHE_SIZE', 256)
+    table_versions.shared = app.config.get('TABLE_CHANGE_LOG', True)
+    table_versions.poll_seconds = app.config.get('TABLE_CHANGE_POLL_SECONDS', CHANGE_POLL_SECONDS)
+    table_versions.retention_seconds = app.config.get('TABLE_CHANGE_RETENTION_SECONDS', CHANGE_RETENTION_SECONDS)
@@ -0,0 +1,90 @@
+import csv
+import datetime
+import io
+
+from sqlalchemy import select
+
+from . import db
+from .fastjson import dumps, format_datetime
+from .models import Manufacture, Medicine, MedicineAdministration, MedicineCabinet, Member, OTC, PrescriptionMedicine
+
+# 每次从服务端游标取出并输出的行数
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _medicines_statement():
+    return select(
+        Medicine.national_code,
+        Medicine.name,
+        Medicine.medicine_type_expression().label('medicine_type'),
+        Medicine.cabinet_id,
+        MedicineCabinet.location.label('cabinet_location'),
+        Medicine.manufacture_name,
+        Manufacture.address.label('manufacture_address'),
+        Medicine.manufacture_date,
+        Medicine.expiry_date,
+        Medicine.remaining_quantity,
+        Medicine.price
+    ).select_from(Medicine) \
+        .outerjoin(OTC, OTC.national_code == Medicine.national_code) \
+        .outerjoin(PrescriptionMedicine, PrescriptionMedicine.national_code == Medicine.national_code) \
+        .outerjoin(MedicineCabinet, MedicineCabinet.cabinet_id == Medicine.cabinet_id) \
+        .outerjoin(Manufacture, Manufacture.manufacture_name == Medicine.manufacture_name) \
+        .order_by(Medicine.national_code)
+
+
+def _administrations_statement():
+    return select(
+        MedicineAdministration.security_id,
+        Member.name.label('member_name'),
+        MedicineAdministration.national_code,
+        Medicine.name.label('medicine_name'),
+        MedicineAdministration.dosage,
+        MedicineAdministration.start_time,
+        MedicineAdministration.lasting_time,
+        MedicineAdministration.end_time,
+        MedicineAdministration.manufacture_date
+    ).select_from(MedicineAdministration) \
+        .outerjoin(Member, Member.security_id == MedicineAdministration.security_id) \
+        .outerjoin(Medicine, Medicine.national_code == MedicineAdministration.national_code) \
+        .order_by(MedicineAdministration.security_id, MedicineAdministration.start_time)
+
+
+EXPORTS = {
+    'medicines': _medicines_statement,
+    'administrations': _administrations_statement
+}
+
+
+def _format_value(value):
+    if isinstance(value, datetime.datetime):
+        return format_datetime(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def stream_export(name, data_format):
+    """使用服务端游标分块读取并逐块输出，内存占用与导出行数无关"""
+    statement = EXPORTS[name]().execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+    result = db.session.execute(statement)
+    try:
+        columns = list(result.keys())
+        if data_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for rows in result.partitions(EXPORT_CHUNK_SIZE):
+                for row in rows:
+                    writer.writerow(['' if value is None else _format_value(value) for value in row])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            # 只有表头时也要输出
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for rows in result.partitions(EXPORT_CHUNK_SIZE):
+                yield b''.join(dumps(dict(zip(columns, map(_format_value, row)))) + b'\n' for row in rows)
+    finally:
+        result.close()
@@ -0,0 +1,314 @@
+import bisect
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from flask import current_app
+
+from . import db
+from .alerts import LOW_STOCK_THRESHOLD
+from .cache import table_versions
+from .models import Medicine, MedicineCabinet, MedicineConsumption, OTC, PrescriptionMedicine
+
+# 这些表以药品编码为主键，写入提交后只重新加载对应的药品
+_MEDICINE_TABLES = {Medicine.__tablename__, OTC.__tablename__, PrescriptionMedicine.__tablename__,
+                    MedicineConsumption.__tablename__}
+RELOAD_BATCH_SIZE = 500
+# 估算每项内存时抽样的药品数
+MEMORY_SAMPLE_SIZE = 1000
+
+
+class MedicineRecord:
+    """读模型中的一种药品：只保存接口需要的列，已连接类型与消耗统计；重复的名称、日期等共享同一个对象
+
+    记录创建后不再修改，药品变化时整条替换，读取方拿到的记录不会在输出过程中改变。
+    """
+    __slots__ = ('national_code', 'name', 'manufacture_name', 'manufacture_date', 'remaining_quantity',
+                 'expiry_date', 'price', 'cabinet_id', 'low_stock_threshold', 'version', 'medicine_type',
+                 'decayed_quantity', 'first_at', 'updated_at')
+
+
+class CabinetRecord:
+    __slots__ = ('cabinet_id', 'location', 'low_stock_threshold')
+
+
+# 与 MedicineRecord.__slots__ 一一对应的查询列
+_COLUMNS = (Medicine.national_code, Medicine.name, Medicine.manufacture_name, Medicine.manufacture_date,
+            Medicine.remaining_quantity, Medicine.expiry_date, Medicine.price, Medicine.cabinet_id,
+            Medicine.low_stock_threshold, Medicine.version, Medicine.medicine_type_expression().label('medicine_type'),
+            MedicineConsumption.decayed_quantity, MedicineConsumption.first_at, MedicineConsumption.updated_at)
+# 取值重复较多、需要共享的字段
+_SHARED_SLOTS = ('name', 'manufacture_name', 'manufacture_date', 'expiry_date', 'medicine_type')
+
+
+def enabled():
+    return current_app.config.get('INVENTORY_READ_MODEL', False)
+
+
+class InventoryReadModel:
+    """药品库存的进程内读模型：药品连同类型、消耗统计，药箱位置与阈值按药箱共享
+
+    启用时在启动阶段整表建立（见 init_inventory），失败或整表失效时在下一次读取时重建；之后药品、OTC、处方药品、消耗统计的写入提交后只记录被修改的药品编码，
+    下一次读取前用 IN 查询重新加载这些药品；药箱变化时重新加载药箱表（很小）。
+    另外维护按编码、按有效期排序的列表与库存不足集合，列表、有效期与库存不足查询都不访问数据库。
+    其他进程的写入经变更日志同样按药品编码通知（见 app/cache.py），修改范围未知时整表重建。
+    """
+
+    def __init__(self):
+        self._records = {}  # 药品编码 -> MedicineRecord
+        self._codes = []  # 药品编码，有序
+        self._expiry = []  # (有效期, 药品编码)，有序，不含没有有效期的药品
+        self._low_stock = set()  # 库存不足的药品编码
+        self._cabinets = {}  # 药箱ID -> CabinetRecord
+        self._shared = {}  # 共享的字符串、日期
+        self._default_threshold = None
+        self._pending = set()
+        self._stale = True
+        self._cabinets_stale = False
+        self._lock = threading.Lock()
+        self.build_seconds = None
+        self.reloaded = 0
+
+    # ---- 增量维护 ----
+
+    def on_commit(self, changes):
+        with self._lock:
+            if self._stale:
+                return
+            for table in _MEDICINE_TABLES & set(changes):
+                keys = changes[table]
+                if keys is None:
+                    self._stale = True
+                    return
+                self._pending.update(keys)
+            if MedicineCabinet.__tablename__ in changes:
+                self._cabinets_stale = True
+
+    def _sync(self):
+        # 调用方持有 self._lock
+        default_threshold = current_app.config.get('LOW_STOCK_THRESHOLD', LOW_STOCK_THRESHOLD)
+        if self._stale:
+            self._pending.clear()
+            self._cabinets_stale = False
+            self._default_threshold = default_threshold
+            self._build()
+            # 建立成功后才清除标记，建立中途出错时下一次读取重新建立
+            self._stale = False
+            return
+        recompute = False
+        if self._cabinets_stale:
+            self._cabinets_stale = False
+            self._load_cabinets()
+            recompute = True
+        if default_threshold != self._default_threshold:
+            self._default_threshold = default_threshold
+            recompute = True
+        if self._pending:
+            keys, self._pending = list(self._pending), set()
+            self._reload(keys)
+        if recompute:
+            # 药箱阈值或全局阈值变化会影响所有药品
+            self._low_stock = {code for code, record in self._records.items() if self._is_low(record)}
+
+    def _query(self):
+        return db.session.query(*_COLUMNS) \
+            .outerjoin(OTC, OTC.national_code == Medicine.national_code) \
+            .outerjoin(PrescriptionMedicine, PrescriptionMedicine.national_code == Medicine.national_code) \
+            .outerjoin(MedicineConsumption, MedicineConsumption.national_code == Medicine.national_code)
+
+    def _load_cabinets(self):
+        cabinets = {}
+        for cabinet_id, location, low_stock_threshold in db.session.query(
+                MedicineCabinet.cabinet_id, MedicineCabinet.location, MedicineCabinet.low_stock_threshold):
+            cabinet = cabinets[cabinet_id] = CabinetRecord()
+            cabinet.cabinet_id, cabinet.location, cabinet.low_stock_threshold = cabinet_id, location, low_stock_threshold
+        self._cabinets = cabinets
+
+    def _build(self):
+        started = time.perf_counter()
+        self._shared = {}
+        self._load_cabinets()
+        records = {}
+        for row in self._query():
+            record = self._record(row)
+            records[record.national_code] = record
+        self._records = records
+        self._codes = sorted(records)
+        self._expiry = sorted((record.expiry_date, code) for code, record in records.items()
+                              if record.expiry_date is not None)
+        self._low_stock = {code for code, record in records.items() if self._is_low(record)}
+        self.build_seconds = time.perf_counter() - started
+
+    def _reload(self, keys):
+        for key in keys:
+            self._remove(key)
+        for start in range(0, len(keys), RELOAD_BATCH_SIZE):
+            for row in self._query().filter(Medicine.national_code.in_(keys[start:start + RELOAD_BATCH_SIZE])):
+                self._add(self._record(row))
+        self.reloaded += len(keys)
+
+    def _record(self, row):
+        record = MedicineRecord()
+        shared = self._shared
+        for slot, value in zip(MedicineRecord.__slots__, row):
+            if value is not None and slot in _SHARED_SLOTS:
+                value = shared.setdefault(value, value)
+            setattr(record, slot, value)
+        return record
+
+    def _add(self, record):
+        code = record.national_code
+        self._records[code] = record
+        bisect.insort(self._codes, code)
+        if record.expiry_date is not None:
+            bisect.insort(self._expiry, (record.expiry_date, code))
+        if self._is_low(record):
+            self._low_stock.add(code)
+
+    def _remove(self, code):
+        record = self._records.pop(code, None)
+        if record is None:
+            return
+        del self._codes[bisect.bisect_left(self._codes, code)]
+        if record.expiry_date is not None:
+            del self._expiry[bisect.bisect_left(self._expiry, (record.expiry_date, code))]
+        self._low_stock.discard(code)
+
+    def _threshold(self, record):
+        # 与 alerts.low_stock_threshold_expression 相同：药品 > 所在药箱 > 全局默认值
+        if record.low_stock_threshold is not None:
+            return record.low_stock_threshold
+        cabinet = self._cabinets.get(record.cabinet_id)
+        if cabinet is not None and cabinet.low_stock_threshold is not None:
+            return cabinet.low_stock_threshold
+        return self._default_threshold
+
+    def _is_low(self, record):
+        remaining_quantity = record.remaining_quantity
+        return remaining_quantity is not None and 0 < remaining_quantity < self._threshold(record)
+
+    # ---- 查询 ----
+
+    def location(self, cabinet_id):
+        cabinet = self._cabinets.get(cabinet_id)
+        return cabinet.location if cabinet is not None else None
+
+    def build(self):
+        """立即整表建立，第一个请求不再承担建立耗时"""
+        table_versions.sync()
+        with self._lock:
+            self._stale = True
+            self._sync()
+
+    def medicines(self, name_prefix=None, cabinet_id=None, medicine_type=None, min_quantity=None, max_quantity=None):
+        """按编码顺序返回药品记录；筛选条件与 /api/medicines 相同（名称前缀不区分大小写，与 SQL 的 LIKE 一致）"""
+        table_versions.sync()
+        with self._lock:
+            self._sync()
+            records = [self._records[code] for code in self._codes]
+        if name_prefix:
+            name_prefix = name_prefix.lower()
+            records = [r for r in records if r.name is not None and r.name.lower().startswith(name_prefix)]
+        if cabinet_id is not None:
+            records = [r for r in records if r.cabinet_id == cabinet_id]
+        if medicine_type:
+            records = [r for r in records if r.medicine_type == medicine_type]
+        if min_quantity is not None:
+            records = [r for r in records if r.remaining_quantity is not None and r.remaining_quantity >= min_quantity]
+        if max_quantity is not None:
+            records = [r for r in records if r.remaining_quantity is not None and r.remaining_quantity <= max_quantity]
+        return records
+
+    def medicine_view(self, national_code, default_threshold):
+        """单个药品的详情：记录各字段加上药箱位置（location）与生效的库存提醒阈值，药品不存在时返回 None"""
+        table_versions.sync()
+        with self._lock:
+            self._sync()
+            record = self._records.get(national_code)
+            if record is None:
+                return None
+            cabinet = self._cabinets.get(record.cabinet_id)
+        view = SimpleNamespace(**{slot: getattr(record, slot) for slot in MedicineRecord.__slots__})
+        view.location = cabinet.location if cabinet is not None else None
+        view.effective_low_stock_threshold = next(
+            (value for value in (record.low_stock_threshold, cabinet.low_stock_threshold if cabinet else None)
+             if value is not None), default_threshold)
+        return view
+
+    def low_stock(self, limit=None):
+        """库存不足的药品，按剩余数量、编码排序，行格式与 alerts.low_stock_query 相同"""
+        table_versions.sync()
+        with self._lock:
+            self._sync()
+            records = sorted((self._records[code] for code in self._low_stock),
+                             key=lambda r: (r.remaining_quantity, r.national_code))
+            if limit is not None:
+                records = records[:limit]
+            return [(r.national_code, r.name, r.remaining_quantity, self._threshold(r), self.location(r.cabinet_id))
+                    for r in records]
+
+    def expiring(self, start=None, end=None):
+        """有效期在 [start, end) 内且仍有库存的药品记录，按有效期排序；start 为空表示不限"""
+        table_versions.sync()
+        with self._lock:
+            self._sync()
+            low = bisect.bisect_left(self._expiry, (start,)) if start is not None else 0
+            high = bisect.bisect_left(self._expiry, (end,))
+            records = [self._records[code] for _, code in self._expiry[low:high]]
+        return [r for r in records if r.remaining_quantity is not None and r.remaining_quantity > 0]
+
+    # ---- 统计 ----
+
+    def _value_bytes(self, record):
+        size = sys.getsizeof(record)
+        for slot in MedicineRecord.__slots__:
+            value = getattr(record, slot)
+            # None、布尔值、小整数与共享对象不计入单个药品
+            if value is None or isinstance(value, bool) or (isinstance(value, int) and -5 <= value <= 256):
+                continue
+            if slot in _SHARED_SLOTS and self._shared.get(value) is value:
+                continue
+            size += sys.getsizeof(value)
+        return size
+
+    def stats(self):
+        """药品数与每项内存估算（字节）：记录本身、所有索引结构及共享对象分摊到每项"""
+        with self._lock:
+            count = len(self._records)
+            sample = [self._records[code] for code in self._codes[::max(count // MEMORY_SAMPLE_SIZE, 1)]]
+            record_bytes = sum(self._value_bytes(r) for r in sample) / len(sample) if sample else 0
+            index_bytes = sys.getsizeof(self._records) + sys.getsizeof(self._codes) + sys.getsizeof(self._expiry) \
+                + sum(sys.getsizeof(entry) for entry in self._expiry) + sys.getsizeof(self._low_stock)
+            shared_bytes = sys.getsizeof(self._shared) + sum(sys.getsizeof(value) for value in self._shared)
+            index_bytes = index_bytes / count if count else 0
+            shared_bytes = shared_bytes / count if count else 0
+            return {
+                'built': self.build_seconds is not None,
+                'medicines': count,
+                'cabinets': len(self._cabinets),
+                'low_stock': len(self._low_stock),
+                'pending': len(self._pending),
+                'reloaded': self.reloaded,
+                'build_seconds': round(self.build_seconds, 3) if self.build_seconds is not None else None,
+                'bytes_per_item': {
+                    'record': round(record_bytes, 1),
+                    'indexes': round(index_bytes, 1),
+                    'shared': round(shared_bytes, 1),
+                    'total': round(record_bytes + index_bytes + shared_bytes, 1)
+                }
+            }
+
+
+read_model = InventoryReadModel()
+
+
+def init_inventory(app):
+    table_versions.subscribe(read_model.on_commit)
+    if app.config.get('INVENTORY_READ_MODEL', False):
+        try:
+            read_model.build()
+        except Exception as e:
+            # 数据库尚未建表或尚未升级（如执行 init-db、upgrade-db 命令时），留到第一次读取时建立
+            db.session.rollback()
+            app.logger.warning(f'启动时建立药品库存读模型失败，将在第一次读取时建立：{str(e)}')
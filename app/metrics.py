@@ -0,0 +1,169 @@
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 请求耗时直方图的桶上限（秒）与单个请求 SQL 条数直方图的桶上限
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# 去掉语句中的字面量，得到"语句形状"（ORM 生成的语句本身已参数化，主要针对原生 SQL）
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    return _WHITESPACE.sub(' ', _LITERALS.sub('?', statement)).strip()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+
+class EndpointMetrics:
+    """按蓝图端点汇总的请求耗时、SQL 条数与耗时"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency = {}
+            self.statements = {}
+            self.requests = Counter()
+            self.sql_count = Counter()
+            self.sql_seconds = Counter()
+            self.n_plus_one = Counter()
+
+    def record(self, endpoint, method, status, seconds, sql_count, sql_seconds, n_plus_one):
+        key = (endpoint, method)
+        with self._lock:
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.statements.setdefault(key, Histogram(STATEMENT_BUCKETS)).observe(sql_count)
+            self.requests[(endpoint, method, status)] += 1
+            self.sql_count[key] += sql_count
+            self.sql_seconds[key] += sql_seconds
+            if n_plus_one:
+                self.n_plus_one[key] += 1
+
+    def render(self):
+        """按 Prometheus 文本格式输出"""
+        lines = []
+        with self._lock:
+            lines.append('# HELP http_requests_total Total HTTP requests by endpoint, method and status.')
+            lines.append('# TYPE http_requests_total counter')
+            for (endpoint, method, status), value in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {value}')
+
+            _render_histogram(lines, 'http_request_duration_seconds', 'Request latency in seconds.', self.latency)
+            _render_histogram(lines, 'db_statements_per_request', 'SQL statements executed per request.', self.statements)
+
+            lines.append('# HELP db_statements_total SQL statements executed while handling requests.')
+            lines.append('# TYPE db_statements_total counter')
+            for (endpoint, method), value in sorted(self.sql_count.items()):
+                lines.append(f'db_statements_total{_labels(endpoint=endpoint, method=method)} {value}')
+
+            lines.append('# HELP db_statement_seconds_total Time spent executing SQL while handling requests.')
+            lines.append('# TYPE db_statement_seconds_total counter')
+            for (endpoint, method), value in sorted(self.sql_seconds.items()):
+                lines.append(f'db_statement_seconds_total{_labels(endpoint=endpoint, method=method)} {value:.6f}')
+
+            lines.append('# HELP db_repeated_statement_requests_total Requests that repeated one statement shape above the threshold.')
+            lines.append('# TYPE db_repeated_statement_requests_total counter')
+            for (endpoint, method), value in sorted(self.n_plus_one.items()):
+                lines.append(f'db_repeated_statement_requests_total{_labels(endpoint=endpoint, method=method)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _render_histogram(lines, name, help_text, histograms):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for (endpoint, method), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(endpoint=endpoint, method=method, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(endpoint=endpoint, method=method, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(endpoint=endpoint, method=method)} {histogram.total:.6f}')
+        lines.append(f'{name}_count{_labels(endpoint=endpoint, method=method)} {histogram.count}')
+
+
+endpoint_metrics = EndpointMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'sql_shapes' in g:
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_start', None)
+    if start is None or not has_request_context() or 'sql_shapes' not in g:
+        return
+    g.sql_seconds += time.perf_counter() - start
+    g.sql_shapes[statement_shape(statement)] += 1
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.sql_shapes = Counter()
+    g.sql_seconds = 0.0
+
+
+def _remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+def _finish_request(exception):
+    # 在 teardown 中记录，流式响应会在输出结束后才计入
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    seconds = time.perf_counter() - start
+    shapes = g.pop('sql_shapes')
+    status = 500 if exception is not None else g.get('response_status', 500)
+    endpoint = request.endpoint or 'unmatched'
+
+    threshold = current_app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+    repeated = [(shape, count) for shape, count in shapes.items() if count > threshold]
+    for shape, count in repeated:
+        current_app.logger.warning(f'疑似 N+1 查询：{endpoint} 单次请求执行同一语句 {count} 次：{shape[:300]}')
+
+    endpoint_metrics.record(endpoint, request.method, status, seconds,
+                            sum(shapes.values()), g.sql_seconds, bool(repeated))
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_remember_status)
+    app.teardown_request(_finish_request)
@@ -1,5 +1,40 @@
+import datetime
+from sqlalchemy import and_, case, event, or_
 from app import db
 
+# 长期用药的持续时间写法
+LONG_TERM = '长期'
+
+
+def parse_lasting_days(lasting_time):
+    """解析 'N天' 形式的持续时间，返回天数；长期或无法解析时返回 None"""
+    if not lasting_time or lasting_time == LONG_TERM:
+        return None
+    try:
+        return int(lasting_time.replace('天', ''))
+    except (ValueError, AttributeError):
+        return None
+
+
+def compute_end_time(start_time, lasting_time):
+    """根据开始时间和持续时间计算结束时间，无法计算时返回 None
+
+    结束时间为 None 的记录是否正在进行见 MedicineAdministration.active_filter：长期用药与无法解析的持续时间
+    视为正在进行；未填写持续时间、或非长期用药但没有开始时间的记录既不是正在进行也不是已结束。
+    """
+    if not start_time or not lasting_time:
+        return None
+    days = parse_lasting_days(lasting_time)
+    if days is None:
+        return None
+    return start_time + datetime.timedelta(days=days)
+
+
+def has_open_end(start_time, lasting_time):
+    """结束时间为 None 时是否视为正在进行：长期用药，或有开始时间、持续时间无法解析（与 active_filter 相同）"""
+    return lasting_time == LONG_TERM or bool(start_time and lasting_time)
+
+
 class OTC(db.Model):
     __tablename__ = 'OTC'
     national_code = db.Column(db.String(256), db.ForeignKey('medicine.national_code'), primary_key=True)
@@ -17,6 +52,8 @@ class MedicineCabinet(db.Model):
     __tablename__ = 'medicine_cabinet'
     cabinet_id = db.Column(db.Integer, primary_key=True)
     location = db.Column(db.String(256))
+    # 药箱内药品的默认库存提醒阈值，为空时使用全局默认值
+    low_stock_threshold = db.Column(db.SmallInteger)
 
 
 class Medicine(db.Model):
@@ -28,8 +65,14 @@ class Medicine(db.Model):
     name = db.Column(db.String(256))
     manufacture_date = db.Column(db.Date)
     remaining_quantity = db.Column(db.SmallInteger)
-    expiry_date = db.Column(db.Date)  # 修正拼写错误：expiry_data -> expiry_date
+    expiry_date = db.Column(db.Date, index=True)  # 修正拼写错误：expiry_data -> expiry_date
     price = db.Column(db.Float)
+    # 库存提醒阈值，为空时使用药箱或全局默认值
+    low_stock_threshold = db.Column(db.SmallInteger)
+    # 乐观锁版本号：ORM 修改药品信息时校验并递增；库存数量由条件 UPDATE 修改，不参与版本校验
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     otc_info = db.relationship('OTC', uselist=False, backref='medicine')
     
@@ -48,6 +91,29 @@ class Medicine(db.Model):
         # 如果都不在，返回未知
         return 'Unknown'
 
+    @staticmethod
+    def medicine_type_expression():
+        """药品类型表达式：与OTC表、PrescriptionMedicine表外连接后由数据库直接判断类型"""
+        return case(
+            (OTC.national_code.isnot(None), 'OTC'),
+            (PrescriptionMedicine.national_code.isnot(None), '处方药'),
+            else_='Unknown'
+        )
+
+    @classmethod
+    def query_with_type(cls, *columns):
+        """一次查询同时取出药品及其类型（避免逐行查询OTC表和PrescriptionMedicine表）
+
+        返回的每一行为 (Medicine, medicine_type, *columns)
+        """
+        return cls.join_type(db.session.query(cls, cls.medicine_type_expression().label('medicine_type'), *columns))
+
+    @staticmethod
+    def join_type(query):
+        """外连接OTC表和PrescriptionMedicine表，供 medicine_type_expression 与按类型筛选使用"""
+        return query.outerjoin(OTC, OTC.national_code == Medicine.national_code) \
+            .outerjoin(PrescriptionMedicine, PrescriptionMedicine.national_code == Medicine.national_code)
+
 
 class Member(db.Model):
     __tablename__ = 'member'  # 修正表名拼写错误
@@ -69,6 +135,38 @@ class MedicineAdministration(db.Model):
     start_time = db.Column(db.DateTime)
     lasting_time = db.Column(db.String(256))
     manufacture_date = db.Column(db.Date)  # 添加manufacture_date字段
+    end_time = db.Column(db.DateTime, index=True)  # 由 start_time + lasting_time 计算，NULL 表示无法计算（见 active_filter）
+
+    @classmethod
+    def active_filter(cls, current_time):
+        """正在进行的用药：结束时间未到，或没有结束时间且为长期用药（含开始时间已知、持续时间无法解析的记录）
+
+        未填写持续时间、或非长期用药但没有开始时间的记录不算正在进行（与原来逐条解析时相同）。
+        """
+        return or_(
+            cls.end_time >= current_time,
+            and_(cls.end_time.is_(None),
+                 or_(cls.lasting_time == LONG_TERM,
+                     and_(cls.start_time.isnot(None), cls.lasting_time.isnot(None), cls.lasting_time != '')))
+        )
+
+    @classmethod
+    def historical_filter(cls, current_time):
+        """已结束的用药"""
+        return cls.end_time < current_time
+
+    def is_active(self, current_time):
+        """与 active_filter 相同的判断，用于已加载的记录（也可用于包含 end_time、start_time、lasting_time 的结果行）"""
+        if self.end_time is not None:
+            return self.end_time >= current_time
+        return has_open_end(self.start_time, self.lasting_time)
+
+
+@event.listens_for(MedicineAdministration, 'before_insert')
+@event.listens_for(MedicineAdministration, 'before_update')
+def _fill_administration_end_time(mapper, connection, target):
+    # 写入时同步计算结束时间，查询时无需再解析 lasting_time
+    target.end_time = compute_end_time(target.start_time, target.lasting_time)
 
 
 class Prescription(db.Model):
@@ -86,6 +184,57 @@ class PrescriptionMedicine(db.Model):
     prescription_id = db.Column(db.String(256), db.ForeignKey('prescription.prescription_id'))
     manufacture_date = db.Column(db.Date)  # 添加manufacture_date字段
 
+class StockMovement(db.Model):
+    """库存变动流水（只追加）：每次新增、补充、出库、删除药品都记录一条"""
+    __tablename__ = 'stock_movement'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # 不设外键：药品删除后流水仍需保留
+    national_code = db.Column(db.String(256), nullable=False)
+    movement_type = db.Column(db.String(16), nullable=False)  # add / refill / remove / dispense / delete
+    quantity_change = db.Column(db.Integer, nullable=False)  # 入库为正，出库为负
+    quantity_after = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_stock_movement_code_time', 'national_code', 'created_at'),
+        db.Index('ix_stock_movement_created_at', 'created_at'),
+    )
+
+
+class MedicineConsumption(db.Model):
+    """按出库流水增量维护的消耗统计：出库数量按时间指数衰减累加"""
+    __tablename__ = 'medicine_consumption'
+    national_code = db.Column(db.String(256), primary_key=True)
+    decayed_quantity = db.Column(db.Float, nullable=False, default=0.0)  # 截至 updated_at 的衰减累计出库量
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+    first_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class SchedulerLease(db.Model):
+    """定时任务的领导者租约：持有未过期租约的进程执行只需运行一次的任务"""
+    __tablename__ = 'scheduler_lease'
+    name = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(128), nullable=False)  # 主机名:进程号:随机串
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class TableChange(db.Model):
+    """变更日志（只追加）：写入事务提交前在同一事务中追加所修改的表与主键，其他进程据此使缓存与索引失效（见 app/cache.py）"""
+    __tablename__ = 'table_change'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    primary_key = db.Column(db.Text)  # JSON 编码的主键，为空表示修改范围未知
+    origin = db.Column(db.String(64), nullable=False)  # 写入进程的标识，进程读取时跳过自己的记录
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_table_change_created_at', 'created_at'),
+        # SQLite 删除末尾的行后不重用 ID
+        {'sqlite_autoincrement': True},
+    )
+
+
 class UserInfo(db.Model):
     __tablename__ = 'userinfo'
     username = db.Column(db.String(80), primary_key=True)
@@ -0,0 +1,200 @@
+import base64
+import datetime
+import heapq
+import json
+
+from sqlalchemy import and_, or_
+
+# 单页最大条数，防止一次请求拉取整张表
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class PaginationError(ValueError):
+    """分页/筛选参数不合法（路由中转换为 400 响应）"""
+
+
+def parse_limit(args):
+    """解析 limit 参数；未提供时返回 None，表示保持原来的整表返回"""
+    raw = args.get('limit')
+    if raw is None or raw == '':
+        return None
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise PaginationError('limit 必须是整数！')
+    if limit <= 0:
+        raise PaginationError('limit 必须大于0！')
+    return min(limit, MAX_LIMIT)
+
+
+def parse_int_arg(args, name):
+    raw = args.get(name)
+    if raw is None or raw == '':
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise PaginationError(f'{name} 必须是整数！')
+
+
+def parse_bool_arg(args, name, default=False):
+    raw = args.get(name)
+    if raw is None or raw == '':
+        return default
+    value = raw.lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    raise PaginationError(f'{name} 只能是 true 或 false！')
+
+
+def parse_date_arg(args, name):
+    """解析 YYYY-MM-DD 格式的日期参数"""
+    raw = args.get(name)
+    if raw is None or raw == '':
+        return None
+    try:
+        return datetime.datetime.strptime(raw, '%Y-%m-%d').date()
+    except ValueError:
+        raise PaginationError(f'{name} 日期格式不正确，应为 YYYY-MM-DD！')
+
+
+def parse_sort(args, sort_columns, default):
+    """解析 sort / order 参数，返回 (排序名, 排序列, 是否降序)"""
+    sort = args.get('sort') or default
+    if sort not in sort_columns:
+        raise PaginationError(f'不支持的排序字段：{sort}，可选：{", ".join(sort_columns)}')
+    order = (args.get('order') or 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise PaginationError('order 只能是 asc 或 desc！')
+    return sort, sort_columns[sort], order == 'desc'
+
+
+def _to_json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _from_json_value(value, column):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    if python_type is datetime.date:
+        return datetime.date.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(sort, sort_value, key_value):
+    payload = json.dumps([sort, _to_json_value(sort_value), _to_json_value(key_value)], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, sort, sort_column, key_column):
+    try:
+        cursor_sort, sort_value, key_value = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+        if cursor_sort != sort:
+            raise PaginationError('cursor 与当前排序字段不匹配！')
+        return _from_json_value(sort_value, sort_column), _from_json_value(key_value, key_column)
+    except PaginationError:
+        raise
+    except Exception:
+        raise PaginationError('无效的 cursor！')
+
+
+def _after(sort_column, key_column, sort_value, key_value, descending):
+    """构造"位于游标之后"的条件（MySQL/SQLite 中 NULL 升序排在最前、降序排在最后）"""
+    if sort_column is key_column:
+        return key_column < key_value if descending else key_column > key_value
+    if descending:
+        if sort_value is None:
+            return and_(sort_column.is_(None), key_column < key_value)
+        return or_(sort_column < sort_value, sort_column.is_(None),
+                   and_(sort_column == sort_value, key_column < key_value))
+    if sort_value is None:
+        return or_(sort_column.isnot(None), and_(sort_column.is_(None), key_column > key_value))
+    return or_(sort_column > sort_value, and_(sort_column == sort_value, key_column > key_value))
+
+
+def keyset_paginate(query, args, sort_columns, key_column, entity=None, default_sort=None):
+    """对查询按 (排序列, 主键) 做游标分页
+
+    entity(row) 从结果行中取出 ORM 对象（默认即结果行本身），用于读取排序值并生成下一页的游标。
+    返回 (rows, next_cursor, limit)；未提供 limit 时 rows 为全部结果，limit 为 None。
+    """
+    sort, sort_column, descending = parse_sort(args, sort_columns, default_sort or next(iter(sort_columns)))
+    limit = parse_limit(args)
+
+    cursor = args.get('cursor')
+    if cursor:
+        if limit is None:
+            limit = DEFAULT_LIMIT
+        sort_value, key_value = decode_cursor(cursor, sort, sort_column, key_column)
+        query = query.filter(_after(sort_column, key_column, sort_value, key_value, descending))
+
+    if sort_column is key_column:
+        ordering = [key_column.desc() if descending else key_column.asc()]
+    else:
+        ordering = [sort_column.desc(), key_column.desc()] if descending else [sort_column.asc(), key_column.asc()]
+    query = query.order_by(*ordering)
+
+    if limit is None:
+        return query.all(), None, None
+
+    # 多取一行用于判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = entity(rows[-1]) if entity else rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, sort_column.key), getattr(last, key_column.key))
+    return rows, next_cursor, limit
+
+
+def _sort_key(sort_column, key_column):
+    sort_attribute, key_attribute = sort_column.key, key_column.key
+    # 与 _after 一致：NULL 在升序中排在最前、降序中排在最后
+    return lambda item: (getattr(item, sort_attribute) is not None, getattr(item, sort_attribute),
+                         getattr(item, key_attribute))
+
+
+def paginate_items(items, args, sort_columns, key_column, default_sort=None):
+    """与 keyset_paginate 参数、游标格式和返回值相同，对内存中的对象分页（对象的属性名与列名相同）
+
+    提供 limit 时只用堆取出前 limit + 1 项，不对全部对象排序。
+    """
+    sort, sort_column, descending = parse_sort(args, sort_columns, default_sort or next(iter(sort_columns)))
+    limit = parse_limit(args)
+    sort_key = _sort_key(sort_column, key_column)
+
+    cursor = args.get('cursor')
+    if cursor:
+        if limit is None:
+            limit = DEFAULT_LIMIT
+        sort_value, key_value = decode_cursor(cursor, sort, sort_column, key_column)
+        position = (sort_value is not None, sort_value, key_value)
+        if descending:
+            items = [item for item in items if sort_key(item) < position]
+        else:
+            items = [item for item in items if sort_key(item) > position]
+
+    if limit is None:
+        return sorted(items, key=sort_key, reverse=descending), None, None
+
+    rows = (heapq.nlargest if descending else heapq.nsmallest)(limit + 1, items, key=sort_key)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, getattr(rows[-1], sort_column.key), getattr(rows[-1], key_column.key))
+    return rows, next_cursor, limit
+
+
+def page_response(items, next_cursor, limit):
+    """未分页时保持原来的数组格式；分页时返回 items 与 next_cursor"""
+    if limit is None:
+        return items
+    return {'items': items, 'next_cursor': next_cursor, 'limit': limit}
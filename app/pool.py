@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool, QueuePool
+
+# 保留最近若干次连接获取等待时间，用于计算分位数
+_RECENT_WAITS = 1000
+
+
+class PoolStats:
+    """连接池运行统计：由连接池事件和 InstrumentedQueuePool 更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.in_use = 0
+            self.peak_in_use = 0
+            self.invalidations = 0
+            self.soft_invalidations = 0
+            self.checkout_timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.waits = deque(maxlen=_RECENT_WAITS)
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            self.waits.append(seconds)
+            if timed_out:
+                self.checkout_timeouts += 1
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def record_checkin(self):
+        with self._lock:
+            self.checkins += 1
+            self.in_use = max(self.in_use - 1, 0)
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            waits = sorted(self.waits)
+            measured = len(waits)
+            data = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'invalidations': self.invalidations,
+                'soft_invalidations': self.soft_invalidations,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_wait_ms': {
+                    'measured': measured,
+                    'avg': round(self.wait_total / measured * 1000, 3) if measured else 0,
+                    'p50': round(waits[measured // 2] * 1000, 3) if measured else 0,
+                    'p99': round(waits[min(int(measured * 0.99), measured - 1)] * 1000, 3) if measured else 0,
+                    'max': round(self.wait_max * 1000, 3)
+                }
+            }
+        if pool is not None:
+            data['pool_class'] = type(pool).__name__
+            if isinstance(pool, QueuePool):
+                data['size'] = pool.size()
+                data['idle'] = pool.checkedin()
+                data['checked_out'] = pool.checkedout()
+                # overflow() 为负数时表示连接池尚未建满
+                data['overflow'] = max(pool.overflow(), 0)
+                data['max_overflow'] = pool._max_overflow
+                data['timeout'] = pool.timeout()
+            data['status'] = pool.status()
+        return data
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录获取连接时的等待时间与超时次数的 QueuePool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(Pool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.incr('connects')
+
+
+@event.listens_for(Pool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.record_checkout()
+
+
+@event.listens_for(Pool, 'checkin')
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.record_checkin()
+
+
+@event.listens_for(Pool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.incr('invalidations')
+
+
+@event.listens_for(Pool, 'soft_invalidate')
+def _on_soft_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.incr('soft_invalidations')
+
+
+def init_app(app):
+    """根据数据库类型补全引擎参数：MySQL 等服务端数据库使用带统计的 QueuePool
+
+    SQLite 不支持跨线程共享连接，保留 SQLAlchemy 默认连接池，并去掉连接池大小相关参数。
+    """
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        for key in ('pool_size', 'max_overflow', 'pool_timeout', 'poolclass'):
+            options.pop(key, None)
+    else:
+        options.setdefault('poolclass', InstrumentedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
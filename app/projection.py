@@ -0,0 +1,46 @@
+from collections import namedtuple
+
+from .pagination import PaginationError
+
+# 可返回的字段：查询该字段需要的列，以及从结果行得到字段值的函数
+Field = namedtuple('Field', 'columns render')
+
+
+def column_field(column, render=None):
+    """直接取自一列的字段；render 对取出的值做格式化"""
+    key = column.key
+    if render is None:
+        return Field((column,), lambda row: getattr(row, key))
+    return Field((column,), lambda row: render(getattr(row, key)))
+
+
+def date_field(column):
+    """日期原样返回，由 fastjson 编码为 YYYY-MM-DD（须用 fastjson.json_response 输出）；为空时返回 未知"""
+    return column_field(column, lambda value: value or '未知')
+
+
+def parse_fields(args, available, default=None):
+    """解析 fields 参数（逗号分隔），返回字段名元组；未提供时返回 default（默认为全部字段）"""
+    raw = args.get('fields')
+    if raw is None or raw == '':
+        return tuple(default or available)
+    fields = tuple(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        raise PaginationError(f'不支持的字段：{", ".join(unknown)}，可选：{", ".join(available)}')
+    return fields
+
+
+def projection_columns(available, fields, *required):
+    """所选字段需要查询的列（按列名去重）；required 中的列总是查询，如分页用的主键与排序列"""
+    columns = {}
+    for column in required:
+        columns.setdefault(column.key, column)
+    for field in fields:
+        for column in available[field].columns:
+            columns.setdefault(column.key, column)
+    return list(columns.values())
+
+
+def render_row(row, available, fields):
+    return {field: available[field].render(row) for field in fields}
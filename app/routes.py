@@ -1,16 +1,27 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, session
-from sqlalchemy import text # 导入 text 函数
-from .models import Medicine, Member, MedicineAdministration, MedicineCabinet, Prescription, PrescriptionMedicine, Manufacture, OTC, UserInfo, ExpiringMedicinesView
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, session, current_app, Response, stream_with_context
+from sqlalchemy import text, and_, or_ # 导入 text 函数
+from sqlalchemy.orm.exc import StaleDataError
+from .models import LONG_TERM, Medicine, Member, MedicineAdministration, MedicineCabinet, Prescription, PrescriptionMedicine, Manufacture, OTC, UserInfo, StockMovement, MedicineConsumption
 import datetime
-from apscheduler.schedulers.background import BackgroundScheduler
+import math
 from . import db
+from .cache import conditional_get, mark_changed, reference_cache
+from .bulk_import import IMPORTERS, read_rows
+from .export import EXPORTS, stream_export
+from .fastjson import STREAM_CHUNK_SIZE, format_datetime, json_response, stream_array
+from . import alerts
+from . import inventory
+from .pool import pool_stats
+from . import scheduler as scheduler_state
+from .safety import audit_active_administrations, check_medicines
+from .search import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, search_index, search_kinds
+from .stock import StockError, add_stock, create_consumptions, dispense, record_movement, supply_forecast, take_stock
+from .metrics import endpoint_metrics
+from .pagination import PaginationError, keyset_paginate, page_response, paginate_items, parse_bool_arg, parse_date_arg, parse_int_arg, parse_limit, parse_sort
+from .projection import Field, column_field, date_field, parse_fields, projection_columns, render_row
 
 main = Blueprint('main', __name__)
 
-# 初始化定时任务调度器
-scheduler = BackgroundScheduler()
-scheduler.start()
-
 @main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -37,287 +48,479 @@ def index():
         return redirect(url_for('main.login'))
     return render_template('index.html')
 
-# 获取药品列表
+def _cached_reference(name, model, loader):
+    """参考数据（药箱、生产厂家、处方）列表按请求参数缓存，表版本变化后自动失效"""
+    key = (name, tuple(sorted(request.args.items(multi=True))))
+    return reference_cache.get_or_load(key, [model.__tablename__], loader)
+
+def _manufacture_addresses():
+    """生产厂家名称 -> 地址（整表缓存，写入校验时不再查询数据库）"""
+    return reference_cache.get_or_load(('map', Manufacture.__tablename__), [Manufacture.__tablename__],
+                                       lambda: dict(db.session.query(Manufacture.manufacture_name, Manufacture.address).all()))
+
+def _prescription_ids():
+    """已有处方ID集合（整表缓存）"""
+    return reference_cache.get_or_load(('map', Prescription.__tablename__), [Prescription.__tablename__],
+                                       lambda: frozenset(pid for pid, in db.session.query(Prescription.prescription_id)))
+
+def _manufacture_exists(manufacture_name):
+    if manufacture_name in _manufacture_addresses():
+        return True
+    # 本次请求中刚添加、尚未 flush 的生产厂家
+    if any(isinstance(obj, Manufacture) and obj.manufacture_name == manufacture_name for obj in db.session.new):
+        return True
+    # 缓存未命中时按主键确认：已 flush 但未提交的对象在标识映射中，其他进程新增的厂家在数据库中
+    return db.session.get(Manufacture, manufacture_name) is not None
+
+def _version_conflict(medicine, data):
+    """校验客户端读取药品时拿到的版本号（请求体中的 expected_version），不一致时返回错误响应，一致时返回 None
+
+    这里只挡住客户端读取之后发生的修改；读取版本号到提交之间的修改由 version_id_col 在 UPDATE 时发现（StaleDataError）。
+    """
+    expected_version = data.get('expected_version')
+    if expected_version is None:
+        return jsonify({'error': '修改药品信息时必须提供 expected_version（读取药品时返回的 version）！'}), 428
+    try:
+        expected_version = int(expected_version)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'expected_version 必须是整数！'}), 400
+    if expected_version != medicine.version:
+        return jsonify({'error': '药品信息已被其他操作修改，请刷新后重试！', 'version': medicine.version}), 409
+    return None
+
+# 药品、成员接口可通过 fields 参数选择返回的字段，只查询这些字段需要的列，不加载完整的 ORM 对象
+MEDICINE_FIELDS = {
+    'national_code': column_field(Medicine.national_code),
+    'name': column_field(Medicine.name),
+    'manufacture_name': column_field(Medicine.manufacture_name),
+    'manufacture_date': date_field(Medicine.manufacture_date),
+    'remaining_quantity': column_field(Medicine.remaining_quantity),
+    'expiry_date': date_field(Medicine.expiry_date),
+    'price': column_field(Medicine.price),
+    'cabinet_id': column_field(Medicine.cabinet_id),
+    'low_stock_threshold': column_field(Medicine.low_stock_threshold),
+    # 乐观锁版本号，修改药品信息时作为 expected_version 传回
+    'version': column_field(Medicine.version),
+    # 需要外连接OTC表和PrescriptionMedicine表
+    'medicine_type': column_field(Medicine.medicine_type_expression().label('medicine_type'))
+}
+MEDICINE_LIST_FIELDS = ('national_code', 'name', 'remaining_quantity', 'medicine_type')
+
+# 消耗预测需要的列：剩余数量与消耗统计，结果行可直接作为消耗统计传入 supply_forecast
+_SUPPLY_COLUMNS = (Medicine.remaining_quantity, MedicineConsumption.decayed_quantity, MedicineConsumption.first_at,
+                   MedicineConsumption.updated_at)
+
+def _daily_consumption(row):
+    return round(supply_forecast(row.remaining_quantity, row)[0], 2)
+
+def _days_of_supply(row):
+    days_of_supply = supply_forecast(row.remaining_quantity, row)[1]
+    return round(days_of_supply, 1) if days_of_supply is not None else None
+
+MEDICINE_DETAIL_FIELDS = dict(MEDICINE_FIELDS, **{
+    'cabinet_location': column_field(MedicineCabinet.location, lambda value: value or '未知'),
+    'daily_consumption': Field(_SUPPLY_COLUMNS, _daily_consumption),
+    'days_of_supply': Field(_SUPPLY_COLUMNS, _days_of_supply)
+})
+
+MEMBER_FIELDS = {name: column_field(getattr(Member, name)) for name in (
+    'security_id', 'name', 'gender', 'age', 'weight', 'height', 'underlying_disease', 'allergen')}
+MEMBER_LIST_FIELDS = ('security_id', 'name', 'gender', 'age')
+
+# 获取药品列表（支持游标分页、筛选、排序与 fields 字段选择；启用读模型时不访问数据库）
 @main.route('/api/medicines', methods=['GET'])
+@conditional_get(Medicine, OTC, PrescriptionMedicine)
 def get_medicines():
-    medicines = Medicine.query.all()
-    medicines_data = [{'national_code': m.national_code, 'name': m.name, 'remaining_quantity': m.remaining_quantity, 'medicine_type': m.get_medicine_type()} for m in medicines]
-    return jsonify(medicines_data)
+    try:
+        args = request.args
+        fields = parse_fields(args, MEDICINE_FIELDS, MEDICINE_LIST_FIELDS)
+        sort_columns = {
+            'national_code': Medicine.national_code,
+            'name': Medicine.name,
+            'remaining_quantity': Medicine.remaining_quantity,
+            'expiry_date': Medicine.expiry_date
+        }
+        name_prefix = args.get('name_prefix')
+        cabinet_id = parse_int_arg(args, 'cabinet_id')
+        medicine_type = args.get('type')
+        if medicine_type and medicine_type not in ['OTC', 'Prescription']:
+            raise PaginationError('type 只能是 OTC 或 Prescription！')
+        min_quantity = parse_int_arg(args, 'min_quantity')
+        max_quantity = parse_int_arg(args, 'max_quantity')
 
-# 获取成员列表
+        if inventory.enabled():
+            records = inventory.read_model.medicines(
+                name_prefix, cabinet_id, {'OTC': 'OTC', 'Prescription': '处方药'}.get(medicine_type),
+                min_quantity, max_quantity)
+            medicines, next_cursor, limit = paginate_items(records, args, sort_columns, Medicine.national_code)
+        else:
+            # 主键与排序列用于生成下一页的游标，总是查询
+            _, sort_column, _ = parse_sort(args, sort_columns, 'national_code')
+            query = db.session.query(*projection_columns(MEDICINE_FIELDS, fields, Medicine.national_code, sort_column))
+            if 'medicine_type' in fields or medicine_type:
+                # 通过外连接在同一条查询中得到药品类型，查询次数不随药品数量增长
+                query = Medicine.join_type(query)
+            if name_prefix:
+                query = query.filter(Medicine.name.startswith(name_prefix, autoescape=True))
+            if cabinet_id is not None:
+                query = query.filter(Medicine.cabinet_id == cabinet_id)
+            if medicine_type:
+                type_column = OTC.national_code if medicine_type == 'OTC' else PrescriptionMedicine.national_code
+                query = query.filter(type_column.isnot(None))
+            if min_quantity is not None:
+                query = query.filter(Medicine.remaining_quantity >= min_quantity)
+            if max_quantity is not None:
+                query = query.filter(Medicine.remaining_quantity <= max_quantity)
+            medicines, next_cursor, limit = keyset_paginate(query, args, sort_columns, Medicine.national_code)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    medicines_data = [render_row(row, MEDICINE_FIELDS, fields) for row in medicines]
+    return json_response(page_response(medicines_data, next_cursor, limit))
+
+# 获取成员列表（支持游标分页、按姓名前缀筛选、排序与 fields 字段选择）
 @main.route('/api/members', methods=['GET'])
+@conditional_get(Member)
 def get_members():
-    members = Member.query.all()
-    members_data = [{'security_id': m.security_id, 'name': m.name, 'gender': m.gender, 'age': m.age} for m in members]
-    return jsonify(members_data)
+    try:
+        args = request.args
+        fields = parse_fields(args, MEMBER_FIELDS, MEMBER_LIST_FIELDS)
+        sort_columns = {
+            'security_id': Member.security_id,
+            'name': Member.name,
+            'age': Member.age
+        }
+        _, sort_column, _ = parse_sort(args, sort_columns, 'security_id')
+        query = db.session.query(*projection_columns(MEMBER_FIELDS, fields, Member.security_id, sort_column))
+        name_prefix = args.get('name_prefix')
+        if name_prefix:
+            query = query.filter(Member.name.startswith(name_prefix, autoescape=True))
+        members, next_cursor, limit = keyset_paginate(query, args, sort_columns, Member.security_id)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
 
-# 获取药箱位置列表
+    members_data = [render_row(row, MEMBER_FIELDS, fields) for row in members]
+    return json_response(page_response(members_data, next_cursor, limit))
+
+# 获取药箱位置列表（支持游标分页、按位置前缀筛选与排序，结果按表版本缓存）
 @main.route('/api/cabinets', methods=['GET'])
+@conditional_get(MedicineCabinet)
 def get_cabinets():
-    cabinets = MedicineCabinet.query.all()
-    cabinets_data = [{'cabinet_id': c.cabinet_id, 'location': c.location} for c in cabinets]
-    return jsonify(cabinets_data)
+    def load():
+        query = MedicineCabinet.query
+        name_prefix = request.args.get('name_prefix')
+        if name_prefix:
+            query = query.filter(MedicineCabinet.location.startswith(name_prefix, autoescape=True))
+        cabinet_id = parse_int_arg(request.args, 'cabinet_id')
+        if cabinet_id is not None:
+            query = query.filter(MedicineCabinet.cabinet_id == cabinet_id)
+        cabinets, next_cursor, limit = keyset_paginate(query, request.args, {
+            'cabinet_id': MedicineCabinet.cabinet_id,
+            'location': MedicineCabinet.location
+        }, MedicineCabinet.cabinet_id)
+        cabinets_data = [{'cabinet_id': c.cabinet_id, 'location': c.location} for c in cabinets]
+        return page_response(cabinets_data, next_cursor, limit)
+
+    try:
+        return jsonify(_cached_reference('cabinets', MedicineCabinet, load))
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+def _filter_administrations(query, args, security_id=None):
+    """按成员和开始日期范围（start_from/start_to，含当天）筛选用药记录"""
+    security_id = security_id or args.get('security_id')
+    if security_id:
+        query = query.filter(MedicineAdministration.security_id == security_id)
+    start_from = parse_date_arg(args, 'start_from')
+    if start_from:
+        query = query.filter(MedicineAdministration.start_time >= start_from)
+    start_to = parse_date_arg(args, 'start_to')
+    if start_to:
+        query = query.filter(MedicineAdministration.start_time < start_to + datetime.timedelta(days=1))
+    return query
 
-# 获取成员服药记录
+def _medications_by_member(*criteria):
+    """用一条连接查询取出用药记录及成员、药品名称，按成员排序，调用方单次遍历即可分组
+
+    只查询需要的列，返回尚未执行的查询；结果行包含用药记录各列及 member_name、medicine_name
+    """
+    query = db.session.query(MedicineAdministration.security_id, MedicineAdministration.national_code,
+                             MedicineAdministration.dosage, MedicineAdministration.start_time,
+                             MedicineAdministration.lasting_time, MedicineAdministration.manufacture_date,
+                             MedicineAdministration.end_time,
+                             Member.name.label('member_name'), Medicine.name.label('medicine_name')) \
+        .join(Member, Member.security_id == MedicineAdministration.security_id) \
+        .join(Medicine, Medicine.national_code == MedicineAdministration.national_code) \
+        .filter(*criteria)
+    query = _filter_administrations(query, request.args)
+    return query.order_by(MedicineAdministration.security_id, MedicineAdministration.start_time)
+
+# 获取成员服药记录（支持 start_from/start_to 日期筛选）
 @main.route('/api/member_medicine_records/<string:security_id>', methods=['GET'])
+@conditional_get(MedicineAdministration, Medicine)
 def get_member_medicine_records(security_id):
-    records = MedicineAdministration.query.filter_by(security_id=security_id).all()
+    try:
+        query = db.session.query(MedicineAdministration, Medicine.name) \
+            .outerjoin(Medicine, Medicine.national_code == MedicineAdministration.national_code)
+        records = _filter_administrations(query, request.args, security_id) \
+            .order_by(MedicineAdministration.start_time).all()
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
     records_data = []
-    for r in records:
-        medicine = Medicine.query.get(r.national_code)
+    for r, medicine_name in records:
         records_data.append({
-            'medicine_name': medicine.name if medicine else '未知药品',
+            'medicine_name': medicine_name or '未知药品',
             'dosage': r.dosage,
             'start_time': r.start_time.strftime('%Y-%m-%d %H:%M:%S') if r.start_time else '未知',
             'lasting_time': r.lasting_time
         })
     return jsonify(records_data)
 
-# 新增：获取家庭成员详细信息
+# 新增：获取家庭成员详细信息（支持 fields 字段选择）
 @main.route('/api/member_details/<string:security_id>', methods=['GET'])
+@conditional_get(Member)
 def get_member_details(security_id):
-    member = Member.query.get(security_id)
+    try:
+        fields = parse_fields(request.args, MEMBER_FIELDS)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    member = db.session.query(*projection_columns(MEMBER_FIELDS, fields, Member.security_id)) \
+        .filter(Member.security_id == security_id).first()
     if not member:
         return jsonify({'error': 'Member not found'}), 404
-    
-    member_data = {
-        'security_id': member.security_id,
-        'name': member.name,
-        'gender': member.gender,
-        'age': member.age,
-        'weight': member.weight,
-        'height': member.height,
-        'underlying_disease': member.underlying_disease,
-        'allergen': member.allergen
-    }
-    return jsonify(member_data)
+    return json_response(render_row(member, MEMBER_FIELDS, fields))
 
-# 新增：获取药品详细信息（包括存放位置）
+# 新增：获取药品详细信息（包括存放位置，支持 fields 字段选择）
 @main.route('/api/medicine_details/<string:national_code>', methods=['GET'])
+@conditional_get(Medicine, OTC, PrescriptionMedicine, MedicineCabinet, MedicineConsumption, bucket=60)
 def get_medicine_details(national_code):
-    medicine = Medicine.query.get(national_code)
-    if not medicine:
+    default_threshold = current_app.config.get('LOW_STOCK_THRESHOLD', alerts.LOW_STOCK_THRESHOLD)
+    available = dict(MEDICINE_DETAIL_FIELDS, effective_low_stock_threshold=column_field(
+        alerts.low_stock_threshold_expression(default_threshold).label('effective_low_stock_threshold')))
+    try:
+        fields = parse_fields(request.args, available)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if inventory.enabled():
+        row = inventory.read_model.medicine_view(national_code, default_threshold)
+    else:
+        # 药品、类型、药箱位置和消耗统计在同一条查询中取出，只查询所选字段需要的列
+        query = db.session.query(*projection_columns(available, fields, Medicine.national_code))
+        row = Medicine.join_type(query) \
+            .outerjoin(MedicineCabinet, MedicineCabinet.cabinet_id == Medicine.cabinet_id) \
+            .outerjoin(MedicineConsumption, MedicineConsumption.national_code == Medicine.national_code) \
+            .filter(Medicine.national_code == national_code).first()
+    if not row:
         return jsonify({'error': 'Medicine not found'}), 404
-    
-    cabinet = MedicineCabinet.query.get(medicine.cabinet_id) if medicine.cabinet_id else None
-    
-    medicine_data = {
-        'national_code': medicine.national_code,
-        'name': medicine.name,
-        'manufacture_name': medicine.manufacture_name,
-        'manufacture_date': medicine.manufacture_date.strftime('%Y-%m-%d') if medicine.manufacture_date else '未知',
-        'remaining_quantity': medicine.remaining_quantity,
-        'expiry_date': medicine.expiry_date.strftime('%Y-%m-%d') if medicine.expiry_date else '未知',
-        'price': medicine.price,
-        'cabinet_id': medicine.cabinet_id,
-        'cabinet_location': cabinet.location if cabinet else '未知',
-        'medicine_type': medicine.get_medicine_type()  # 使用方法获取药品类型
-    }
-    return jsonify(medicine_data)
+    return json_response(render_row(row, available, fields))
 
-# 新增：获取所有处方信息
+# 新增：获取所有处方信息（支持游标分页、按处方ID前缀筛选与排序，结果按表版本缓存）
 @main.route('/api/prescriptions', methods=['GET'])
+@conditional_get(Prescription)
 def get_prescriptions():
-    prescriptions = Prescription.query.all()
-    prescriptions_data = []
-    
-    for p in prescriptions:
-        prescriptions_data.append({
-            'prescription_id': p.prescription_id,
-            'time': p.time.strftime('%Y-%m-%d') if p.time else '未知',
-            'doctor': p.doctor
-        })
-    
-    return jsonify(prescriptions_data)
+    def load():
+        query = Prescription.query
+        name_prefix = request.args.get('name_prefix')
+        if name_prefix:
+            query = query.filter(Prescription.prescription_id.startswith(name_prefix, autoescape=True))
+        prescriptions, next_cursor, limit = keyset_paginate(query, request.args, {
+            'prescription_id': Prescription.prescription_id,
+            'time': Prescription.time
+        }, Prescription.prescription_id)
 
-# 获取生产厂家列表
+        prescriptions_data = []
+        
+        for p in prescriptions:
+            prescriptions_data.append({
+                'prescription_id': p.prescription_id,
+                'time': p.time.strftime('%Y-%m-%d') if p.time else '未知',
+                'doctor': p.doctor
+            })
+        
+        return page_response(prescriptions_data, next_cursor, limit)
+
+    try:
+        return jsonify(_cached_reference('prescriptions', Prescription, load))
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+# 获取生产厂家列表（支持游标分页、按厂家名前缀筛选，结果按表版本缓存）
 @main.route('/api/manufactures', methods=['GET'])
+@conditional_get(Manufacture)
 def get_manufactures():
-    manufactures = Manufacture.query.all()
-    manufactures_data = [{'manufacture_name': m.manufacture_name, 'address': m.address} for m in manufactures]
-    return jsonify(manufactures_data)
+    def load():
+        query = Manufacture.query
+        name_prefix = request.args.get('name_prefix')
+        if name_prefix:
+            query = query.filter(Manufacture.manufacture_name.startswith(name_prefix, autoescape=True))
+        manufactures, next_cursor, limit = keyset_paginate(query, request.args, {
+            'manufacture_name': Manufacture.manufacture_name
+        }, Manufacture.manufacture_name)
+        manufactures_data = [{'manufacture_name': m.manufacture_name, 'address': m.address} for m in manufactures]
+        return page_response(manufactures_data, next_cursor, limit)
+
+    try:
+        return jsonify(_cached_reference('manufactures', Manufacture, load))
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
 
-# 检查生产厂家是否存在
+# 按药品名称、编码、生产厂家搜索药品与生产厂家（输入时自动补全，使用内存索引）
+@main.route('/api/search', methods=['GET'])
+@conditional_get(Medicine, Manufacture)
+def search():
+    try:
+        args = request.args
+        kinds = [kind for kind in (args.get('type') or '').split(',') if kind] or None
+        unknown = [kind for kind in kinds or [] if kind not in search_kinds()]
+        if unknown:
+            raise PaginationError(f'type 只能是 {"、".join(search_kinds())}！')
+        limit = min(parse_limit(args) or DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        results = search_index.search(args.get('q', ''), kinds, limit)
+        return jsonify([dict(data, type=kind, match=match) for kind, match, data in results])
+    except Exception as e:
+        return jsonify({'error': f'搜索失败：{str(e)}'}), 500
+
+# 检查生产厂家是否存在（查缓存）
 @main.route('/api/check_manufacture/<string:manufacture_name>', methods=['GET'])
+@conditional_get(Manufacture)
 def check_manufacture(manufacture_name):
-    manufacture = Manufacture.query.get(manufacture_name)
+    addresses = _manufacture_addresses()
     return jsonify({
-        'exists': manufacture is not None,
-        'address': manufacture.address if manufacture else None
+        'exists': manufacture_name in addresses,
+        'address': addresses.get(manufacture_name)
     })
 
-# 新增：获取处方详情（包括开给谁和包含哪些药品）
+# 一次批量获取处方详情时最多允许的处方数
+MAX_PRESCRIPTION_IDS = 100
+
+def _prescription_details(prescription_ids):
+    """批量查询处方详情：处方与成员一次外连接查询，处方药品与药品一次连接查询，查询次数与处方、药品数量无关
+
+    返回 {处方ID: 详情}，不存在的处方不包含在内。
+    """
+    details = {}
+    rows = db.session.query(Prescription.prescription_id, Prescription.time, Prescription.doctor,
+                            Member.security_id, Member.name) \
+        .outerjoin(Member, Member.security_id == Prescription.security_id) \
+        .filter(Prescription.prescription_id.in_(prescription_ids)).all()
+    for prescription_id, time, doctor, security_id, member_name in rows:
+        details[prescription_id] = {
+            'prescription_id': prescription_id,
+            'time': time.strftime('%Y-%m-%d') if time else '未知',
+            'doctor': doctor,
+            'members': [{'security_id': security_id, 'name': member_name}] if security_id else [],
+            'medicines': []
+        }
+    if not details:
+        return details
+
+    medicines = db.session.query(PrescriptionMedicine.prescription_id, Medicine.national_code, Medicine.name) \
+        .join(Medicine, Medicine.national_code == PrescriptionMedicine.national_code) \
+        .filter(PrescriptionMedicine.prescription_id.in_(list(details))) \
+        .order_by(PrescriptionMedicine.prescription_id, Medicine.national_code).all()
+    for prescription_id, national_code, name in medicines:
+        details[prescription_id]['medicines'].append({'national_code': national_code, 'name': name})
+    return details
+
+# 获取处方详情（包括开给谁和包含哪些药品）
 @main.route('/api/prescription_details/<string:prescription_id>', methods=['GET'])
+@conditional_get(Prescription, Member, PrescriptionMedicine, Medicine)
 def get_prescription_details(prescription_id):
-    prescription = Prescription.query.get(prescription_id)
-    if not prescription:
-        return jsonify({'error': 'Prescription not found'}), 404
-    
-    # 查询这个处方开给哪些成员（加入异常处理）
-    members = []
     try:
-        prescribe_records = Prescription.query.filter_by(prescription_id=prescription_id).all()
-        for record in prescribe_records:
-            member = Member.query.get(record.security_id)
-            if member:
-                members.append({
-                    'security_id': member.security_id,
-                    'name': member.name
-                })
+        details = _prescription_details([prescription_id]).get(prescription_id)
     except Exception as e:
-        print(f"查询处方用户时出错: {str(e)}")
-        # 如果表不存在或出错，至少返回一个空列表而不是崩溃
-    
-    # 查询这个处方包含哪些药品
-    medicines = []
+        return jsonify({'error': f'获取处方详情失败：{str(e)}'}), 500
+    if details is None:
+        return jsonify({'error': 'Prescription not found'}), 404
+    return jsonify(details)
+
+# 批量获取处方详情：ids 为逗号分隔的处方ID，按请求顺序返回，不存在的处方列在 not_found 中
+@main.route('/api/prescriptions/details', methods=['GET'])
+@conditional_get(Prescription, Member, PrescriptionMedicine, Medicine)
+def get_prescriptions_details():
+    prescription_ids = list(dict.fromkeys(pid.strip() for pid in (request.args.get('ids') or '').split(',') if pid.strip()))
+    if not prescription_ids:
+        return jsonify({'error': 'ids 不能为空！'}), 400
+    if len(prescription_ids) > MAX_PRESCRIPTION_IDS:
+        return jsonify({'error': f'一次最多查询 {MAX_PRESCRIPTION_IDS} 个处方！'}), 400
     try:
-        prescription_medicines = PrescriptionMedicine.query.filter_by(prescription_id=prescription_id).all()
-        for pm in prescription_medicines:
-            medicine = Medicine.query.get(pm.national_code)
-            if medicine:
-                medicines.append({
-                    'national_code': medicine.national_code,
-                    'name': medicine.name
-                })
+        details = _prescription_details(prescription_ids)
+        return jsonify({
+            'prescriptions': [details[pid] for pid in prescription_ids if pid in details],
+            'not_found': [pid for pid in prescription_ids if pid not in details]
+        })
     except Exception as e:
-        print(f"查询处方药品时出错: {str(e)}")
-        # 如果表不存在或出错，至少返回一个空列表而不是崩溃
-    
-    prescription_data = {
-        'prescription_id': prescription.prescription_id,
-        'time': prescription.time.strftime('%Y-%m-%d') if prescription.time else '未知',
-        'doctor': prescription.doctor,
-        'members': members,
-        'medicines': medicines
+        return jsonify({'error': f'获取处方详情失败：{str(e)}'}), 500
+
+# 日期列直接交给 JSON 编码器（输出 YYYY-MM-DD），不再逐行 strftime
+def _current_medication_info(row):
+    return {
+        'medicine_name': row.medicine_name,
+        'national_code': row.national_code,
+        'start_time': format_datetime(row.start_time),
+        'dosage': row.dosage,
+        'lasting_time': row.lasting_time,
+        # 直接从MedicineAdministration获取生产日期
+        'manufacture_date': row.manufacture_date or '未知'
     }
-    
-    return jsonify(prescription_data)
 
-# 获取家庭成员当前用药情况
+def _historical_medication_info(row):
+    return {
+        'medicine_name': row.medicine_name,
+        'national_code': row.national_code,
+        'start_time': format_datetime(row.start_time),
+        'end_time': format_datetime(row.end_time),
+        'dosage': row.dosage,
+        'lasting_time': row.lasting_time
+    }
+
+def _group_medications(rows, build):
+    """将按成员排序的用药行逐个成员分组输出（生成器），build 负责生成单条用药信息"""
+    group = None
+    for row in rows:
+        if group is None or group['security_id'] != row.security_id:
+            if group is not None:
+                yield group
+            group = {'member_name': row.member_name, 'security_id': row.security_id, 'medications': []}
+        group['medications'].append(build(row))
+    if group is not None:
+        yield group
+
+# 获取家庭成员当前用药情况（支持 security_id、start_from/start_to 筛选）
 @main.route('/api/current_medications', methods=['GET'])
+@conditional_get(MedicineAdministration, Member, Medicine, bucket=60)
 def get_current_medications():
     current_date = datetime.datetime.now()
-    # 查询所有正在进行的用药记录
-    records = MedicineAdministration.query.filter(
-        MedicineAdministration.start_time <= current_date
-    ).all()
-    
-    result = {}
-    
-    for record in records:
-        try:
-            # 计算用药是否仍在有效期内
-            is_valid = False
-            if record.lasting_time == '长期':
-                is_valid = True
-            elif record.start_time and record.lasting_time:
-                # 安全地解析持续时间
-                try:
-                    days_str = record.lasting_time.replace('天', '')
-                    days = int(days_str)
-                    # 检查药品是否在有效期内
-                    if record.start_time + datetime.timedelta(days=days) >= current_date:
-                        is_valid = True
-                except (ValueError, AttributeError):
-                    # 如果解析失败，假定药品仍然有效
-                    is_valid = True
-            
-            if is_valid:
-                member = Member.query.get(record.security_id)
-                medicine = Medicine.query.get(record.national_code)
-                
-                if member and medicine:
-                    if record.security_id not in result:
-                        result[record.security_id] = {
-                            'member_name': member.name,
-                            'security_id': record.security_id,
-                            'medications': []
-                        }
-                    
-                    medication_info = {
-                        'medicine_name': medicine.name,
-                        'national_code': record.national_code,
-                        'start_time': record.start_time.strftime('%Y-%m-%d %H:%M:%S') if record.start_time else '未知',
-                        'dosage': record.dosage,
-                        'lasting_time': record.lasting_time
-                    }
-                    
-                    # 直接从MedicineAdministration获取生产日期
-                    if record.manufacture_date:
-                        medication_info['manufacture_date'] = record.manufacture_date.strftime('%Y-%m-%d')
-                    else:
-                        medication_info['manufacture_date'] = '未知'
-                    
-                    result[record.security_id]['medications'].append(medication_info)
-        except Exception as e:
-            # 记录错误但继续处理其他记录
-            print(f"处理药品记录时出错: {str(e)}")
-            continue
+    try:
+        # 查询所有正在进行的用药记录（长期用药或结束时间未到，走 end_time 索引）
+        records = _medications_by_member(
+            MedicineAdministration.start_time <= current_date,
+            MedicineAdministration.active_filter(current_date)
+        )
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify(list(result.values()))
+    # 从服务端游标分块读取，按成员逐块编码输出
+    return stream_array(_group_medications(records.yield_per(STREAM_CHUNK_SIZE), _current_medication_info))
 
-# 新增：获取历史用药情况
+# 新增：获取历史用药情况（支持 security_id、start_from/start_to 筛选）
 @main.route('/api/historical_medications', methods=['GET'])
+@conditional_get(MedicineAdministration, Member, Medicine, bucket=60)
 def get_historical_medications():
     current_date = datetime.datetime.now()
-    # 查询所有用药记录
-    records = MedicineAdministration.query.all()
-    
-    result = {}
-    
-    for record in records:
-        try:
-            # 计算用药是否已经过期（历史记录）
-            is_historical = False
-            if record.lasting_time != '长期' and record.start_time and record.lasting_time:
-                # 安全地解析持续时间
-                try:
-                    days_str = record.lasting_time.replace('天', '')
-                    days = int(days_str)
-                    # 检查药品是否已经过期
-                    if record.start_time + datetime.timedelta(days=days) < current_date:
-                        is_historical = True
-                except (ValueError, AttributeError):
-                    # 如果解析失败，跳过此记录
-                    continue
-            
-            if is_historical:
-                member = Member.query.get(record.security_id)
-                medicine = Medicine.query.get(record.national_code)
-                
-                if member and medicine:
-                    if record.security_id not in result:
-                        result[record.security_id] = {
-                            'member_name': member.name,
-                            'security_id': record.security_id,
-                            'medications': []
-                        }
-                    
-                    end_date = None
-                    if record.start_time and record.lasting_time and record.lasting_time != '长期':
-                        try:
-                            days_str = record.lasting_time.replace('天', '')
-                            days = int(days_str)
-                            end_date = record.start_time + datetime.timedelta(days=days)
-                        except (ValueError, AttributeError):
-                            pass
-                    
-                    medication_info = {
-                        'medicine_name': medicine.name,
-                        'national_code': record.national_code,
-                        'start_time': record.start_time.strftime('%Y-%m-%d %H:%M:%S') if record.start_time else '未知',
-                        'end_time': end_date.strftime('%Y-%m-%d %H:%M:%S') if end_date else '未知',
-                        'dosage': record.dosage,
-                        'lasting_time': record.lasting_time
-                    }
-                    
-                    result[record.security_id]['medications'].append(medication_info)
-        except Exception as e:
-            # 记录错误但继续处理其他记录
-            print(f"处理历史药品记录时出错: {str(e)}")
-            continue
+    try:
+        # 查询所有已结束的用药记录（结束时间早于当前时间，走 end_time 索引）
+        records = _medications_by_member(MedicineAdministration.historical_filter(current_date))
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify(list(result.values()))
+    return stream_array(_group_medications(records.yield_per(STREAM_CHUNK_SIZE), _historical_medication_info))
 
 # 添加药品
 @main.route('/api/add_medicine', methods=['POST'])
@@ -331,8 +534,7 @@ def api_add_medicine():
         # 检查生产厂家是否存在，如果不存在则需要提供地址
         manufacture_name = data.get('manufacture_name', '').strip()
         if manufacture_name:
-            existing_manufacture = Manufacture.query.get(manufacture_name)
-            if not existing_manufacture:
+            if not _manufacture_exists(manufacture_name):
                 # 生产厂家不存在，检查是否提供了地址
                 manufacture_address = data.get('manufacture_address', '').strip()
                 if not manufacture_address:
@@ -352,8 +554,7 @@ def api_add_medicine():
                 return jsonify({'error': '添加处方药时必须填写处方ID！'}), 400
             
             # 验证处方ID是否存在
-            existing_prescription = Prescription.query.get(prescription_id)
-            if not existing_prescription:
+            if prescription_id not in _prescription_ids():
                 return jsonify({'error': f'处方ID "{prescription_id}" 不存在！请输入有效的处方ID。'}), 400
           # 检查药品编码是否已存在
         existing_medicine = Medicine.query.get(data['national_code'])
@@ -361,15 +562,15 @@ def api_add_medicine():
             # 如果药品已存在，检查其他信息是否相同
             if existing_medicine.name == data['name']:
                 # 药品名称相同，更新数量和其他信息
-                new_quantity = existing_medicine.remaining_quantity + (int(data.get('remaining_quantity', 0)) or 0)
+                quantity_to_add = int(data.get('remaining_quantity', 0)) or 0
+                new_quantity = existing_medicine.remaining_quantity + quantity_to_add
                 
                 # 更新药品信息
                 if data.get('manufacture_name'):
                     # 检查新的生产厂家是否存在
                     new_manufacture_name = data.get('manufacture_name').strip()
                     if new_manufacture_name != existing_medicine.manufacture_name:
-                        existing_new_manufacture = Manufacture.query.get(new_manufacture_name)
-                        if not existing_new_manufacture:
+                        if not _manufacture_exists(new_manufacture_name):
                             manufacture_address = data.get('manufacture_address', '').strip()
                             if not manufacture_address:
                                 return jsonify({'error': f'生产厂家 "{new_manufacture_name}" 不存在于系统中，请填写厂家地址！'}), 400
@@ -402,9 +603,15 @@ def api_add_medicine():
                     existing_medicine.price = float(data.get('price', 0.0))
                 
                 if data.get('cabinet_id'):
-                    existing_medicine.cabinet_id = int(data.get('cabinet_id'))                
-                # 更新数量
-                existing_medicine.remaining_quantity = new_quantity
+                    existing_medicine.cabinet_id = int(data.get('cabinet_id'))
+                # 药品信息确有变化时校验版本号；只累加数量（或信息与已有的相同）时不需要
+                if db.session.is_modified(existing_medicine):
+                    conflict = _version_conflict(existing_medicine, data)
+                    if conflict:
+                        return conflict
+                # 更新数量（条件 UPDATE 原子地累加，并记录库存流水）
+                if quantity_to_add:
+                    _, new_quantity = add_stock(data['national_code'], quantity_to_add, movement_type='add')
                   # 确保药品类型记录存在
                 if medicine_type == 'OTC':
                     from app.models import OTC
@@ -430,8 +637,7 @@ def api_add_medicine():
                             return jsonify({'error': '添加处方药时必须填写处方ID！'}), 400
                         
                         # 验证处方ID是否存在
-                        existing_prescription = Prescription.query.get(prescription_id)
-                        if not existing_prescription:
+                        if prescription_id not in _prescription_ids():
                             return jsonify({'error': f'处方ID "{prescription_id}" 不存在！请输入有效的处方ID。'}), 400
                         
                         prescription_record = PrescriptionMedicine(
@@ -444,7 +650,8 @@ def api_add_medicine():
                 db.session.commit()
                 return jsonify({
                     'message': f'药品"{existing_medicine.name}"数量已更新！当前数量：{new_quantity}',
-                    'updated': True
+                    'updated': True,
+                    'version': existing_medicine.version
                 })
             else:
                 # 药品编码相同但名称不同，返回错误
@@ -494,8 +701,7 @@ def api_add_medicine():
                 return jsonify({'error': '添加处方药时必须填写处方ID！'}), 400
             
             # 验证处方ID是否存在
-            existing_prescription = Prescription.query.get(prescription_id)
-            if not existing_prescription:
+            if prescription_id not in _prescription_ids():
                 return jsonify({'error': f'处方ID "{prescription_id}" 不存在！请输入有效的处方ID。'}), 400
             
             prescription_record = PrescriptionMedicine(
@@ -505,9 +711,16 @@ def api_add_medicine():
             )
             db.session.add(prescription_record)
         
+        create_consumptions([new_medicine.national_code])
+        if new_medicine.remaining_quantity:
+            record_movement(new_medicine.national_code, 'add', int(new_medicine.remaining_quantity),
+                            int(new_medicine.remaining_quantity))
         db.session.commit()
         return jsonify({'message': '药品添加成功！'})
         
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': '药品信息已被其他操作修改，请刷新后重试！'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'添加药品时发生错误：{str(e)}'}), 500
@@ -520,42 +733,30 @@ def api_delete_medicine(national_code):
         if not medicine:
             return jsonify({'error': '找不到指定的药品'}), 404
 
-        # 开始事务
-        db.session.begin()
-        
+        # 查询药品时已自动开始事务，以下操作在同一事务中完成
         try:
-            # 检查是否有正在进行的用药记录
-            active_administrations = MedicineAdministration.query.filter_by(national_code=national_code).all()
+            # 检查是否有正在进行的用药记录（长期用药或结束时间未到）
+            current_date = datetime.datetime.now()
+            active_administrations = db.session.query(MedicineAdministration, Member.name) \
+                .outerjoin(Member, Member.security_id == MedicineAdministration.security_id) \
+                .filter(
+                    MedicineAdministration.national_code == national_code,
+                    MedicineAdministration.active_filter(current_date)
+                ).all()
             
             if active_administrations:
-                # 检查是否有正在进行的用药
-                current_date = datetime.datetime.now()
-                has_active_medication = False
                 active_users = []
-                
-                for admin in active_administrations:
-                    # 获取用户信息
-                    member = Member.query.get(admin.security_id)
-                    user_name = member.name if member else admin.security_id
-                    
-                    if admin.lasting_time == '长期':
-                        has_active_medication = True
+                for admin, member_name in active_administrations:
+                    user_name = member_name or admin.security_id
+                    if admin.lasting_time == LONG_TERM:
                         active_users.append(f"{user_name} (长期用药)")
-                    elif admin.start_time and admin.lasting_time:
-                        try:
-                            days_str = admin.lasting_time.replace('天', '')
-                            days = int(days_str)
-                            if admin.start_time + datetime.timedelta(days=days) >= current_date:
-                                has_active_medication = True
-                                active_users.append(f"{user_name} ({admin.lasting_time})")
-                        except (ValueError, AttributeError):
-                            continue
+                    else:
+                        active_users.append(f"{user_name} ({admin.lasting_time})")
                 
-                if has_active_medication:
-                    db.session.rollback()
-                    return jsonify({
-                        'error': f'该药品正在被使用中，无法删除！\n正在使用的用户：{", ".join(active_users)}\n请先停止相关用药记录。'
-                    }), 400
+                db.session.rollback()
+                return jsonify({
+                    'error': f'该药品正在被使用中，无法删除！\n正在使用的用户：{", ".join(active_users)}\n请先停止相关用药记录。'
+                }), 400
             
             # 删除相关的子表记录
             # 1. 删除 OTC 记录
@@ -569,6 +770,8 @@ def api_delete_medicine(national_code):
             
             # 4. 最后删除主表记录
             db.session.delete(medicine)
+            if medicine.remaining_quantity:
+                record_movement(national_code, 'delete', -medicine.remaining_quantity, 0)
             
             # 提交事务
             db.session.commit()
@@ -637,6 +840,49 @@ def init_data():
         db.session.rollback()
         return jsonify({'error': f'数据初始化失败：{str(e)}'}), 500
 
+# 批量导入药品、生产厂家或成员（CSV 或 NDJSON，流式读取、分批写入，逐行报告错误）
+@main.route('/api/import/<string:kind>', methods=['POST'])
+def api_bulk_import(kind):
+    importer_class = IMPORTERS.get(kind)
+    if not importer_class:
+        return jsonify({'error': f'不支持的导入类型：{kind}，可选：{", ".join(IMPORTERS)}'}), 404
+
+    data_format = request.args.get('format')
+    if not data_format:
+        if request.mimetype == 'text/csv':
+            data_format = 'csv'
+        elif request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+            data_format = 'ndjson'
+    if data_format not in ('csv', 'ndjson'):
+        return jsonify({'error': '请使用 text/csv 或 application/x-ndjson 格式上传，或通过 format 参数指定！'}), 400
+
+    try:
+        importer = importer_class(batch_size=current_app.config.get('IMPORT_BATCH_SIZE', 1000))
+        report = importer.run(read_rows(request.stream, data_format))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'批量导入失败：{str(e)}'}), 500
+
+    report['kind'] = kind
+    return jsonify(report)
+
+# 导出药品库存或完整用药记录（CSV 或 NDJSON，服务端游标流式输出）
+@main.route('/api/export/<string:name>', methods=['GET'])
+def api_export(name):
+    if name not in EXPORTS:
+        return jsonify({'error': f'不支持的导出类型：{name}，可选：{", ".join(EXPORTS)}'}), 404
+
+    data_format = request.args.get('format', 'csv')
+    if data_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format 只能是 csv 或 ndjson！'}), 400
+
+    mimetype = 'text/csv' if data_format == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(stream_export(name, data_format)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={name}.{data_format}'}
+    )
+
 # 删除药品（按数量删除，带事务处理）
 @main.route('/api/remove_medicine', methods=['POST'])
 def api_remove_medicine():
@@ -651,52 +897,24 @@ def api_remove_medicine():
         if quantity_to_remove <= 0:
             return jsonify({'error': '删除数量必须大于0！'}), 400
         
-        # 开始事务
-        db.session.begin()
-        
         try:
-            # 查找药品记录（加锁防止并发修改）
-            medicine = Medicine.query.filter_by(national_code=national_code).with_for_update().first()
-            
-            if not medicine:
-                db.session.rollback()
-                return jsonify({'error': '找不到指定的药品！'}), 404
-            
-            # 检查当前数量
-            if medicine.remaining_quantity < quantity_to_remove:
-                db.session.rollback()
-                return jsonify({'error': f'删除数量({quantity_to_remove})超过当前剩余数量({medicine.remaining_quantity})！'}), 400
-              # 计算删除后的数量
-            new_quantity = medicine.remaining_quantity - quantity_to_remove
+            # 条件更新：剩余数量足够时才扣减，不需要先加锁读取
+            medicine_name, new_quantity = take_stock(national_code, quantity_to_remove)
             
             if new_quantity == 0:
-                # 数量为0时，需要检查是否有相关的用药记录
-                active_administrations = MedicineAdministration.query.filter_by(national_code=national_code).all()
+                # 数量为0时，需要检查是否有正在进行的用药记录
+                has_active_medication = db.session.query(
+                    MedicineAdministration.query.filter(
+                        MedicineAdministration.national_code == national_code,
+                        MedicineAdministration.active_filter(datetime.datetime.now())
+                    ).exists()
+                ).scalar()
                 
-                if active_administrations:
-                    # 检查是否有正在进行的用药
-                    current_date = datetime.datetime.now()
-                    has_active_medication = False
-                    
-                    for admin in active_administrations:
-                        if admin.lasting_time == '长期':
-                            has_active_medication = True
-                            break
-                        elif admin.start_time and admin.lasting_time:
-                            try:
-                                days_str = admin.lasting_time.replace('天', '')
-                                days = int(days_str)
-                                if admin.start_time + datetime.timedelta(days=days) >= current_date:
-                                    has_active_medication = True
-                                    break
-                            except (ValueError, AttributeError):
-                                continue
-                    
-                    if has_active_medication:
-                        db.session.rollback()
-                        return jsonify({'error': '该药品正在被使用中，无法完全删除！请先停止相关用药记录。'}), 400
+                if has_active_medication:
+                    db.session.rollback()
+                    return jsonify({'error': '该药品正在被使用中，无法完全删除！请先停止相关用药记录。'}), 400
                 
-                # 删除相关的子表记录，然后删除主表记录
+                # 删除相关的子表记录，然后删除主表记录（扣减后该行已被本事务锁定）
                 # 1. 删除 OTC 记录
                 OTC.query.filter_by(national_code=national_code).delete()
                 
@@ -707,21 +925,21 @@ def api_remove_medicine():
                 MedicineAdministration.query.filter_by(national_code=national_code).delete()
                 
                 # 4. 最后删除主表记录
-                db.session.delete(medicine)
-                message = f'药品"{medicine.name}"已完全删除！'
+                Medicine.query.filter_by(national_code=national_code).delete()
+                message = f'药品"{medicine_name}"已完全删除！'
             else:
-                # 更新数量
-                medicine.remaining_quantity = new_quantity
-                message = f'成功从"{medicine.name}"中删除 {quantity_to_remove} 个，剩余数量：{new_quantity}'
-            
-            # 记录操作日志（可选，这里简化处理）
-            print(f"药品删除操作：{national_code}, 删除数量：{quantity_to_remove}, 操作时间：{datetime.datetime.now()}")
+                message = f'成功从"{medicine_name}"中删除 {quantity_to_remove} 个，剩余数量：{new_quantity}'
             
             # 提交事务
             db.session.commit()
+            # 记录操作日志（提交成功后记录，时间由日志格式给出）
+            current_app.logger.info(f'药品删除操作：{national_code}，删除数量：{quantity_to_remove}')
             
             return jsonify({'message': message})
             
+        except StockError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), e.status
         except Exception as e:
             # 发生错误时回滚事务
             db.session.rollback()
@@ -730,39 +948,125 @@ def api_remove_medicine():
     except Exception as e:
         return jsonify({'error': f'删除操作失败：{str(e)}'}), 500
 
+# 批量发药：一次扣减多个药品（或整张处方中的药品），全部成功才提交
+@main.route('/api/dispense', methods=['POST'])
+def api_dispense():
+    try:
+        data = request.json or {}
+        items = data.get('items')
+        prescription_id = data.get('prescription_id')
+
+        if (items is None) == (prescription_id is None):
+            return jsonify({'error': 'items 和 prescription_id 必须且只能提供一个！'}), 400
+
+        security_id = data.get('security_id')
+        if prescription_id is not None:
+            # 处方中的每种药品各发 quantity 个（默认 1），用药成员为处方所属成员
+            quantity = data.get('quantity', 1)
+            security_id = security_id or db.session.query(Prescription.security_id) \
+                .filter(Prescription.prescription_id == prescription_id).scalar()
+            codes = [code for code, in db.session.query(PrescriptionMedicine.national_code)
+                     .filter(PrescriptionMedicine.prescription_id == prescription_id)]
+            if not codes:
+                return jsonify({'error': '找不到指定的处方或处方中没有药品！'}), 404
+            items = [{'national_code': code, 'quantity': quantity} for code in codes]
+
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'items 必须是非空列表！'}), 400
+
+        # 同一药品出现多次时合并数量
+        quantities = {}
+        for item in items:
+            national_code = item.get('national_code') if isinstance(item, dict) else None
+            quantity = item.get('quantity') if isinstance(item, dict) else None
+            if not national_code:
+                return jsonify({'error': '药品编码不能为空！'}), 400
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+                return jsonify({'error': f'药品 {national_code} 的发药数量必须是大于0的整数！'}), 400
+            quantities[national_code] = quantities.get(national_code, 0) + quantity
+
+        # 已知用药成员时检查过敏原与基础疾病冲突，存在冲突时需确认（override_conflicts）后才发药
+        conflicts = check_medicines(security_id, quantities) if security_id else {}
+        if conflicts and not data.get('override_conflicts'):
+            return jsonify({'error': '发药药品与成员的过敏原或基础疾病冲突，确认后请带 override_conflicts 重新提交！',
+                            'conflicts': conflicts}), 409
+
+        try:
+            results, succeeded = dispense(quantities)
+            if not succeeded:
+                db.session.rollback()
+                # 可以扣减的项目也随事务一起回滚
+                for result in results:
+                    if result['status'] == 'ok':
+                        result['status'] = 'not_applied'
+                        del result['remaining_quantity']
+                return jsonify({'error': '部分药品无法发药，本次发药未执行！', 'items': results}), 400
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise e
+
+        response = {'message': f'成功发药 {len(results)} 种', 'items': results}
+        if conflicts:
+            response['conflicts'] = conflicts
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({'error': f'发药失败：{str(e)}'}), 500
+
+# 检查成员使用指定药品（national_code 可用逗号分隔多个）是否与其过敏原、基础疾病冲突
+@main.route('/api/safety/check', methods=['GET'])
+@conditional_get(Member, Medicine)
+def safety_check():
+    security_id = request.args.get('security_id')
+    national_codes = [code for code in (request.args.get('national_code') or '').split(',') if code]
+    if not security_id or not national_codes:
+        return jsonify({'error': 'security_id 和 national_code 不能为空！'}), 400
+    try:
+        if db.session.query(Member.security_id).filter(Member.security_id == security_id).first() is None:
+            return jsonify({'error': 'Member not found'}), 404
+        conflicts = check_medicines(security_id, national_codes)
+        return jsonify({'security_id': security_id, 'safe': not conflicts, 'conflicts': conflicts})
+    except Exception as e:
+        return jsonify({'error': f'检查用药冲突失败：{str(e)}'}), 500
+
+# 检查所有正在进行的用药中与成员过敏原、基础疾病冲突的记录
+@main.route('/api/safety/audit', methods=['GET'])
+@conditional_get(Member, Medicine, MedicineAdministration, bucket=60)
+def safety_audit():
+    try:
+        result = [{
+            'security_id': security_id,
+            'member_name': member_name,
+            'national_code': national_code,
+            'medicine_name': medicine_name,
+            'conflicts': conflicts
+        } for (security_id, national_code, medicine_name, member_name), conflicts
+            in audit_active_administrations(datetime.datetime.now())]
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': f'检查用药冲突失败：{str(e)}'}), 500
+
 # 获取药品的使用状态信息
 @main.route('/api/medicine_usage/<string:national_code>', methods=['GET'])
+@conditional_get(Medicine, MedicineAdministration, Member, bucket=60)
 def get_medicine_usage(national_code):
     try:
         medicine = Medicine.query.get(national_code)
         if not medicine:
             return jsonify({'error': 'Medicine not found'}), 404
         
-        # 查询该药品的使用记录
-        administrations = MedicineAdministration.query.filter_by(national_code=national_code).all()
+        # 查询该药品的使用记录，是否仍在使用由 end_time 直接判断
         current_date = datetime.datetime.now()
+        administrations = db.session.query(MedicineAdministration, Member) \
+            .join(Member, Member.security_id == MedicineAdministration.security_id) \
+            .filter(MedicineAdministration.national_code == national_code).all()
         
         active_users = []
         historical_count = 0
         
-        for admin in administrations:
-            member = Member.query.get(admin.security_id)
-            if not member:
-                continue
-                
-            is_active = False
-            if admin.lasting_time == '长期':
-                is_active = True
-            elif admin.start_time and admin.lasting_time:
-                try:
-                    days_str = admin.lasting_time.replace('天', '')
-                    days = int(days_str)
-                    if admin.start_time + datetime.timedelta(days=days) >= current_date:
-                        is_active = True
-                except (ValueError, AttributeError):
-                    pass
-            
-            if is_active:
+        for admin, member in administrations:
+            if admin.is_active(current_date):
                 active_users.append({
                     'name': member.name,
                     'security_id': member.security_id,
@@ -805,7 +1109,7 @@ def api_add_new_medicine():
         manufacture_name = data.get('manufacture_name')
         if manufacture_name:
             # 检查生产商是否存在
-            existing_manufacture = Manufacture.query.get(manufacture_name)
+            existing_manufacture = _manufacture_exists(manufacture_name)
             if not existing_manufacture:
                 # 如果生产商不存在，则创建新的生产商记录
                 new_manufacture = Manufacture(
@@ -859,8 +1163,7 @@ def api_add_new_medicine():
                 prescription_id = None
             else:
                 # 验证处方ID是否存在
-                existing_prescription = Prescription.query.get(prescription_id)
-                if not existing_prescription:
+                if prescription_id not in _prescription_ids():
                     return jsonify({'error': f'处方ID "{prescription_id}" 不存在！请输入有效的处方ID或留空。'}), 400
             
             prescription_record = PrescriptionMedicine(
@@ -870,6 +1173,10 @@ def api_add_new_medicine():
             )
             db.session.add(prescription_record)
         
+        create_consumptions([new_medicine.national_code])
+        if new_medicine.remaining_quantity:
+            record_movement(new_medicine.national_code, 'add', int(new_medicine.remaining_quantity),
+                            int(new_medicine.remaining_quantity))
         db.session.commit()
         
         # 根据是否创建了新的生产商，返回不同的成功消息
@@ -896,24 +1203,16 @@ def api_refill_medicine():
         if quantity_to_add <= 0:
             return jsonify({'error': '补充数量必须大于0！'}), 400
         
-        # 开始事务
-        db.session.begin()
-        
         try:
-            # 查找药品记录（加锁防止并发修改）
-            medicine = Medicine.query.filter_by(national_code=national_code).with_for_update().first()
-            
-            if not medicine:
-                db.session.rollback()
-                return jsonify({'error': '找不到指定的药品！'}), 404
-            
-            # 更新数量
-            new_quantity = medicine.remaining_quantity + quantity_to_add
-            medicine.remaining_quantity = new_quantity
+            # 在数据库中原子地增加数量，并发补充不会丢失更新
+            medicine_name, new_quantity = add_stock(national_code, quantity_to_add)
             
             db.session.commit()
-            return jsonify({'message': f'成功为"{medicine.name}"补充 {quantity_to_add} 个，当前总数量：{new_quantity}'})
+            return jsonify({'message': f'成功为"{medicine_name}"补充 {quantity_to_add} 个，当前总数量：{new_quantity}'})
             
+        except StockError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), e.status
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': f'补充药品时发生错误：{str(e)}'}), 500
@@ -921,93 +1220,353 @@ def api_refill_medicine():
     except Exception as e:
         return jsonify({'error': f'处理请求时发生错误：{str(e)}'}), 500
 
-# 获取即将过期的药品（30天内）
-@main.route('/api/expiring_medicines', methods=['GET'])
-def get_expiring_medicines():
+def _alert_response(section):
+    """从提醒快照返回某一类提醒，并通过响应头给出快照生成时间"""
+    response = jsonify(alerts.snapshot.get()[section])
+    response.headers['X-Snapshot-Generated-At'] = alerts.snapshot.generated_at.strftime('%Y-%m-%d %H:%M:%S')
+    return response
+
+# 设置药品或药箱的库存提醒阈值（low_stock_threshold 为空表示清除，改用上一级默认值；修改药品时须提供 expected_version）
+@main.route('/api/update_low_stock_threshold', methods=['PUT'])
+def api_update_low_stock_threshold():
     try:
-        # 使用视图查询即将过期的药品
-        expiring_medicines = ExpiringMedicinesView.query.all()
-        
+        data = request.json or {}
+        national_code = data.get('national_code')
+        cabinet_id = data.get('cabinet_id')
+        if bool(national_code) == (cabinet_id is not None):
+            return jsonify({'error': '请提供 national_code 或 cabinet_id 中的一个！'}), 400
+
+        threshold = data.get('low_stock_threshold')
+        if threshold is not None:
+            try:
+                threshold = int(threshold)
+            except (TypeError, ValueError):
+                return jsonify({'error': '库存提醒阈值必须是整数！'}), 400
+            if threshold < 0:
+                return jsonify({'error': '库存提醒阈值不能为负数！'}), 400
+
+        if national_code:
+            target = Medicine.query.get(national_code)
+            if not target:
+                return jsonify({'error': '药品不存在！'}), 404
+            conflict = _version_conflict(target, data)
+            if conflict:
+                return conflict
+        else:
+            target = MedicineCabinet.query.get(cabinet_id)
+            if not target:
+                return jsonify({'error': '药箱不存在！'}), 404
+
+        target.low_stock_threshold = threshold
+        db.session.commit()
+        result = {'message': '库存提醒阈值已更新！', 'low_stock_threshold': threshold}
+        if national_code:
+            result['version'] = target.version
+        return jsonify(result)
+    except StaleDataError:
+        db.session.rollback()
+        return jsonify({'error': '药品信息已被其他操作修改，请刷新后重试！'}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'更新库存提醒阈值失败：{str(e)}'}), 500
+
+# 补货预测：按近期日均消耗量估算可用天数，列出 within_days 天内将用完的药品及建议补货数量
+@main.route('/api/reorder_forecast', methods=['GET'])
+@conditional_get(Medicine, MedicineConsumption, MedicineCabinet, bucket=60)
+def get_reorder_forecast():
+    try:
+        args = request.args
+        within_days = parse_int_arg(args, 'within_days')
+        within_days = 14 if within_days is None else within_days
+        cover_days = parse_int_arg(args, 'cover_days')
+        cover_days = 30 if cover_days is None else cover_days
+        if within_days < 0 or cover_days < 0:
+            raise PaginationError('within_days 和 cover_days 不能为负数！')
+        limit = parse_limit(args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        now = datetime.datetime.now()
+        # 每种药品都有消耗统计（没有出库时为 0，预测中跳过），内连接即可；只取用到的列
+        rows = db.session.query(Medicine.national_code, Medicine.name, Medicine.remaining_quantity,
+                                MedicineConsumption, MedicineCabinet.location) \
+            .join(MedicineConsumption, MedicineConsumption.national_code == Medicine.national_code) \
+            .outerjoin(MedicineCabinet, MedicineCabinet.cabinet_id == Medicine.cabinet_id) \
+            .all()
+
         result = []
-        for medicine in expiring_medicines:
+        for national_code, name, remaining_quantity, consumption, cabinet_location in rows:
+            daily_rate, days_of_supply = supply_forecast(remaining_quantity, consumption, now)
+            if days_of_supply is None or days_of_supply > within_days:
+                continue
             result.append({
-                'national_code': medicine.national_code,
-                'name': medicine.name,
-                'expiry_date': medicine.expiry_date.strftime('%Y-%m-%d'),
-                'days_until_expiry': medicine.days_until_expiry,
-                'remaining_quantity': medicine.remaining_quantity,
-                'cabinet_location': medicine.cabinet_location
+                'national_code': national_code,
+                'name': name,
+                'remaining_quantity': remaining_quantity,
+                'daily_consumption': round(daily_rate, 2),
+                'days_of_supply': round(days_of_supply, 1),
+                'expected_stockout_date': (now + datetime.timedelta(days=days_of_supply)).strftime('%Y-%m-%d'),
+                # 补足 cover_days 天用量所需的数量
+                'suggested_quantity': max(math.ceil(daily_rate * cover_days - (remaining_quantity or 0)), 0),
+                'cabinet_location': cabinet_location or '未知'
             })
-        
+
+        # 最先用完的排在前面
+        result.sort(key=lambda x: (x['days_of_supply'], x['national_code']))
+        if limit is not None:
+            result = result[:limit]
         return jsonify(result)
-        
+    except Exception as e:
+        return jsonify({'error': f'获取补货预测失败：{str(e)}'}), 500
+
+# 获取药品的库存流水（支持游标分页，默认最新的在前）
+@main.route('/api/stock_movements/<string:national_code>', methods=['GET'])
+@conditional_get(StockMovement)
+def get_stock_movements(national_code):
+    try:
+        args = request.args
+        if not args.get('order'):
+            args = args.copy()
+            args['order'] = 'desc'
+        query = StockMovement.query.filter(StockMovement.national_code == national_code)
+        movement_type = args.get('type')
+        if movement_type:
+            query = query.filter(StockMovement.movement_type == movement_type)
+        movements, next_cursor, limit = keyset_paginate(query, args, {
+            'created_at': StockMovement.created_at
+        }, StockMovement.id)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    movements_data = [{
+        'id': m.id,
+        'movement_type': m.movement_type,
+        'quantity_change': m.quantity_change,
+        'quantity_after': m.quantity_after,
+        'created_at': m.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    } for m in movements]
+    return jsonify(page_response(movements_data, next_cursor, limit))
+
+# 获取即将过期的药品（30天内，读取提醒快照）
+@main.route('/api/expiring_medicines', methods=['GET'])
+@conditional_get(version=alerts.snapshot.etag_version)
+def get_expiring_medicines():
+    try:
+        return _alert_response('expiring_medicines')
     except Exception as e:
         return jsonify({'error': f'获取即将过期药品失败：{str(e)}'}), 500
 
-# 获取库存不足的药品（少于3个）
+# 获取库存不足的药品（低于药品、药箱或全局提醒阈值；提供 limit 时直接查询前 N 条，否则读取提醒快照）
 @main.route('/api/low_stock_medicines', methods=['GET'])
+@conditional_get(Medicine, MedicineCabinet, version=alerts.snapshot.etag_version)
 def get_low_stock_medicines():
     try:
-        # 查询所有库存少于3的药品
-        low_stock_medicines = Medicine.query.filter(
-            Medicine.remaining_quantity < 3,
-            Medicine.remaining_quantity > 0  # 只显示还有剩余的药品
-        ).all()
-        
-        result = []
-        for medicine in low_stock_medicines:
-            cabinet = MedicineCabinet.query.get(medicine.cabinet_id) if medicine.cabinet_id else None
-            
-            result.append({
-                'national_code': medicine.national_code,
-                'name': medicine.name,
-                'remaining_quantity': medicine.remaining_quantity,
-                'cabinet_location': cabinet.location if cabinet else '未知'
-            })
-        
-        # 按照剩余数量排序，最少的排在前面        
-        result.sort(key=lambda x: x['remaining_quantity'])
-        
-        return jsonify(result)
-        
+        limit = parse_limit(request.args)
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        if limit is not None:
+            rows = inventory.read_model.low_stock(limit) if inventory.enabled() \
+                else alerts.low_stock_query(limit=limit)
+            return jsonify(alerts.low_stock_items(rows))
+        return _alert_response('low_stock_medicines')
     except Exception as e:
         return jsonify({'error': f'获取库存不足药品失败：{str(e)}'}), 500
 
-# 获取已过期的药品
+# 获取已过期的药品（读取提醒快照）
 @main.route('/api/expired_medicines', methods=['GET'])
+@conditional_get(version=alerts.snapshot.etag_version)
 def get_expired_medicines():
     try:
-        current_date = datetime.datetime.now().date()
-        
-        # 查询所有有过期日期且已经过期的药品
-        expired_medicines = Medicine.query.filter(
-            Medicine.expiry_date.isnot(None),
-            Medicine.expiry_date < current_date,
-            Medicine.remaining_quantity > 0  # 只显示还有剩余的药品
-        ).all()
-        
+        return _alert_response('expired_medicines')
+    except Exception as e:
+        return jsonify({'error': f'获取已过期药品失败：{str(e)}'}), 500
+
+# 按任意天数窗口查询即将过期或已过期的药品（基于 expiry_date 索引的范围查询）
+@main.route('/api/expiry', methods=['GET'])
+@conditional_get(Medicine, MedicineCabinet, bucket='day')
+def get_expiry():
+    try:
+        args = request.args
+        today = datetime.date.today()
+        within_days = parse_int_arg(args, 'within_days')
+        if within_days is not None and within_days < 0:
+            raise PaginationError('within_days 不能为负数！')
+        expired = parse_bool_arg(args, 'expired')
+
+        if expired:
+            # 已过期：expiry_date < 今天；提供 within_days 时只看最近 N 天内过期的
+            start = today - datetime.timedelta(days=within_days) if within_days is not None else None
+            end = today
+            # 默认最近过期的排在前面
+            if not args.get('order'):
+                args = args.copy()
+                args['order'] = 'desc'
+        else:
+            if within_days is None:
+                within_days = alerts.EXPIRY_WARNING_DAYS
+            start, end = today, today + datetime.timedelta(days=within_days + 1)
+
+        sort_columns = {'expiry_date': Medicine.expiry_date}
+        if inventory.enabled():
+            records, next_cursor, limit = paginate_items(inventory.read_model.expiring(start, end), args,
+                                                         sort_columns, Medicine.national_code)
+            rows = [(record, inventory.read_model.location(record.cabinet_id)) for record in records]
+        else:
+            query = db.session.query(Medicine, MedicineCabinet.location) \
+                .outerjoin(MedicineCabinet, MedicineCabinet.cabinet_id == Medicine.cabinet_id) \
+                .filter(Medicine.remaining_quantity > 0, Medicine.expiry_date < end)
+            if start is not None:
+                query = query.filter(Medicine.expiry_date >= start)
+            rows, next_cursor, limit = keyset_paginate(query, args, sort_columns, Medicine.national_code,
+                                                       entity=lambda row: row[0])
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
         result = []
-        for medicine in expired_medicines:
-            days_expired = (current_date - medicine.expiry_date).days
-            
-            cabinet = MedicineCabinet.query.get(medicine.cabinet_id) if medicine.cabinet_id else None
-            
-            result.append({
+        for medicine, cabinet_location in rows:
+            item = {
                 'national_code': medicine.national_code,
                 'name': medicine.name,
-                'expiry_date': medicine.expiry_date.strftime('%Y-%m-%d'),
-                'days_expired': days_expired,
-                'remaining_quantity': medicine.remaining_quantity,
-                'cabinet_location': cabinet.location if cabinet else '未知'
-            })
-        
-        # 按照过期时间排序，最近过期的排在前面
-        result.sort(key=lambda x: x['days_expired'])
-        
-        return jsonify(result)
-        
+                'expiry_date': medicine.expiry_date.strftime('%Y-%m-%d')
+            }
+            days = (medicine.expiry_date - today).days
+            if expired:
+                item['days_expired'] = -days
+            else:
+                item['days_until_expiry'] = days
+            item['remaining_quantity'] = medicine.remaining_quantity
+            item['cabinet_location'] = cabinet_location or '未知'
+            result.append(item)
+        return jsonify(page_response(result, next_cursor, limit))
     except Exception as e:
-        return jsonify({'error': f'获取已过期药品失败：{str(e)}'}), 500
+        return jsonify({'error': f'获取药品有效期信息失败：{str(e)}'}), 500
+
+DASHBOARD_SECTIONS = [
+    'members', 'medicines', 'prescriptions', 'current_medications', 'historical_medications',
+    'expiring_medicines', 'low_stock_medicines', 'expired_medicines'
+]
+# 以用药记录为数据来源的部分，共用同一次查询
+_MEDICATION_SECTIONS = {'current_medications', 'historical_medications'}
+
+def _select_fields(item, fields):
+    return {key: value for key, value in item.items() if key in fields}
+
+# 首页汇总：一次请求返回多个部分，各部分共用查询，避免页面分别请求并重复扫描同一张表
+@main.route('/api/dashboard', methods=['GET'])
+@conditional_get(Medicine, OTC, PrescriptionMedicine, MedicineCabinet, MedicineAdministration, Member, Prescription,
+                 bucket=60, version=alerts.snapshot.etag_version)
+def get_dashboard():
+    sections = request.args.get('sections')
+    sections = [name.strip() for name in sections.split(',') if name.strip()] if sections else DASHBOARD_SECTIONS
+    unknown = [name for name in sections if name not in DASHBOARD_SECTIONS]
+    if unknown:
+        return jsonify({'error': f'不支持的部分：{", ".join(unknown)}，可选：{", ".join(DASHBOARD_SECTIONS)}'}), 400
+    sections = set(sections)
+
+    current_date = datetime.datetime.now()
+    result = {}
+
+    try:
+        if 'medicines' in sections:
+            if inventory.enabled():
+                rows = inventory.read_model.medicines()
+            else:
+                rows = Medicine.join_type(db.session.query(*projection_columns(MEDICINE_FIELDS, MEDICINE_LIST_FIELDS))) \
+                    .order_by(Medicine.national_code)
+            result['medicines'] = [render_row(row, MEDICINE_FIELDS, MEDICINE_LIST_FIELDS) for row in rows]
+
+        # 三类提醒直接取自定时生成的提醒快照
+        if sections & set(alerts.ALERT_SECTIONS):
+            result.update(alerts.snapshot.get())
+            result['alerts_generated_at'] = alerts.snapshot.generated_at.strftime('%Y-%m-%d %H:%M:%S')
+
+        if sections & _MEDICATION_SECTIONS:
+            # 当前与历史用药一次取出，再按结束时间拆分
+            rows = _medications_by_member(or_(
+                and_(MedicineAdministration.start_time <= current_date,
+                     MedicineAdministration.active_filter(current_date)),
+                MedicineAdministration.historical_filter(current_date)
+            )).all()
+            current_rows = [row for row in rows if MedicineAdministration.is_active(row, current_date)]
+            historical_rows = [row for row in rows if not MedicineAdministration.is_active(row, current_date)]
+            result['current_medications'] = list(_group_medications(current_rows, _current_medication_info))
+            result['historical_medications'] = list(_group_medications(historical_rows, _historical_medication_info))
+
+        if 'members' in sections:
+            query = db.session.query(*projection_columns(MEMBER_FIELDS, MEMBER_LIST_FIELDS))
+            result['members'] = [render_row(row, MEMBER_FIELDS, MEMBER_LIST_FIELDS)
+                                 for row in query.order_by(Member.security_id)]
+
+        if 'prescriptions' in sections:
+            result['prescriptions'] = [{
+                'prescription_id': prescription_id,
+                'time': time or '未知',
+                'doctor': doctor
+            } for prescription_id, time, doctor in db.session.query(
+                Prescription.prescription_id, Prescription.time, Prescription.doctor).order_by(Prescription.prescription_id)]
+    except PaginationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'获取汇总信息失败：{str(e)}'}), 500
+
+    # 按部分筛选返回字段：fields[部分名]=字段1,字段2；用药部分作用于每条用药信息
+    dashboard = {}
+    for name in DASHBOARD_SECTIONS:
+        if name not in sections:
+            continue
+        data = result[name]
+        fields = request.args.get(f'fields[{name}]')
+        if fields:
+            fields = {field.strip() for field in fields.split(',')}
+            if name in _MEDICATION_SECTIONS:
+                data = [dict(group, medications=[_select_fields(m, fields) for m in group['medications']]) for group in data]
+            else:
+                data = [_select_fields(item, fields) for item in data]
+        dashboard[name] = data
+    if 'alerts_generated_at' in result:
+        dashboard['alerts_generated_at'] = result['alerts_generated_at']
+    return json_response(dashboard)
+
+# 获取数据库连接池运行统计（需登录）
+@main.route('/api/admin/pool_stats', methods=['GET'])
+def get_pool_stats():
+    if 'username' not in session:
+        return jsonify({'error': '请先登录！'}), 401
+    try:
+        stats = pool_stats.snapshot(db.engine.pool)
+        options = current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        stats['config'] = {key: value for key, value in options.items() if key != 'poolclass'}
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({'error': f'获取连接池统计失败：{str(e)}'}), 500
+
+# 获取后台定时任务状态：本进程是否为领导者、租约到期时间、各任务下次运行时间（需登录）
+@main.route('/api/admin/scheduler', methods=['GET'])
+def get_scheduler_status():
+    if 'username' not in session:
+        return jsonify({'error': '请先登录！'}), 401
+    try:
+        return jsonify(scheduler_state.state.status())
+    except Exception as e:
+        return jsonify({'error': f'获取定时任务状态失败：{str(e)}'}), 500
+
+# 获取药品库存读模型的状态与每项内存估算（需登录）
+@main.route('/api/admin/inventory', methods=['GET'])
+def get_inventory_stats():
+    if 'username' not in session:
+        return jsonify({'error': '请先登录！'}), 401
+    try:
+        return jsonify(dict(inventory.read_model.stats(), enabled=inventory.enabled()))
+    except Exception as e:
+        return jsonify({'error': f'获取读模型状态失败：{str(e)}'}), 500
+
+# 以 Prometheus 文本格式输出各接口的请求耗时与 SQL 统计
+@main.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(endpoint_metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 # 修改成员信息（使用存储过程）
 @main.route('/api/update_member', methods=['PUT'])
@@ -1048,6 +1607,9 @@ def api_update_member():
             # 获取存储过程的返回结果
             result_data = result.fetchone()
             if result_data and result_data[0] == 'success':
+                # 存储过程会同步修改关联表中的成员ID，ORM 无法自动识别
+                for table in (Member.__tablename__, MedicineAdministration.__tablename__, Prescription.__tablename__):
+                    mark_changed(db.session, table)
                 db.session.commit()
                 return jsonify({'message': result_data[1]})
             else:
@@ -1071,6 +1633,7 @@ def api_update_member():
 
 # 获取成员详细信息（用于编辑页面）
 @main.route('/api/member_details_for_edit/<string:security_id>', methods=['GET'])
+@conditional_get(Member, MedicineAdministration, Prescription)
 def get_member_details_for_edit(security_id):
     try:
         member = Member.query.get(security_id)
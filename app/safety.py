@@ -0,0 +1,201 @@
+import re
+import threading
+
+from . import db
+from .cache import table_versions
+from .models import Medicine, MedicineAdministration, Member
+from .search import normalize
+
+# 过敏原 -> 药品名称中表示含有该成分或同类药物的关键词（示例规则，仅用于提醒，不能代替医嘱）
+ALLERGEN_RULES = {
+    '青霉素': ('青霉素', '西林'),  # 阿莫西林、氨苄西林等
+    '头孢': ('头孢',),
+    '磺胺': ('磺胺', '新诺明'),
+    '阿司匹林': ('阿司匹林', '乙酰水杨酸'),
+    '布洛芬': ('布洛芬',),
+    '对乙酰氨基酚': ('对乙酰氨基酚', '扑热息痛'),
+    '喹诺酮': ('沙星',),  # 左氧氟沙星等
+}
+
+# 基础疾病 -> (药品名称关键词, 原因)
+CONTRAINDICATION_RULES = {
+    '高血压': (('麻黄', '甘草'), '可能升高血压'),
+    '胃炎': (('阿司匹林', '布洛芬'), '非甾体抗炎药刺激胃黏膜'),
+    '胃溃疡': (('阿司匹林', '布洛芬'), '非甾体抗炎药刺激胃黏膜'),
+    '哮喘': (('阿司匹林', '普萘洛尔'), '可能诱发支气管痉挛'),
+    '糖尿病': (('葡萄糖', '蔗糖'), '含糖，影响血糖'),
+}
+
+# 成员过敏原、基础疾病的分隔符
+_SEPARATORS = re.compile(r'[，,、;；/\s]+|和|及')
+# 过敏原原文至少这么长才直接作为药品名称关键词（避免单字误报）
+MIN_DIRECT_KEYWORD = 2
+
+
+def member_terms(allergen, underlying_disease):
+    """把成员的过敏原、基础疾病拆分为 [(类型, 原文词, 关键词, 原因)]"""
+    terms = []
+    for token in filter(None, (normalize(t) for t in _SEPARATORS.split(allergen or ''))):
+        keywords = {keyword for name, rule in ALLERGEN_RULES.items() if name in token for keyword in rule}
+        direct = token.replace('过敏', '')
+        if len(direct) >= MIN_DIRECT_KEYWORD:
+            # 过敏原直接写成药品名称（如"阿莫西林"）时，按原文匹配
+            keywords.add(direct)
+        terms.extend(('allergen', token, keyword, '过敏') for keyword in sorted(keywords))
+    for token in filter(None, (normalize(t) for t in _SEPARATORS.split(underlying_disease or ''))):
+        for name, (rule, reason) in CONTRAINDICATION_RULES.items():
+            if name in token:
+                terms.extend(('contraindication', token, keyword, reason) for keyword in rule)
+    return terms
+
+
+class SafetyIndex:
+    """成员过敏原、基础疾病的倒排索引：关键词 -> {成员: [(类型, 原文词, 原因)]}
+
+    所有关键词预编译为一个正则表达式，药品名称只匹配一次，结果按药品缓存。
+    成员、药品写入提交后只记录被修改的主键，下一次检查前重新加载这些成员、丢弃这些药品的缓存；
+    关键词集合变化时才重新编译正则表达式。索引只在当前进程内有效。
+    """
+
+    def __init__(self):
+        self._members = {}  # 成员 -> [(类型, 原文词, 关键词, 原因)]
+        self._keywords = {}  # 关键词 -> {成员: [(类型, 原文词, 原因)]}
+        self._pattern = None
+        self._pattern_keywords = frozenset()
+        self._medicines = {}  # 药品编码 -> (药品名称, 命中的关键词)
+        self._pending_members = set()
+        self._pending_medicines = set()
+        self._members_stale = True
+        self._lock = threading.Lock()
+
+    def on_commit(self, changes):
+        with self._lock:
+            if Member.__tablename__ in changes:
+                keys = changes[Member.__tablename__]
+                if keys is None:
+                    self._members_stale = True
+                else:
+                    self._pending_members.update(keys)
+            if Medicine.__tablename__ in changes:
+                keys = changes[Medicine.__tablename__]
+                if keys is None:
+                    self._medicines.clear()
+                else:
+                    self._pending_medicines.update(keys)
+
+    def _sync(self):
+        # 调用方持有 self._lock
+        for national_code in self._pending_medicines:
+            self._medicines.pop(national_code, None)
+        self._pending_medicines.clear()
+
+        if self._members_stale:
+            self._members_stale = False
+            self._pending_members.clear()
+            self._members.clear()
+            self._keywords.clear()
+            rows = db.session.query(Member.security_id, Member.allergen, Member.underlying_disease)
+        elif self._pending_members:
+            keys, self._pending_members = list(self._pending_members), set()
+            for security_id in keys:
+                self._remove_member(security_id)
+            rows = db.session.query(Member.security_id, Member.allergen, Member.underlying_disease) \
+                .filter(Member.security_id.in_(keys))
+        else:
+            rows = []
+        for security_id, allergen, underlying_disease in rows:
+            self._add_member(security_id, member_terms(allergen, underlying_disease))
+
+        keywords = frozenset(self._keywords)
+        if keywords != self._pattern_keywords:
+            # 较长的关键词优先；前瞻匹配使互相重叠的关键词都能命中
+            alternatives = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+            self._pattern = re.compile(f'(?=({alternatives}))') if keywords else None
+            self._pattern_keywords = keywords
+            self._medicines.clear()
+
+    def _add_member(self, security_id, terms):
+        if not terms:
+            return
+        self._members[security_id] = terms
+        for kind, term, keyword, reason in terms:
+            self._keywords.setdefault(keyword, {}).setdefault(security_id, []).append((kind, term, reason))
+
+    def _remove_member(self, security_id):
+        for _, _, keyword, _ in self._members.pop(security_id, ()):
+            members = self._keywords.get(keyword)
+            if members is not None:
+                members.pop(security_id, None)
+                if not members:
+                    del self._keywords[keyword]
+
+    def _medicine_keywords(self, national_code, name):
+        cached = self._medicines.get(national_code)
+        if cached is not None and cached[0] == name:
+            return cached[1]
+        text = normalize(name)
+        keywords = frozenset(m.group(1) for m in self._pattern.finditer(text)) if self._pattern else frozenset()
+        self._medicines[national_code] = (name, keywords)
+        return keywords
+
+    def _conflicts(self, security_id, national_code, name):
+        conflicts = []
+        if security_id not in self._members:
+            return conflicts
+        for keyword in sorted(self._medicine_keywords(national_code, name)):
+            for kind, term, reason in self._keywords[keyword].get(security_id, ()):
+                conflicts.append({'type': kind, 'member_term': term, 'matched': keyword, 'reason': reason})
+        return conflicts
+
+    def check(self, security_id, items):
+        """检查一位成员使用 items（[(药品编码, 药品名称)]）的冲突，返回 {药品编码: [冲突]}，只包含有冲突的药品"""
+        table_versions.sync()
+        with self._lock:
+            self._sync()
+            result = {}
+            for national_code, name in items:
+                conflicts = self._conflicts(security_id, national_code, name)
+                if conflicts:
+                    result[national_code] = conflicts
+            return result
+
+    def audit(self, rows):
+        """一次检查多条 (成员, 药品编码, 药品名称)，返回 [(行, 冲突)]，只包含有冲突的行"""
+        table_versions.sync()
+        with self._lock:
+            self._sync()
+            result = []
+            for row in rows:
+                conflicts = self._conflicts(*row[:3])
+                if conflicts:
+                    result.append((row, conflicts))
+            return result
+
+    def stats(self):
+        return {'members': len(self._members), 'keywords': len(self._keywords), 'cached_medicines': len(self._medicines)}
+
+
+safety_index = SafetyIndex()
+
+
+def check_medicines(security_id, national_codes):
+    """按药品编码检查一位成员的冲突，返回 {药品编码: [冲突]}（一次查询取出药品名称）"""
+    rows = db.session.query(Medicine.national_code, Medicine.name) \
+        .filter(Medicine.national_code.in_(list(national_codes))).all() if national_codes else []
+    return safety_index.check(security_id, rows)
+
+
+def audit_active_administrations(current_time):
+    """一次查询取出所有正在进行的用药，逐条检查冲突"""
+    rows = db.session.query(MedicineAdministration.security_id, MedicineAdministration.national_code,
+                            Medicine.name, Member.name) \
+        .join(Medicine, Medicine.national_code == MedicineAdministration.national_code) \
+        .join(Member, Member.security_id == MedicineAdministration.security_id) \
+        .filter(MedicineAdministration.active_filter(current_time)) \
+        .order_by(MedicineAdministration.security_id, MedicineAdministration.national_code) \
+        .all()
+    return safety_index.audit(rows)
+
+
+def init_safety(app):
+    table_versions.subscribe(safety_index.on_commit)
@@ -0,0 +1,254 @@
+import atexit
+import datetime
+import functools
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from flask import current_app
+from sqlalchemy import or_
+
+from . import db
+from .models import SchedulerLease
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能使用数据库租约
+    fcntl = None
+
+LEASE_NAME = 'scheduler'
+LEASE_SECONDS = 30
+RENEW_SECONDS = 10
+
+# 每个进程一个调度器，在处理第一个请求时启动（见 init_scheduler）
+scheduler = BackgroundScheduler()
+
+
+class LeaseLeadership:
+    """数据库租约：用条件 UPDATE 抢占或续约 scheduler_lease 中的一行
+
+    租约过期前只有持有者能续约；持有者退出（或失去数据库连接）后，租约过期即由其他进程接替。
+    各进程的时钟偏差应远小于租约有效期。
+    """
+
+    def __init__(self, owner, lease_seconds=LEASE_SECONDS, renew_seconds=RENEW_SECONDS):
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = renew_seconds
+        self.expires_at = None
+        self._valid_until = 0.0
+
+    def renew(self):
+        table = SchedulerLease.__table__
+        started = time.monotonic()
+        now = datetime.datetime.now()
+        expires_at = now + datetime.timedelta(seconds=self.lease_seconds)
+        try:
+            acquired = db.session.execute(
+                table.update().where(table.c.name == LEASE_NAME,
+                                     or_(table.c.owner == self.owner, table.c.expires_at < now))
+                .values(owner=self.owner, expires_at=expires_at)
+            ).rowcount == 1
+            if not acquired and db.session.query(SchedulerLease.name).filter_by(name=LEASE_NAME).first() is None:
+                # 第一次运行还没有租约行；并发插入时只有一个进程成功
+                db.session.execute(table.insert().values(name=LEASE_NAME, owner=self.owner, expires_at=expires_at))
+                acquired = True
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._lose()
+            raise
+
+        if acquired:
+            self.expires_at = expires_at
+            # 本地按单调时钟判断，并留出一个续约间隔的余量
+            self._valid_until = started + self.lease_seconds - self.renew_seconds
+        else:
+            self._lose()
+        return acquired
+
+    def _lose(self):
+        self.expires_at = None
+        self._valid_until = 0.0
+
+    def is_leader(self):
+        return time.monotonic() < self._valid_until
+
+    def release(self):
+        if self.expires_at is None:
+            return
+        table = SchedulerLease.__table__
+        self._lose()
+        db.session.execute(table.update().where(table.c.name == LEASE_NAME, table.c.owner == self.owner)
+                           .values(expires_at=datetime.datetime.now()))
+        db.session.commit()
+
+    def status(self):
+        return {'lock': 'database', 'owner': self.owner, 'leader': self.is_leader(),
+                'lease_expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S') if self.expires_at else None}
+
+
+class FileLeadership:
+    """本机文件锁：持有排他锁的进程为领导者，进程退出时由操作系统释放，其他进程下次续约时接替"""
+
+    def __init__(self, owner, path):
+        if fcntl is None:
+            raise RuntimeError('当前系统不支持文件锁，请将 SCHEDULER_LEADER_LOCK 设为 database')
+        self.owner = owner
+        self.path = path
+        self._file = None
+
+    def renew(self):
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def is_leader(self):
+        return self._file is not None
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def status(self):
+        return {'lock': 'file', 'path': self.path, 'owner': self.owner, 'leader': self.is_leader()}
+
+
+class SchedulerState:
+    """当前进程中调度器的状态：领导者选举方式与只由领导者执行的任务"""
+
+    def __init__(self):
+        self.leadership = None
+        self.leader_jobs = set()
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def is_leader(self):
+        return self.leadership is not None and self.leadership.is_leader()
+
+    def status(self):
+        status = {'running': scheduler.running, 'skipped_leader_jobs': self.skipped}
+        if self.leadership is not None:
+            status.update(self.leadership.status())
+        jobs = []
+        for job in scheduler.get_jobs():
+            # 调度器未启动时任务尚未计算下次运行时间，没有 next_run_time 属性
+            next_run_time = getattr(job, 'next_run_time', None)
+            jobs.append({
+                'id': job.id,
+                'leader_only': job.id in self.leader_jobs,
+                'next_run_time': next_run_time.strftime('%Y-%m-%d %H:%M:%S') if next_run_time else None
+            })
+        status['jobs'] = jobs
+        return status
+
+
+state = SchedulerState()
+
+
+def add_leader_job(app, func, trigger, job_id, **trigger_args):
+    """注册只需在所有进程中运行一次的任务：每个进程都注册，触发时只有领导者执行"""
+    @functools.wraps(func)
+    def run():
+        if not state.is_leader():
+            state.record_skip()
+            return
+        with app.app_context():
+            try:
+                func()
+            except Exception as e:
+                app.logger.error(f'定时任务 {job_id} 执行失败：{str(e)}')
+            finally:
+                db.session.remove()
+
+    state.leader_jobs.add(job_id)
+    scheduler.add_job(run, trigger, id=job_id, replace_existing=True, coalesce=True, **trigger_args)
+
+
+def _renew_job(app):
+    with app.app_context():
+        was_leader = state.is_leader()
+        try:
+            leader = state.leadership.renew()
+        except Exception as e:
+            app.logger.error(f'定时任务领导者续约失败：{str(e)}')
+            leader = False
+        finally:
+            db.session.remove()
+        if leader != was_leader:
+            app.logger.info(f'定时任务领导者：{state.leadership.owner} {"成为领导者" if leader else "不再是领导者"}')
+
+
+def _backfill_end_times():
+    # 批量导入等绕过 ORM 事件的写入可能留下 end_time 为空的用药记录
+    from .schema import backfill_end_times
+    backfill_end_times()
+
+
+def _prune_changes():
+    # 各进程读取变更日志后，过期的记录不再需要
+    from .cache import CHANGE_RETENTION_SECONDS, prune_changes
+    prune_changes(current_app.config.get('TABLE_CHANGE_RETENTION_SECONDS', CHANGE_RETENTION_SECONDS))
+
+
+def _owner():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def start_scheduler(app):
+    """在当前进程中启动调度器（在处理请求的进程中调用；fork 之后、reloader 子进程中才会调用）"""
+    if scheduler.running or not app.config.get('SCHEDULER_ENABLED', True):
+        return
+    lease_seconds = app.config.get('SCHEDULER_LEASE_SECONDS', LEASE_SECONDS)
+    renew_seconds = app.config.get('SCHEDULER_RENEW_SECONDS', RENEW_SECONDS)
+    if app.config.get('SCHEDULER_LEADER_LOCK', 'database') == 'file':
+        path = app.config.get('SCHEDULER_LOCK_FILE') or os.path.join(tempfile.gettempdir(), 'smart_medibox_scheduler.lock')
+        state.leadership = FileLeadership(_owner(), path)
+    else:
+        state.leadership = LeaseLeadership(_owner(), lease_seconds, renew_seconds)
+
+    # 续约任务每个进程都运行；启动时立即尝试一次
+    scheduler.add_job(_renew_job, 'interval', seconds=renew_seconds, args=[app], id='scheduler_renew',
+                      replace_existing=True, coalesce=True, next_run_time=datetime.datetime.now())
+    scheduler.start()
+
+    def shutdown():
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+        with app.app_context():
+            try:
+                state.leadership.release()
+            except Exception:
+                pass
+            finally:
+                db.session.remove()
+
+    atexit.register(shutdown)
+
+
+def init_scheduler(app):
+    """注册只由领导者执行的任务，并在处理第一个请求时启动调度器
+
+    不在导入或 create_app 时启动：gunicorn 预加载后 fork 出的各 worker、调试模式下 reloader 的父进程、
+    flask 命令行都不会因此多启动一个调度器；需要运行任务的每个 worker 各自启动一个，由领导者执行只需运行一次的任务。
+    """
+    add_leader_job(app, _backfill_end_times, 'interval', 'backfill_end_times', hours=1)
+    add_leader_job(app, _prune_changes, 'interval', 'prune_table_changes', minutes=10)
+    app.before_first_request(lambda: start_scheduler(app))
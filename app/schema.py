@@ -0,0 +1,108 @@
+import datetime
+
+from sqlalchemy import and_, exists, inspect, literal, or_, select, text
+from sqlalchemy.schema import CreateIndex
+
+from . import db
+from .models import ExpiringMedicinesView, LONG_TERM, Medicine, MedicineAdministration, MedicineConsumption, compute_end_time
+
+
+def _column_ddl(column, dialect):
+    ddl = f'{column.name} {column.type.compile(dialect=dialect)}'
+    if column.server_default is not None:
+        ddl += f' DEFAULT {column.server_default.arg}'
+    ddl += ' NULL' if column.nullable else ' NOT NULL'
+    return ddl
+
+
+def upgrade_schema():
+    """按模型定义补齐已有数据库中缺失的表、列和索引（可重复执行）"""
+    engine = db.engine
+    # 视图由数据库维护，不在这里创建
+    tables = [t for t in db.metadata.sorted_tables if t is not ExpiringMedicinesView.__table__]
+    db.metadata.create_all(bind=engine, tables=tables)
+
+    inspector = inspect(engine)
+    changes = []
+    with engine.begin() as conn:
+        for table in tables:
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, engine.dialect)}'))
+                    changes.append(f'{table.name}.{column.name}')
+
+            existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    conn.execute(CreateIndex(index))
+                    changes.append(index.name)
+    return changes
+
+
+def backfill_end_times(batch_size=1000):
+    """为已有用药记录补算 end_time（按主键分批处理），返回更新的行数"""
+    table = MedicineAdministration.__table__
+    statement = table.update().where(
+        table.c.security_id == db.bindparam('b_security_id'),
+        table.c.national_code == db.bindparam('b_national_code')
+    ).values(end_time=db.bindparam('b_end_time'))
+
+    updated = 0
+    last_key = None
+    while True:
+        query = db.session.query(
+            MedicineAdministration.security_id,
+            MedicineAdministration.national_code,
+            MedicineAdministration.start_time,
+            MedicineAdministration.lasting_time
+        ).filter(
+            MedicineAdministration.end_time.is_(None),
+            MedicineAdministration.start_time.isnot(None),
+            MedicineAdministration.lasting_time.isnot(None),
+            MedicineAdministration.lasting_time.notin_([LONG_TERM, ''])
+        )
+        if last_key:
+            query = query.filter(or_(
+                MedicineAdministration.security_id > last_key[0],
+                and_(MedicineAdministration.security_id == last_key[0],
+                     MedicineAdministration.national_code > last_key[1])
+            ))
+        rows = query.order_by(MedicineAdministration.security_id, MedicineAdministration.national_code) \
+            .limit(batch_size).all()
+        if not rows:
+            break
+        last_key = (rows[-1].security_id, rows[-1].national_code)
+
+        batch = []
+        for security_id, national_code, start_time, lasting_time in rows:
+            end_time = compute_end_time(start_time, lasting_time)
+            if end_time is not None:
+                batch.append({'b_security_id': security_id, 'b_national_code': national_code, 'b_end_time': end_time})
+        if batch:
+            db.session.execute(statement, batch)
+            updated += len(batch)
+        db.session.commit()
+    return updated
+
+
+def backfill_consumptions():
+    """为没有消耗统计的药品插入空的消耗统计（出库时的加锁读取须命中已有的行，见 stock.create_consumptions），返回插入的行数"""
+    table = MedicineConsumption.__table__
+    now = datetime.datetime.now()
+    missing = select(Medicine.national_code, literal(0.0), literal(0), literal(now), literal(now)) \
+        .where(~exists().where(table.c.national_code == Medicine.national_code))
+    result = db.session.execute(table.insert().from_select(
+        ['national_code', 'decayed_quantity', 'total_quantity', 'first_at', 'updated_at'], missing))
+    db.session.commit()
+    return result.rowcount
+
+
+def register_commands(app):
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """补齐缺失的表、列、索引并回填派生字段"""
+        for change in upgrade_schema():
+            print(f'已添加：{change}')
+        print(f'已回填 {backfill_end_times()} 条用药记录的结束时间')
+        print(f'已为 {backfill_consumptions()} 种药品创建消耗统计')
@@ -0,0 +1,304 @@
+import bisect
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from . import db
+from .cache import table_versions
+from .models import Manufacture, Medicine
+
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+RESULT_CACHE_SIZE = 1024
+
+# 匹配方式，排序时数值越小越靠前
+EXACT, PREFIX, SUBSTRING, FUZZY = range(4)
+MATCH_NAMES = {EXACT: 'exact', PREFIX: 'prefix', SUBSTRING: 'substring', FUZZY: 'fuzzy'}
+
+# 模糊匹配时至少需要命中的查询二元组比例（容忍输错、漏输个别字）
+FUZZY_MIN_OVERLAP = 0.6
+
+# 类型 -> (模型, 被索引的字段（按优先级）, 返回的字段)
+# 字段为 (字段名, 是否支持中间匹配)：编码只按前缀匹配，名称还支持中间片段与模糊匹配
+_KINDS = {
+    'medicine': (Medicine, (('national_code', False), ('name', True), ('manufacture_name', True)),
+                 ('national_code', 'name', 'manufacture_name', 'remaining_quantity')),
+    'manufacture': (Manufacture, (('manufacture_name', True),), ('manufacture_name', 'address')),
+}
+
+
+def normalize(text):
+    """全角转半角、忽略大小写和首尾空白"""
+    return unicodedata.normalize('NFKC', text or '').strip().lower()
+
+
+def _grams(text):
+    """单字与相邻二元组：单字查询用单字倒排，其余用二元组倒排"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _query_grams(query):
+    return {query} if len(query) == 1 else {query[i:i + 2] for i in range(len(query) - 1)}
+
+
+class SearchIndex:
+    """药品与生产厂家的内存索引
+
+    - 精确与前缀匹配：每个字段一个按 (值, 主键) 排序的列表，二分查找后只取前 limit 项；
+    - 中间片段与模糊匹配：对字段的不同取值（而不是每条记录）建 n-gram 倒排，药品名称大量重复时候选很少。
+    按匹配方式逐级查找，凑够 limit 条即停止。
+
+    写入提交后只记录被修改的主键，下一次搜索前用 IN 查询重新加载这些行；
+    修改范围未知时整表重建。索引只在当前进程内有效。
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self._docs = {}  # (类型, 主键) -> (返回数据, 各字段归一化后的值)
+        self._sorted = {}  # (类型, 字段序号) -> [(值, 主键)]，有序
+        self._values = {}  # (类型, 字段序号) -> {值: [主键]}，主键有序
+        self._postings = {}  # gram -> {(类型, 字段序号, 值)}
+        self._pending = {kind: set() for kind in _KINDS}
+        self._stale = set(_KINDS)  # 需要整表重建的类型
+        self._lock = threading.Lock()
+        # 结果缓存与合并中的查询：相同的查询在同一版本的索引上只计算一次
+        self._results = OrderedDict()
+        self._inflight = {}
+        self._results_lock = threading.Lock()
+
+    # ---- 增量维护 ----
+
+    def on_commit(self, changes):
+        for kind, (model, _, _) in _KINDS.items():
+            if model.__tablename__ not in changes:
+                continue
+            keys = changes[model.__tablename__]
+            with self._lock:
+                if keys is None:
+                    self._stale.add(kind)
+                else:
+                    self._pending[kind].update(keys)
+
+    def _sync(self):
+        # 调用方持有 self._lock
+        changed = False
+        for kind in _KINDS:
+            if kind in self._stale:
+                self._stale.discard(kind)
+                self._pending[kind].clear()
+                self._rebuild(kind)
+                changed = True
+            elif self._pending[kind]:
+                keys, self._pending[kind] = self._pending[kind], set()
+                self._reload(kind, keys)
+                changed = True
+        if changed:
+            self.generation += 1
+
+    def _rows(self, kind, keys=None):
+        model, _, columns = _KINDS[kind]
+        key_column = model.__mapper__.primary_key[0]
+        query = db.session.query(key_column, *[getattr(model, c) for c in columns])
+        if keys is not None:
+            query = query.filter(key_column.in_(keys))
+        return query
+
+    def _rebuild(self, kind):
+        for doc_id in [doc_id for doc_id in self._docs if doc_id[0] == kind]:
+            del self._docs[doc_id]
+        for gram in list(self._postings):
+            posting = {entry for entry in self._postings[gram] if entry[0] != kind}
+            if posting:
+                self._postings[gram] = posting
+            else:
+                del self._postings[gram]
+
+        rows = sorted(self._rows(kind), key=lambda row: row[0])
+        for row in rows:
+            self._docs[kind, row[0]] = self._document(kind, row)
+        # 整表重建时排序一次，不逐条插入
+        for field_rank, (_, substring) in enumerate(_KINDS[kind][1]):
+            entries, values = [], {}
+            for row in rows:
+                value = self._docs[kind, row[0]][1][field_rank]
+                entries.append((value, row[0]))
+                values.setdefault(value, []).append(row[0])
+            entries.sort()
+            self._sorted[kind, field_rank] = entries
+            self._values[kind, field_rank] = values
+            if substring:
+                for value in values:
+                    for gram in _grams(value):
+                        self._postings.setdefault(gram, set()).add((kind, field_rank, value))
+
+    def _reload(self, kind, keys):
+        keys = list(keys)
+        for key in keys:
+            self._remove(kind, key)
+        # 分批查询，避免 IN 列表过长
+        for start in range(0, len(keys), 500):
+            for row in self._rows(kind, keys[start:start + 500]):
+                self._add(kind, row)
+
+    def _document(self, kind, row):
+        _, fields, columns = _KINDS[kind]
+        data = dict(zip(columns, row[1:]))
+        return data, tuple(normalize(data.get(field)) for field, _ in fields)
+
+    def _add(self, kind, row):
+        key = row[0]
+        data, values = self._docs[kind, key] = self._document(kind, row)
+        for field_rank, (_, substring) in enumerate(_KINDS[kind][1]):
+            value = values[field_rank]
+            bisect.insort(self._sorted.setdefault((kind, field_rank), []), (value, key))
+            keys = self._values.setdefault((kind, field_rank), {}).setdefault(value, [])
+            bisect.insort(keys, key)
+            if substring and len(keys) == 1:
+                for gram in _grams(value):
+                    self._postings.setdefault(gram, set()).add((kind, field_rank, value))
+
+    def _remove(self, kind, key):
+        doc = self._docs.pop((kind, key), None)
+        if doc is None:
+            return
+        for field_rank, (_, substring) in enumerate(_KINDS[kind][1]):
+            value = doc[1][field_rank]
+            entries = self._sorted[kind, field_rank]
+            del entries[bisect.bisect_left(entries, (value, key))]
+            values = self._values[kind, field_rank]
+            keys = values[value]
+            del keys[bisect.bisect_left(keys, key)]
+            if keys:
+                continue
+            # 该值已没有记录，从倒排中去掉
+            del values[value]
+            if substring:
+                for gram in _grams(value):
+                    posting = self._postings.get(gram)
+                    if posting is not None:
+                        posting.discard((kind, field_rank, value))
+                        if not posting:
+                            del self._postings[gram]
+
+    # ---- 查询 ----
+
+    def search(self, query, kinds=None, limit=DEFAULT_SEARCH_LIMIT):
+        """返回 [(类型, 匹配方式, 返回数据)]，按匹配方式、命中字段优先级、字段值排序"""
+        query = normalize(query)
+        kinds = tuple(sorted(kinds or _KINDS))
+        if not query:
+            return []
+        # 先读取其他进程的变更记录：其写入在此时通知到 on_commit
+        table_versions.sync()
+        with self._lock:
+            if self._stale or any(self._pending.values()):
+                self._sync()
+            generation = self.generation
+
+        key = (query, kinds, limit)
+        with self._results_lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] == generation:
+                self._results.move_to_end(key)
+                return cached[1]
+            entry = self._inflight.get(key)
+            leader = entry is None or entry[0] != generation
+            if leader:
+                entry = (generation, threading.Event())
+                self._inflight[key] = entry
+
+        if not leader:
+            # 同一查询正在计算（连续按键、重复请求时常见），等待其结果
+            entry[1].wait()
+            with self._results_lock:
+                cached = self._results.get(key)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+
+        try:
+            with self._lock:
+                results = self._search(query, kinds, limit)
+            with self._results_lock:
+                self._results[key] = (generation, results)
+                self._results.move_to_end(key)
+                while len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+        finally:
+            if leader:
+                with self._results_lock:
+                    if self._inflight.get(key) is entry:
+                        del self._inflight[key]
+                entry[1].set()
+        return results
+
+    def _search(self, query, kinds, limit):
+        # 调用方持有 self._lock
+        ranked = {}  # (类型, 主键) -> 排序键，同一记录只保留最好的匹配
+
+        # 精确与前缀：每个字段最多取 limit 项
+        for kind in kinds:
+            for field_rank in range(len(_KINDS[kind][1])):
+                entries = self._sorted.get((kind, field_rank), [])
+                start = bisect.bisect_left(entries, (query,))
+                for value, key in entries[start:start + limit]:
+                    if not value.startswith(query):
+                        break
+                    self._offer(ranked, (EXACT if value == query else PREFIX, 0, field_rank, value, kind, key))
+
+        grams = _query_grams(query)
+        if len(ranked) < limit:
+            # 中间片段：在不同取值上取倒排交集
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+            matches = sorted((0, field_rank, value, kind) for kind, field_rank, value in candidates
+                             if kind in kinds and query in value and not value.startswith(query))
+            self._expand(ranked, matches, SUBSTRING, limit)
+
+        if not ranked and len(grams) > 1:
+            # 没有完整匹配时，按命中的二元组数量给出模糊匹配
+            overlap = {}
+            for gram in grams:
+                for entry in self._postings.get(gram, ()):
+                    if entry[0] in kinds:
+                        overlap[entry] = overlap.get(entry, 0) + 1
+            required = max(round(len(grams) * FUZZY_MIN_OVERLAP), 1)
+            matches = sorted((-count, field_rank, value, kind)
+                             for (kind, field_rank, value), count in overlap.items() if count >= required)
+            self._expand(ranked, matches, FUZZY, limit)
+
+        results = []
+        for rank in sorted(ranked.values())[:limit]:
+            kind, key = rank[-2:]
+            results.append((kind, MATCH_NAMES[rank[0]], self._docs[kind, key][0]))
+        return results
+
+    @staticmethod
+    def _offer(ranked, rank):
+        doc_id = rank[-2:]
+        if doc_id not in ranked or rank < ranked[doc_id]:
+            ranked[doc_id] = rank
+
+    def _expand(self, ranked, matches, match, limit):
+        # matches 为有序的 (得分, 字段序号, 值, 类型)，依次展开为记录，凑够 limit 条即停止
+        for score, field_rank, value, kind in matches:
+            for key in self._values[kind, field_rank][value][:limit]:
+                self._offer(ranked, (match, score, field_rank, value, kind, key))
+            if len(ranked) >= limit:
+                return
+
+    def stats(self):
+        return {'documents': len(self._docs), 'grams': len(self._postings), 'generation': self.generation,
+                'cached_results': len(self._results)}
+
+
+search_index = SearchIndex()
+
+
+def init_search(app):
+    table_versions.subscribe(search_index.on_commit)
+
+
+def search_kinds():
+    return tuple(_KINDS)
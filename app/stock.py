@@ -0,0 +1,178 @@
+import datetime
+import math
+
+from flask import current_app
+
+from . import db
+from .cache import mark_changed
+from .models import Medicine, MedicineConsumption, StockMovement
+
+# 消耗速率的时间常数（天）：出库记录的权重按 e^(-经过天数/时间常数) 衰减
+CONSUMPTION_WINDOW_DAYS = 14
+
+# 计入消耗统计的流水类型
+CONSUMPTION_MOVEMENTS = ('remove', 'dispense')
+
+
+class StockError(ValueError):
+    """库存变更失败；status 为对应的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _execute(statement, national_code):
+    # 直接在连接上执行，按主键登记修改（经 ORM 执行的 DML 只能登记整张表）
+    result = db.session.connection().execute(statement)
+    mark_changed(db.session, Medicine.__tablename__, [national_code])
+    return result.rowcount
+
+
+def _current_stock(national_code):
+    """返回 (药品名称, 剩余数量)；本事务已修改该行时读到的是本事务写入后的值"""
+    row = db.session.query(Medicine.name, Medicine.remaining_quantity) \
+        .filter(Medicine.national_code == national_code).first()
+    if row is None:
+        raise StockError('找不到指定的药品！', 404)
+    return row
+
+
+def _window_days():
+    return current_app.config.get('CONSUMPTION_WINDOW_DAYS', CONSUMPTION_WINDOW_DAYS)
+
+
+def record_movement(national_code, movement_type, quantity_change, quantity_after, at=None):
+    """在当前事务中追加一条库存流水；出库同时增量更新消耗统计"""
+    at = at or datetime.datetime.now()
+    db.session.execute(StockMovement.__table__.insert(), [{
+        'national_code': national_code,
+        'movement_type': movement_type,
+        'quantity_change': quantity_change,
+        'quantity_after': quantity_after,
+        'created_at': at
+    }])
+    if movement_type in CONSUMPTION_MOVEMENTS:
+        _record_consumption(national_code, -quantity_change, at)
+
+
+def record_movements(rows):
+    """批量追加库存流水（批量导入使用），rows 中每项包含 record_movement 的各字段"""
+    if rows:
+        db.session.execute(StockMovement.__table__.insert(), rows)
+
+
+def create_consumptions(national_codes, at=None):
+    """在当前事务中为新药品插入空的消耗统计（已有的跳过，如删除后重新添加的药品）
+
+    药品创建时就有这一行，出库时的加锁读取总是命中已有的行：MySQL 对不存在的行加锁读取会锁住索引间隙，
+    编码落在同一间隙的两个药品首次出库时各持有间隙锁、再互相等待对方的插入，其中一个事务会因死锁失败。
+    """
+    codes = set(national_codes)
+    if not codes:
+        return
+    existing = {code for code, in db.session.query(MedicineConsumption.national_code)
+                .filter(MedicineConsumption.national_code.in_(codes))}
+    at = at or datetime.datetime.now()
+    rows = [{'national_code': code, 'decayed_quantity': 0.0, 'total_quantity': 0, 'first_at': at, 'updated_at': at}
+            for code in sorted(codes - existing)]
+    if rows:
+        db.session.execute(MedicineConsumption.__table__.insert(), rows)
+
+
+def _consumption_for_update(national_code):
+    """加锁读取消耗统计：锁定读取总是读到最新提交的数据，不受事务快照（MySQL REPEATABLE READ）影响"""
+    return db.session.query(MedicineConsumption) \
+        .filter(MedicineConsumption.national_code == national_code) \
+        .with_for_update().populate_existing()
+
+
+def _record_consumption(national_code, quantity, at):
+    # 调用前的条件 UPDATE 已锁定药品行，同一药品的出库在此串行：等到前一个事务提交后，
+    # 加锁读取才能读到它写入的消耗统计，不会丢失更新
+    consumption = _consumption_for_update(national_code).first()
+    if consumption is None:
+        # 药品创建时已插入这一行（见 create_consumptions）；只有绕过添加接口、导入与 upgrade-db 写入的药品才会缺少
+        consumption = MedicineConsumption(national_code=national_code, decayed_quantity=0.0, total_quantity=0,
+                                          first_at=at, updated_at=at)
+        db.session.add(consumption)
+    elif not consumption.total_quantity:
+        # 第一次出库：统计时长从此刻算起
+        consumption.first_at = at
+    elapsed_days = max((at - consumption.updated_at).total_seconds() / 86400, 0)
+    decay = math.exp(-elapsed_days / _window_days())
+    consumption.decayed_quantity = consumption.decayed_quantity * decay + quantity
+    consumption.total_quantity += quantity
+    consumption.updated_at = at
+
+
+def daily_consumption(consumption, now=None):
+    """由消耗统计得到近期日均消耗量（近期出库权重更高），没有出库记录时返回 0"""
+    if consumption is None or consumption.decayed_quantity is None:
+        return 0.0
+    now = now or datetime.datetime.now()
+    window = _window_days()
+    elapsed_days = max((now - consumption.updated_at).total_seconds() / 86400, 0)
+    # 统计时长不足一个时间常数时按实际时长折算（至少 1 天），避免新药品的速率被低估
+    age_days = max((now - consumption.first_at).total_seconds() / 86400, 1)
+    effective_days = window * (1 - math.exp(-age_days / window))
+    return consumption.decayed_quantity * math.exp(-elapsed_days / window) / effective_days
+
+
+def supply_forecast(remaining_quantity, consumption, now=None):
+    """返回 (日均消耗量, 可用天数)；没有消耗时可用天数为 None"""
+    rate = daily_consumption(consumption, now)
+    if rate <= 0:
+        return 0.0, None
+    return rate, (remaining_quantity or 0) / rate
+
+
+def take_stock(national_code, quantity, movement_type='remove'):
+    """以一条条件 UPDATE 扣减库存：剩余数量不足时不修改，返回 (药品名称, 扣减后数量)
+
+    不先 SELECT ... FOR UPDATE，行锁只在 UPDATE 到事务提交之间持有；同时记录库存流水。调用方负责提交或回滚。
+    """
+    table = Medicine.__table__
+    statement = table.update() \
+        .where(table.c.national_code == national_code, table.c.remaining_quantity >= quantity) \
+        .values(remaining_quantity=table.c.remaining_quantity - quantity)
+    if _execute(statement, national_code) == 0:
+        # 只在失败时多查一次，区分药品不存在与数量不足
+        name, remaining_quantity = _current_stock(national_code)
+        raise StockError(f'删除数量({quantity})超过当前剩余数量({remaining_quantity})！')
+    name, remaining_quantity = _current_stock(national_code)
+    record_movement(national_code, movement_type, -quantity, remaining_quantity)
+    return name, remaining_quantity
+
+
+def add_stock(national_code, quantity, movement_type='refill'):
+    """以一条 UPDATE 增加库存，返回 (药品名称, 增加后数量)；同时记录库存流水，调用方负责提交或回滚"""
+    table = Medicine.__table__
+    statement = table.update() \
+        .where(table.c.national_code == national_code) \
+        .values(remaining_quantity=table.c.remaining_quantity + quantity)
+    if _execute(statement, national_code) == 0:
+        raise StockError('找不到指定的药品！', 404)
+    name, remaining_quantity = _current_stock(national_code)
+    record_movement(national_code, movement_type, quantity, remaining_quantity)
+    return name, remaining_quantity
+
+
+def dispense(quantities):
+    """在当前事务中按药品编码顺序逐个扣减 {药品编码: 数量}，返回 (每项结果, 是否全部成功)
+
+    所有事务都按同一顺序获取行锁，多个批量发药并发执行时不会互相死锁。
+    某一项失败时继续处理其余各项，以便一次返回全部失败原因；调用方在有失败时回滚。
+    """
+    results, succeeded = [], True
+    for national_code in sorted(quantities):
+        quantity = quantities[national_code]
+        try:
+            name, remaining_quantity = take_stock(national_code, quantity, movement_type='dispense')
+            results.append({'national_code': national_code, 'name': name, 'quantity': quantity,
+                            'remaining_quantity': remaining_quantity, 'status': 'ok'})
+        except StockError as e:
+            succeeded = False
+            results.append({'national_code': national_code, 'quantity': quantity,
+                            'status': 'not_found' if e.status == 404 else 'insufficient', 'error': str(e)})
+    return results, succeeded
@@ -0,0 +1 @@
+"""性能基准测试：数据生成、接口基准与规模扩展测试"""
@@ -0,0 +1,225 @@
+"""按指定规模生成模拟家庭药箱数据
+
+用法（在项目根目录执行）：
+    python -m benchmarks.generate --members 10000 --medicines 50000 --administrations 1000000
+
+默认写入 benchmarks/bench.db（SQLite）；--database-url 可指定本地 MySQL 等其他数据库。
+注意：会先清空目标数据库中的全部业务表，请勿指向正式数据库。
+"""
+import argparse
+import datetime
+import math
+import os
+import random
+import sys
+import time
+
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench.db')
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何林罗高'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华'
+MEDICINE_NAMES = ['阿莫西林胶囊', '布洛芬缓释胶囊', '对乙酰氨基酚片', '头孢克肟片', '氯雷他定片', '蒙脱石散',
+                  '维生素C片', '复方甘草片', '奥美拉唑肠溶胶囊', '硝苯地平缓释片', '二甲双胍片', '阿司匹林肠溶片',
+                  '感冒灵颗粒', '连花清瘟胶囊', '板蓝根颗粒', '氨溴索口服液', '左氧氟沙星片', '藿香正气水']
+DISEASES = ['高血压', '糖尿病', '哮喘', '胃炎', '高血脂', None, None, None]
+ALLERGENS = ['青霉素', '头孢', '花粉', '磺胺', '阿司匹林', None, None, None, None]
+CABINET_LOCATIONS = ['客厅药箱', '卧室药箱', '厨房药箱', '儿童房药箱', '书房药箱']
+DOCTORS = ['王医生', '李医生', '张医生', '刘医生', '陈医生']
+
+# 持续时间中"长期"用药所占比例
+LONG_TERM_RATIO = 0.2
+BATCH_SIZE = 5000
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(table, rows):
+    from app import db
+    count = 0
+    for batch in _batches(rows):
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        count += len(batch)
+    return count
+
+
+def member_id(i):
+    return f'M{i:07d}'
+
+
+def medicine_code(i):
+    return f'H{i:08d}'
+
+
+def generate(members=1000, medicines=5000, administrations=100000, cabinets=50, manufactures=200,
+             seed=0, member_offset=0, reset=True, log=print):
+    """在当前应用上下文的数据库中生成数据，返回各表写入的行数
+
+    member_offset 用于在已有数据上追加新成员的用药记录（扩展规模测试时使用），此时 reset 应为 False。
+    """
+    from app import db
+    from app.models import (ExpiringMedicinesView, LONG_TERM, Manufacture, Medicine, MedicineAdministration,
+                            MedicineCabinet, MedicineConsumption, Member, OTC, Prescription, PrescriptionMedicine,
+                            StockMovement, UserInfo, compute_end_time)
+    from app.schema import upgrade_schema
+    from app.stock import CONSUMPTION_WINDOW_DAYS
+
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    now = datetime.datetime.now()
+    counts = {}
+
+    if reset:
+        db.session.remove()
+        # 视图由数据库维护，不在这里删除或创建
+        db.metadata.drop_all(bind=db.engine, tables=[t for t in db.metadata.sorted_tables
+                                                     if t is not ExpiringMedicinesView.__table__])
+        upgrade_schema()
+        db.session.add(UserInfo(username='admin', password='123456'))
+        db.session.commit()
+
+        counts['medicine_cabinet'] = _insert(MedicineCabinet.__table__, (
+            {'cabinet_id': i, 'location': f'{CABINET_LOCATIONS[i % len(CABINET_LOCATIONS)]}{i}'}
+            for i in range(1, cabinets + 1)
+        ))
+        counts['manufacture'] = _insert(Manufacture.__table__, (
+            {'manufacture_name': f'制药厂{i:04d}', 'address': f'工业园区{i}号'} for i in range(manufactures)
+        ))
+
+    counts['member'] = _insert(Member.__table__, ({
+        'security_id': member_id(i),
+        'name': rng.choice(SURNAMES) + rng.choice(GIVEN_NAMES) + rng.choice(GIVEN_NAMES),
+        'gender': rng.choice('MF'),
+        'age': rng.randint(1, 90),
+        'weight': round(rng.uniform(10, 100), 1),
+        'height': round(rng.uniform(60, 190), 1),
+        'underlying_disease': rng.choice(DISEASES),
+        'allergen': '，'.join(a for a in {rng.choice(ALLERGENS), rng.choice(ALLERGENS)} if a) or None
+    } for i in range(member_offset, member_offset + members)))
+    # 每位成员一张处方
+    counts['prescription'] = _insert(Prescription.__table__, ({
+        'prescription_id': f'P{member_id(i)}',
+        'security_id': member_id(i),
+        'time': today - datetime.timedelta(days=rng.randint(0, 720)),
+        'doctor': rng.choice(DOCTORS)
+    } for i in range(member_offset, member_offset + members)))
+
+    if reset:
+        medicine_rows, otc_rows, prescription_rows = [], [], []
+        for i in range(medicines):
+            code = medicine_code(i)
+            manufacture_date = today - datetime.timedelta(days=rng.randint(30, 900))
+            medicine_rows.append({
+                'national_code': code,
+                'prescription_id': None,
+                'cabinet_id': rng.randint(1, cabinets),
+                'manufacture_name': f'制药厂{rng.randrange(manufactures):04d}',
+                'name': rng.choice(MEDICINE_NAMES),
+                'manufacture_date': manufacture_date,
+                'remaining_quantity': rng.choice([0, 1, 2, 3, 5, 8, 12, 20, 30]),
+                # 有效期在过去 60 天到未来 2 年之间
+                'expiry_date': today + datetime.timedelta(days=rng.randint(-60, 730)),
+                'price': round(rng.uniform(5, 200), 2)
+            })
+            if i % 2:
+                otc_rows.append({'national_code': code, 'direction': '口服，一日三次', 'manufacture_date': manufacture_date})
+            else:
+                prescription_rows.append({'national_code': code, 'prescription_id': f'P{member_id(rng.randrange(members))}',
+                                          'manufacture_date': manufacture_date})
+        counts['medicine'] = _insert(Medicine.__table__, medicine_rows)
+        counts['OTC'] = _insert(OTC.__table__, otc_rows)
+        counts['prescription_medicine'] = _insert(PrescriptionMedicine.__table__, prescription_rows)
+
+        # 过去 60 天的入库、出库流水，并按同样的衰减规则得到消耗统计
+        movement_rows, consumption_rows = [], []
+        for row in medicine_rows:
+            removals = sorted((now - datetime.timedelta(days=rng.uniform(0, 60)), rng.randint(1, 3))
+                              for _ in range(rng.choice([0, 0, 1, 3, 6, 12])))
+            quantity = row['remaining_quantity'] + sum(q for _, q in removals)
+            first_at = now - datetime.timedelta(days=61)
+            movement_rows.append({'national_code': row['national_code'], 'movement_type': 'add',
+                                  'quantity_change': quantity, 'quantity_after': quantity, 'created_at': first_at})
+            decayed, updated_at = 0.0, None
+            for at, removed in removals:
+                quantity -= removed
+                movement_rows.append({'national_code': row['national_code'], 'movement_type': 'remove',
+                                      'quantity_change': -removed, 'quantity_after': quantity, 'created_at': at})
+                if updated_at is not None:
+                    decayed *= math.exp(-(at - updated_at).total_seconds() / 86400 / CONSUMPTION_WINDOW_DAYS)
+                decayed, updated_at = decayed + removed, at
+            # 与添加药品时一样，没有出库的药品也有一行空的消耗统计
+            consumption_rows.append({'national_code': row['national_code'], 'decayed_quantity': decayed,
+                                     'total_quantity': sum(q for _, q in removals),
+                                     'first_at': removals[0][0] if removals else first_at,
+                                     'updated_at': updated_at or first_at})
+        counts['stock_movement'] = _insert(StockMovement.__table__, movement_rows)
+        counts['medicine_consumption'] = _insert(MedicineConsumption.__table__, consumption_rows)
+        del medicine_rows, otc_rows, prescription_rows, movement_rows, consumption_rows
+
+    # 用药记录主键为 (成员, 药品)，每位成员抽取互不相同的药品
+    per_member, extra = divmod(administrations, members)
+    if per_member + (1 if extra else 0) > medicines:
+        raise ValueError('每位成员的用药记录数不能超过药品数')
+
+    def administration_rows():
+        for i in range(member_offset, member_offset + members):
+            count = per_member + (1 if i - member_offset < extra else 0)
+            for code_index in rng.sample(range(medicines), count):
+                start_time = now - datetime.timedelta(days=rng.randint(0, 720), minutes=rng.randint(0, 1440))
+                lasting_time = LONG_TERM if rng.random() < LONG_TERM_RATIO else f'{rng.randint(1, 90)}天'
+                yield {
+                    'security_id': member_id(i),
+                    'national_code': medicine_code(code_index),
+                    'dosage': f'{rng.randint(1, 3)}片/次',
+                    'start_time': start_time,
+                    'lasting_time': lasting_time,
+                    'manufacture_date': None,
+                    # Core 批量插入不经过 ORM 事件，这里直接计算结束时间
+                    'end_time': compute_end_time(start_time, lasting_time)
+                }
+
+    start = time.perf_counter()
+    counts['medicine_administration'] = _insert(MedicineAdministration.__table__, administration_rows())
+    log(f'写入 {counts["medicine_administration"]} 条用药记录，用时 {time.perf_counter() - start:.1f} 秒')
+    return counts
+
+
+def create_bench_app(database_url=None):
+    """创建连接到基准测试数据库的应用（须在导入 app 之前设置数据库地址）"""
+    os.environ['DATABASE_URL'] = database_url or os.environ.get('BENCH_DATABASE_URL', DEFAULT_DATABASE_URL)
+    # 不启动后台定时任务，避免续约等后台查询计入被测接口的 SQL 条数
+    os.environ.setdefault('SCHEDULER_ENABLED', 'false')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import create_app
+    return create_app()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成基准测试数据')
+    parser.add_argument('--database-url', help=f'数据库地址，默认 {DEFAULT_DATABASE_URL}')
+    parser.add_argument('--members', type=int, default=1000)
+    parser.add_argument('--medicines', type=int, default=5000)
+    parser.add_argument('--administrations', type=int, default=100000)
+    parser.add_argument('--cabinets', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    with app.app_context():
+        counts = generate(members=args.members, medicines=args.medicines, administrations=args.administrations,
+                          cabinets=args.cabinets, seed=args.seed)
+    for table, count in counts.items():
+        print(f'{table}: {count}')
+
+
+if __name__ == '__main__':
+    main()
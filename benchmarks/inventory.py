@@ -0,0 +1,105 @@
+"""药品库存读模型基准测试：建立耗时、每项内存，以及启用读模型前后相关接口的延迟与 SQL 条数
+
+每项内存分别用 tracemalloc 实测（建立读模型前后的内存差除以药品数）和读模型自身的估算（/api/admin/inventory
+返回的 bytes_per_item）给出，并与加载完整 Medicine ORM 对象的每项内存对比。
+
+用法（在项目根目录执行，先用 benchmarks.generate 生成数据）：
+    python -m benchmarks.inventory --iterations 20 --max-bytes-per-item 1000
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from .generate import create_bench_app
+from .run import SCENARIOS, load_samples, run_scenario
+
+# 可由读模型提供的场景
+READ_MODEL_SCENARIOS = ('medicines', 'medicines_page', 'medicines_filtered', 'medicines_fields', 'medicine_details',
+                        'low_stock_medicines_top', 'expiry_window')
+
+
+def _traced(load):
+    """返回 (load() 的结果, 执行后仍占用的内存字节数)"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = load()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def measure_memory(app):
+    from app import db
+    from app.inventory import InventoryReadModel
+    from app.models import Medicine
+
+    with app.app_context():
+        model = InventoryReadModel()
+        start = time.perf_counter()
+        records, model_bytes = _traced(model.medicines)
+        build_s = time.perf_counter() - start
+        count = len(records)
+        stats = model.stats()
+        del records
+        orm, orm_bytes = _traced(lambda: Medicine.query.all())
+        del orm
+        db.session.remove()
+    return {
+        'medicines': count,
+        'build_s': round(build_s, 3),
+        'read_model_bytes_per_item': round(model_bytes / count, 1) if count else 0,
+        'estimated_bytes_per_item': stats['bytes_per_item'],
+        'orm_bytes_per_item': round(orm_bytes / count, 1) if count else 0
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='药品库存读模型基准测试')
+    parser.add_argument('--database-url', help='数据库地址，默认与 benchmarks.generate 相同')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--max-bytes-per-item', type=float, help='实测每项内存超过该值时以非零状态码退出')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    app.logger.disabled = True
+    client = app.test_client()
+    with app.app_context():
+        samples = load_samples()
+
+    memory = measure_memory(app)
+    print(f'药品 {memory["medicines"]}，建立读模型 {memory["build_s"]:.3f} 秒')
+    print(f'每项内存：读模型实测 {memory["read_model_bytes_per_item"]} 字节，'
+          f'估算 {memory["estimated_bytes_per_item"]["total"]} 字节，完整 ORM 对象 {memory["orm_bytes_per_item"]} 字节')
+
+    urls = {name: url.format(**samples) for name, url, _ in SCENARIOS if name in READ_MODEL_SCENARIOS}
+    scenarios = {}
+    for name, url in urls.items():
+        scenarios[name] = {}
+        for mode, enabled in (('database', False), ('read_model', True)):
+            app.config['INVENTORY_READ_MODEL'] = enabled
+            scenarios[name][mode] = result = run_scenario(client, url, args.iterations, args.warmup)
+            print(f'{name:26} {mode:10} {result["status"]:>3}  p50 {result["p50_ms"]:>9.2f} ms  '
+                  f'p99 {result["p99_ms"]:>9.2f} ms  sql {result["sql_count"]:>3}  peak {result["peak_memory_kb"]:>10.1f} KB')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'memory': memory, 'scenarios': scenarios}, f, ensure_ascii=False, indent=2)
+
+    failures = [f'{name} ({mode}): 状态码 {result["status"]}' for name, modes in scenarios.items()
+                for mode, result in modes.items() if result['status'] != 200]
+    failures += [f'{name}: 启用读模型后仍执行了 {modes["read_model"]["sql_count"]} 条 SQL'
+                 for name, modes in scenarios.items() if modes['read_model']['sql_count']]
+    if args.max_bytes_per_item and memory['read_model_bytes_per_item'] > args.max_bytes_per_item:
+        failures.append(f'每项内存 {memory["read_model_bytes_per_item"]} 字节超过 {args.max_bytes_per_item}')
+    for failure in failures:
+        print(f'退化：{failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""通过 Flask 测试客户端逐个请求 GET /api/* 接口，统计延迟、SQL 条数与内存峰值
+
+用法（在项目根目录执行，先用 benchmarks.generate 生成数据）：
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --thresholds benchmarks/thresholds.json --baseline old.json --tolerance 0.25
+
+超过阈值或相对基线退化时以非零状态码退出，可用于回归检查。
+"""
+import argparse
+import datetime
+import json
+import platform
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+from .generate import create_bench_app
+
+# (场景名, 请求地址, 计时次数)；{security_id} 等占位符由数据库中的样本值替换，计时次数为 None 时使用命令行参数
+SCENARIOS = [
+    ('medicines', '/api/medicines', None),
+    ('medicines_page', '/api/medicines?limit=50&sort=expiry_date', None),
+    ('medicines_filtered', '/api/medicines?type=OTC&min_quantity=5&limit=50', None),
+    ('medicines_fields', '/api/medicines?fields=national_code,name', None),
+    ('members', '/api/members', None),
+    ('members_page', '/api/members?limit=50', None),
+    ('cabinets', '/api/cabinets', None),
+    ('prescriptions', '/api/prescriptions', None),
+    ('manufactures', '/api/manufactures', None),
+    ('check_manufacture', '/api/check_manufacture/{manufacture_name}', None),
+    ('member_details', '/api/member_details/{security_id}', None),
+    ('member_details_for_edit', '/api/member_details_for_edit/{security_id}', None),
+    ('member_medicine_records', '/api/member_medicine_records/{security_id}', None),
+    ('medicine_details', '/api/medicine_details/{national_code}', None),
+    ('medicine_usage', '/api/medicine_usage/{national_code}', None),
+    ('prescription_details', '/api/prescription_details/{prescription_id}', None),
+    ('prescriptions_details', '/api/prescriptions/details?ids={prescription_ids}', None),
+    ('current_medications', '/api/current_medications', 5),
+    ('current_medications_member', '/api/current_medications?security_id={security_id}', None),
+    ('historical_medications', '/api/historical_medications', 5),
+    ('historical_medications_member', '/api/historical_medications?security_id={security_id}', None),
+    ('expiring_medicines', '/api/expiring_medicines', None),
+    ('expired_medicines', '/api/expired_medicines', None),
+    ('low_stock_medicines', '/api/low_stock_medicines', None),
+    ('low_stock_medicines_top', '/api/low_stock_medicines?limit=20', None),
+    ('expiry_window', '/api/expiry?within_days=90&limit=100', None),
+    ('reorder_forecast', '/api/reorder_forecast?within_days=30', None),
+    ('stock_movements', '/api/stock_movements/{national_code}?limit=50', None),
+    ('search', '/api/search?q={search_prefix}&limit=10', None),
+    ('safety_check', '/api/safety/check?security_id={security_id}&national_code={national_code}', None),
+    ('safety_audit', '/api/safety/audit', 5),
+    ('dashboard_alerts', '/api/dashboard?sections=expiring_medicines,low_stock_medicines,expired_medicines', None),
+    ('dashboard', '/api/dashboard', 5),
+    ('export_medicines', '/api/export/medicines?format=ndjson', 3),
+    ('export_administrations', '/api/export/administrations?format=csv', 3),
+    ('pool_stats', '/api/admin/pool_stats', None),
+    ('inventory_stats', '/api/admin/inventory', None),
+    ('scheduler_status', '/api/admin/scheduler', None),
+]
+
+
+def load_samples():
+    """从数据库中选取占位符使用的样本值：用药记录最多的成员、使用人数最多的药品等"""
+    from sqlalchemy import func
+
+    from app import db
+    from app.models import Manufacture, Medicine, MedicineAdministration, Member, Prescription
+
+    security_id = db.session.query(MedicineAdministration.security_id) \
+        .group_by(MedicineAdministration.security_id) \
+        .order_by(func.count().desc(), MedicineAdministration.security_id).limit(1).scalar() \
+        or db.session.query(func.min(Member.security_id)).scalar()
+    national_code = db.session.query(MedicineAdministration.national_code) \
+        .group_by(MedicineAdministration.national_code) \
+        .order_by(func.count().desc(), MedicineAdministration.national_code).limit(1).scalar() \
+        or db.session.query(func.min(Medicine.national_code)).scalar()
+    samples = {
+        'security_id': security_id,
+        'national_code': national_code,
+        'prescription_id': db.session.query(func.min(Prescription.prescription_id)).scalar(),
+        'prescription_ids': ','.join(pid for pid, in db.session.query(Prescription.prescription_id)
+                                     .order_by(Prescription.prescription_id).limit(50)) or None,
+        'manufacture_name': db.session.query(func.min(Manufacture.manufacture_name)).scalar(),
+        # 搜索使用药品名称的前两个字，模拟输入中的前缀
+        'search_prefix': (db.session.query(func.min(Medicine.name)).scalar() or '')[:2] or None
+    }
+    db.session.remove()
+    missing = [name for name, value in samples.items() if value is None]
+    if missing:
+        raise SystemExit(f'数据库中没有可用的样本数据（{", ".join(missing)}），请先运行 python -m benchmarks.generate')
+    return samples
+
+
+def uncovered_routes(app):
+    """没有对应场景的 GET /api/* 路由，提醒新增接口时补充场景"""
+    paths = [url.split('?')[0] for _, url, _ in SCENARIOS]
+    routes = []
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/api/') and 'GET' in rule.methods:
+            pattern = re.compile('^' + re.sub(r'<[^>]+>', '[^/]+', rule.rule) + '$')
+            if not any(pattern.match(path) for path in paths):
+                routes.append(rule.rule)
+    return routes
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def run_scenario(client, url, iterations, warmup):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        # 变更日志每个进程每隔 TABLE_CHANGE_POLL_SECONDS 秒最多读取一次，与接口无关，不计入
+        if context is not None and context.execution_options.get('table_change_poll'):
+            return
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', count_statement)
+    try:
+        status = None
+        for _ in range(warmup):
+            client.get(url).get_data()
+
+        latencies, sql_counts = [], []
+        size = 0
+        for _ in range(iterations):
+            statements.clear()
+            start = time.perf_counter()
+            response = client.get(url)
+            size = len(response.get_data())
+            latencies.append(time.perf_counter() - start)
+            sql_counts.append(len(statements))
+            status = response.status_code
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count_statement)
+
+    # 单独执行一次统计内存峰值（tracemalloc 会拖慢执行，不与计时混在一起）
+    tracemalloc.start()
+    client.get(url).get_data()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'url': url,
+        'status': status,
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'sql_count': max(sql_counts),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': size
+    }
+
+
+def check_thresholds(results, thresholds):
+    """thresholds 格式：{场景名: {"max_sql": n, "max_p99_ms": x, "max_peak_memory_kb": y}}"""
+    failures = []
+    for name, limits in thresholds.items():
+        result = results.get(name)
+        if result is None:
+            continue
+        for key, metric in (('max_sql', 'sql_count'), ('max_p99_ms', 'p99_ms'), ('max_peak_memory_kb', 'peak_memory_kb')):
+            if key in limits and result[metric] > limits[key]:
+                failures.append(f'{name}: {metric}={result[metric]} 超过阈值 {limits[key]}')
+    return failures
+
+
+def compare_baseline(results, baseline, tolerance):
+    """与上一次的结果比较：SQL 条数不得增加，延迟和内存不得超过基线的 (1 + tolerance) 倍"""
+    failures = []
+    for name, old in baseline.get('scenarios', {}).items():
+        new = results.get(name)
+        if new is None:
+            continue
+        if new['sql_count'] > old['sql_count']:
+            failures.append(f'{name}: sql_count {old["sql_count"]} -> {new["sql_count"]}')
+        for metric in ('p50_ms', 'p99_ms', 'peak_memory_kb'):
+            if old[metric] and new[metric] > old[metric] * (1 + tolerance):
+                failures.append(f'{name}: {metric} {old[metric]} -> {new[metric]}')
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='接口性能基准测试')
+    parser.add_argument('--database-url', help='数据库地址，默认与 benchmarks.generate 相同')
+    parser.add_argument('--iterations', type=int, default=20, help='每个场景的计时次数')
+    parser.add_argument('--warmup', type=int, default=2, help='每个场景计时前的预热次数')
+    parser.add_argument('--only', help='只运行名称匹配该正则表达式的场景')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    parser.add_argument('--thresholds', help='阈值 JSON 文件路径')
+    parser.add_argument('--baseline', help='用于比较的上一次结果 JSON 文件路径')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='相对基线允许的延迟、内存增幅')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    app.logger.disabled = True
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+
+    with app.app_context():
+        samples = load_samples()
+    for route in uncovered_routes(app):
+        print(f'警告：{route} 没有对应的基准测试场景', file=sys.stderr)
+
+    results = {}
+    for name, url, iterations in SCENARIOS:
+        if args.only and not re.search(args.only, name):
+            continue
+        result = run_scenario(client, url.format(**samples), iterations or args.iterations, args.warmup)
+        results[name] = result
+        print(f'{name:32} {result["status"]:>3}  p50 {result["p50_ms"]:>9.2f} ms  p99 {result["p99_ms"]:>9.2f} ms  '
+              f'sql {result["sql_count"]:>4}  peak {result["peak_memory_kb"]:>10.1f} KB')
+
+    report = {
+        'meta': {
+            'generated_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1],
+            'python': platform.python_version(),
+            'iterations': args.iterations,
+            'samples': samples
+        },
+        'scenarios': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    failures = [f'{name}: 状态码 {result["status"]}' for name, result in results.items() if result['status'] != 200]
+    if args.thresholds:
+        with open(args.thresholds, encoding='utf-8') as f:
+            failures += check_thresholds(results, json.load(f))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            failures += compare_baseline(results, json.load(f), args.tolerance)
+    for failure in failures:
+        print(f'退化：{failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
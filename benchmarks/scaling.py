@@ -0,0 +1,80 @@
+"""用药记录规模扩展测试：用药记录总数逐级增长时，单个成员的用药查询延迟应保持平稳
+
+每位成员的用药记录数固定，通过增加成员数量扩大总规模，然后测量同一位成员的
+用药记录、当前用药、历史用药接口。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.scaling --sizes 1000,10000,100000 --output scaling.json
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from .generate import create_bench_app, generate, member_id
+from .run import run_scenario
+
+SCENARIOS = [
+    ('member_medicine_records', '/api/member_medicine_records/{security_id}'),
+    ('current_medications_member', '/api/current_medications?security_id={security_id}'),
+    ('historical_medications_member', '/api/historical_medications?security_id={security_id}'),
+    ('historical_medications_window', '/api/historical_medications?security_id={security_id}&start_from={start_from}'),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='用药记录规模扩展测试')
+    parser.add_argument('--database-url', help='数据库地址，默认与 benchmarks.generate 相同（会被清空）')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='逐级增长的用药记录总数，逗号分隔')
+    parser.add_argument('--per-member', type=int, default=20, help='每位成员的用药记录数')
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--max-ratio', type=float, default=3.0,
+                        help='最大规模与最小规模的 p50 延迟之比超过该值时以非零状态码退出')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    args = parser.parse_args(argv)
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    app = create_bench_app(args.database_url)
+    app.logger.disabled = True
+    client = app.test_client()
+    samples = {
+        'security_id': member_id(0),
+        'start_from': (datetime.date.today() - datetime.timedelta(days=180)).strftime('%Y-%m-%d')
+    }
+
+    results = {}
+    members = 0
+    for size in sizes:
+        # 在上一级的数据上追加成员，直到用药记录总数达到 size
+        new_members = size // args.per_member - members
+        with app.app_context():
+            generate(members=new_members, medicines=max(args.per_member * 5, 1000),
+                     administrations=new_members * args.per_member, seed=size,
+                     member_offset=members, reset=members == 0, log=lambda message: None)
+        members += new_members
+
+        results[size] = {}
+        for name, url in SCENARIOS:
+            result = run_scenario(client, url.format(**samples), args.iterations, warmup=3)
+            results[size][name] = result
+            print(f'{size:>9} {name:32} p50 {result["p50_ms"]:>8.2f} ms  p99 {result["p99_ms"]:>8.2f} ms  '
+                  f'sql {result["sql_count"]}')
+
+    failures = []
+    smallest, largest = results[sizes[0]], results[sizes[-1]]
+    for name, _ in SCENARIOS:
+        ratio = largest[name]['p50_ms'] / smallest[name]['p50_ms'] if smallest[name]['p50_ms'] else 0
+        print(f'{name:32} p50 {sizes[-1]}/{sizes[0]} 倍数 {ratio:.2f}')
+        if ratio > args.max_ratio:
+            failures.append(f'{name}: 用药记录从 {sizes[0]} 增长到 {sizes[-1]} 时 p50 延迟增长 {ratio:.2f} 倍')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'per_member': args.per_member, 'results': results}, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f'退化：{failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
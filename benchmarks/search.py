@@ -0,0 +1,90 @@
+"""搜索索引基准测试：在生成的数据上统计 /api/search 使用的内存索引的建立时间与查询延迟
+
+查询取自药品名称、编码和厂家名称的前缀及中间片段（模拟逐字输入），分别统计
+未命中结果缓存（实际检索）与命中结果缓存时的延迟。
+
+用法（在项目根目录执行，先用 benchmarks.generate 生成数据）：
+    python -m benchmarks.search --queries 2000 --max-p99-us 1000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from .generate import create_bench_app
+from .run import percentile
+
+
+def sample_queries(rng, count):
+    from app import db
+    from app.models import Manufacture, Medicine
+
+    names = [name for name, in db.session.query(Medicine.name).distinct()]
+    codes = [code for code, in db.session.query(Medicine.national_code).limit(1000)]
+    manufactures = [name for name, in db.session.query(Manufacture.manufacture_name).limit(1000)]
+    queries = []
+    for _ in range(count):
+        text = rng.choice(rng.choice([names, codes, manufactures]))
+        if rng.random() < 0.8:
+            # 逐字输入的前缀
+            queries.append(text[:rng.randint(1, len(text))])
+        else:
+            start = rng.randrange(len(text))
+            queries.append(text[start:start + rng.randint(2, 4)])
+    return queries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='搜索索引基准测试')
+    parser.add_argument('--database-url', help='数据库地址，默认与 benchmarks.generate 相同')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-p99-us', type=float, help='未命中缓存的 p99 延迟（微秒）超过该值时以非零状态码退出')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    app.logger.disabled = True
+    from app.search import SearchIndex
+
+    with app.app_context():
+        queries = sample_queries(random.Random(args.seed), args.queries)
+        index = SearchIndex()
+        start = time.perf_counter()
+        index.search('预热')
+        build_s = time.perf_counter() - start
+
+        report = {'build_s': round(build_s, 3), 'queries': len(queries), **index.stats()}
+        # 第一轮结果缓存为空，第二轮全部命中
+        for phase in ('uncached', 'cached'):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query, limit=args.limit)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            report[phase] = {
+                'p50_us': round(percentile(latencies, 0.5) * 1e6, 1),
+                'p99_us': round(percentile(latencies, 0.99) * 1e6, 1),
+                'max_us': round(latencies[-1] * 1e6, 1)
+            }
+        report['distinct_queries'] = len(set(queries))
+
+    print(f'建立索引 {report["build_s"]:.3f} 秒，文档 {report["documents"]}，gram {report["grams"]}')
+    for phase in ('uncached', 'cached'):
+        print(f'{phase:9} p50 {report[phase]["p50_us"]:>9.1f} us  p99 {report[phase]["p99_us"]:>9.1f} us  '
+              f'max {report[phase]["max_us"]:>9.1f} us')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_p99_us and report['uncached']['p99_us'] > args.max_p99_us:
+        print(f'退化：未命中缓存的搜索 p99 {report["uncached"]["p99_us"]} us 超过 {args.max_p99_us} us', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
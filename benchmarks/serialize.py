@@ -0,0 +1,166 @@
+"""JSON 序列化基准测试：对比用药接口原来的输出方式与现在的快速输出方式
+
+- jsonify：原来的实现，加载 ORM 对象、逐行 strftime 生成字典，再由 Flask jsonify 一次编码；
+- fastjson (json) / fastjson (orjson)：现在的接口，只查询需要的列，由 app.fastjson 分块流式编码
+  （分别使用标准库 json 与 orjson，未安装 orjson 时跳过后者）。
+三种方式的输出先解析后比较，确认内容一致，再统计耗时与内存峰值（tracemalloc）。
+
+用法（在项目根目录执行，先用 benchmarks.generate 生成数据）：
+    python -m benchmarks.serialize --repeat 5 --min-speedup 1.5
+"""
+import argparse
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+
+from .generate import create_bench_app
+from .run import percentile
+
+SCENARIOS = ('current_medications', 'historical_medications')
+
+
+def _legacy_rows(criteria):
+    from app import db
+    from app.models import Medicine, MedicineAdministration, Member
+
+    return db.session.query(MedicineAdministration, Member.name, Medicine.name) \
+        .join(Member, Member.security_id == MedicineAdministration.security_id) \
+        .join(Medicine, Medicine.national_code == MedicineAdministration.national_code) \
+        .filter(*criteria) \
+        .order_by(MedicineAdministration.security_id, MedicineAdministration.start_time).all()
+
+
+def _legacy_current(record, medicine_name):
+    return {
+        'medicine_name': medicine_name,
+        'national_code': record.national_code,
+        'start_time': record.start_time.strftime('%Y-%m-%d %H:%M:%S') if record.start_time else '未知',
+        'dosage': record.dosage,
+        'lasting_time': record.lasting_time,
+        'manufacture_date': record.manufacture_date.strftime('%Y-%m-%d') if record.manufacture_date else '未知'
+    }
+
+
+def _legacy_historical(record, medicine_name):
+    return {
+        'medicine_name': medicine_name,
+        'national_code': record.national_code,
+        'start_time': record.start_time.strftime('%Y-%m-%d %H:%M:%S') if record.start_time else '未知',
+        'end_time': record.end_time.strftime('%Y-%m-%d %H:%M:%S') if record.end_time else '未知',
+        'dosage': record.dosage,
+        'lasting_time': record.lasting_time
+    }
+
+
+def legacy_response(name):
+    """原来的实现：ORM 对象 + strftime + jsonify"""
+    from flask import jsonify
+    from app.models import MedicineAdministration
+
+    now = datetime.datetime.now()
+    if name == 'current_medications':
+        rows = _legacy_rows([MedicineAdministration.start_time <= now, MedicineAdministration.active_filter(now)])
+        build = _legacy_current
+    else:
+        rows = _legacy_rows([MedicineAdministration.historical_filter(now)])
+        build = _legacy_historical
+    result = {}
+    for record, member_name, medicine_name in rows:
+        group = result.get(record.security_id)
+        if group is None:
+            group = result[record.security_id] = {
+                'member_name': member_name, 'security_id': record.security_id, 'medications': []
+            }
+        group['medications'].append(build(record, medicine_name))
+    return jsonify(list(result.values()))
+
+
+def _measure(app, name, respond, repeat):
+    from app import db
+
+    def run():
+        with app.test_request_context(f'/api/{name}'):
+            try:
+                return respond(name).get_data()
+            finally:
+                db.session.remove()
+
+    body = run()  # 预热，同时取得输出用于比较
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return body, {
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+        'bytes': len(body)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='JSON 序列化基准测试')
+    parser.add_argument('--database-url', help='数据库地址，默认与 benchmarks.generate 相同')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-speedup', type=float, help='fastjson 相对 jsonify 的 p50 加速比低于该值时以非零状态码退出')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    args = parser.parse_args(argv)
+
+    app = create_bench_app(args.database_url)
+    app.logger.disabled = True
+    from app import fastjson
+
+    def fast_response(name):
+        return app.view_functions[f'main.get_{name}']()
+
+    installed_orjson = fastjson.orjson
+    variants = [('jsonify', legacy_response, None), ('fastjson (json)', fast_response, None)]
+    if installed_orjson is not None:
+        variants.append(('fastjson (orjson)', fast_response, installed_orjson))
+
+    report, failed = {}, False
+    for name in SCENARIOS:
+        report[name] = {}
+        expected = None
+        for variant, respond, encoder in variants:
+            fastjson.orjson = encoder
+            try:
+                body, stats = _measure(app, name, respond, args.repeat)
+            finally:
+                fastjson.orjson = installed_orjson
+            data = json.loads(body)
+            if expected is None:
+                expected = data
+            elif data != expected:
+                print(f'{name}: {variant} 的输出与 jsonify 不一致', file=sys.stderr)
+                failed = True
+            report[name][variant] = stats
+            print(f'{name:24} {variant:18} p50 {stats["p50_ms"]:>10.2f} ms  max {stats["max_ms"]:>10.2f} ms  '
+                  f'peak {stats["peak_kb"]:>12.1f} KB  {stats["bytes"]} bytes')
+
+        fastest = min(stats['p50_ms'] for variant, stats in report[name].items() if variant != 'jsonify')
+        speedup = report[name]['jsonify']['p50_ms'] / fastest if fastest else float('inf')
+        report[name]['speedup'] = round(speedup, 2)
+        print(f'{name:24} 加速比 {speedup:.2f}x')
+        if args.min_speedup and speedup < args.min_speedup:
+            print(f'退化：{name} 加速比 {speedup:.2f} 低于 {args.min_speedup}', file=sys.stderr)
+            failed = True
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import datetime
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 须在导入 app 之前设置：测试使用临时 SQLite 数据库，不启动后台定时任务；
+# 变更日志只在测试显式要求时读取（见 test_table_versions.py），SQL 条数不受读取时机影响
+_DB_DIR = tempfile.mkdtemp(prefix='smart_medibox_test_')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_DB_DIR, "test.db")}'
+os.environ['SCHEDULER_ENABLED'] = 'false'
+os.environ['TABLE_CHANGE_POLL_SECONDS'] = '3600'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.cache import table_versions  # noqa: E402
+from app.stock import create_consumptions  # noqa: E402
+from app.models import (Manufacture, Medicine, MedicineCabinet, Member, OTC, Prescription,  # noqa: E402
+                        PrescriptionMedicine, UserInfo)
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def database(app):
+    """每个测试使用空的数据库；重建表不经过 ORM，需手动使所有缓存与索引失效"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        table_versions.bump({table.name: None for table in db.metadata.sorted_tables})
+        # 变更日志已清空，从头读取
+        table_versions.reset()
+        table_versions.sync(force=True)
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, database):
+    client = app.test_client()
+    with app.app_context():
+        db.session.add(UserInfo(username='admin', password='admin'))
+        db.session.commit()
+    with client.session_transaction() as session:
+        session['username'] = 'admin'
+    return client
+
+
+@pytest.fixture
+def seed(app, database):
+    """seed(n) 写入两个药箱、一个生产厂家、一位成员和一张处方，以及 n 种 OTC 与处方药交替的药品"""
+    def seed(medicines=10, quantity=10):
+        today = datetime.date.today()
+        with app.app_context():
+            db.session.add_all([MedicineCabinet(cabinet_id=1, location='客厅药箱'),
+                                MedicineCabinet(cabinet_id=2, location='卧室药箱'),
+                                Manufacture(manufacture_name='辉瑞', address='上海'),
+                                Member(security_id='M1', name='张三', gender='M', age=30),
+                                Prescription(prescription_id='P1', security_id='M1', time=today, doctor='王医生')])
+            for i in range(medicines):
+                code = f'C{i:04d}'
+                db.session.add(Medicine(national_code=code, name=f'药{i}', cabinet_id=1 + i % 2, manufacture_name='辉瑞',
+                                        remaining_quantity=quantity, expiry_date=today + datetime.timedelta(days=100 + i),
+                                        price=1.0))
+                if i % 2:
+                    db.session.add(OTC(national_code=code, direction='口服'))
+                else:
+                    db.session.add(PrescriptionMedicine(national_code=code, prescription_id='P1'))
+            db.session.flush()
+            create_consumptions([f'C{i:04d}' for i in range(medicines)])
+            db.session.commit()
+    return seed
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_statements(app, database):
+    """count_statements(func) 返回 (func() 的结果, 执行期间发出的 SQL 条数)"""
+    def count_statements(func):
+        counter = StatementCounter()
+        engine = db.engine
+        # 测试中外层应用上下文一直存在，请求之间共用会话；与实际请求一样从新的会话（事务）开始计数
+        db.session.remove()
+        event.listen(engine, 'before_cursor_execute', counter)
+        try:
+            return func(), counter.count
+        finally:
+            event.remove(engine, 'before_cursor_execute', counter)
+    return count_statements
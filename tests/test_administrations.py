@@ -0,0 +1,63 @@
+import datetime
+
+import pytest
+
+from app import db
+from app.models import MedicineAdministration
+
+NOW = datetime.datetime.now()
+
+# (开始时间, 持续时间, 是否正在进行, 是否已结束)；无法解析的持续时间统一视为正在进行（见 README "用药结束时间"）
+CASES = {
+    'long_term': (NOW - datetime.timedelta(days=100), '长期', True, False),
+    'running': (NOW - datetime.timedelta(days=2), '5天', True, False),
+    'finished': (NOW - datetime.timedelta(days=20), '5天', False, True),
+    'unparseable': (NOW - datetime.timedelta(days=20), '按需', True, False),
+    'empty_lasting': (NOW - datetime.timedelta(days=20), '', False, False),
+    'missing_lasting': (NOW - datetime.timedelta(days=20), None, False, False),
+    'missing_start': (None, '5天', False, False),
+}
+
+
+def _administer(app, start_time, lasting_time, national_code='C0000'):
+    with app.app_context():
+        db.session.add(MedicineAdministration(security_id='M1', national_code=national_code, dosage='1',
+                                              start_time=start_time, lasting_time=lasting_time))
+        db.session.commit()
+
+
+def _codes(client, url):
+    return [m['national_code'] for group in client.get(url).get_json() for m in group['medications']]
+
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_current_and_historical(app, client, seed, case):
+    start_time, lasting_time, active, historical = CASES[case]
+    seed(medicines=1)
+    _administer(app, start_time, lasting_time)
+
+    assert _codes(client, '/api/current_medications') == (['C0000'] if active else [])
+    assert _codes(client, '/api/historical_medications') == (['C0000'] if historical else [])
+    with app.app_context():
+        record = db.session.query(MedicineAdministration).one()
+        assert record.is_active(NOW) == active
+        assert db.session.query(MedicineAdministration).filter(MedicineAdministration.active_filter(NOW)).count() \
+            == int(active)
+
+
+@pytest.mark.parametrize('case', sorted(CASES))
+def test_delete_is_blocked_only_by_active_administrations(app, client, seed, case):
+    start_time, lasting_time, active, _ = CASES[case]
+    seed(medicines=1)
+    _administer(app, start_time, lasting_time)
+
+    response = client.delete('/api/delete_medicine/C0000')
+    assert response.status_code == (400 if active else 200), response.get_json()
+
+
+def test_long_term_without_start_time_blocks_delete_but_is_not_current(app, client, seed):
+    seed(medicines=1)
+    _administer(app, None, '长期')
+
+    assert _codes(client, '/api/current_medications') == []
+    assert client.delete('/api/delete_medicine/C0000').status_code == 400
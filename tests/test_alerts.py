@@ -0,0 +1,40 @@
+import datetime
+
+# conftest 中 SCHEDULER_ENABLED=false：调度器不启动，提醒快照须在写入后读取时重新计算
+
+
+def test_low_stock_reflects_writes_without_scheduler(client, seed):
+    seed(medicines=2)
+    assert client.get('/api/low_stock_medicines').get_json() == []
+
+    response = client.post('/api/remove_medicine', json={'national_code': 'C0001', 'quantity_to_remove': 8})
+    assert response.status_code == 200, response.get_json()
+
+    low_stock = client.get('/api/low_stock_medicines').get_json()
+    assert [item['national_code'] for item in low_stock] == ['C0001']
+    assert low_stock == client.get('/api/low_stock_medicines?limit=5').get_json()
+
+
+def test_expiring_reflects_refill_without_scheduler(client, seed):
+    seed(medicines=0)
+    expiry_date = (datetime.date.today() + datetime.timedelta(days=5)).isoformat()
+    response = client.post('/api/add_medicine', json={'national_code': 'E1', 'name': '即将过期', 'medicine_type': 'OTC',
+                                                      'cabinet_id': 1, 'remaining_quantity': 5,
+                                                      'expiry_date': expiry_date})
+    assert response.status_code == 200, response.get_json()
+    assert [item['remaining_quantity'] for item in client.get('/api/expiring_medicines').get_json()] == [5]
+
+    response = client.post('/api/refill_medicine', json={'national_code': 'E1', 'quantity_to_add': 1})
+    assert response.status_code == 200, response.get_json()
+    assert [item['remaining_quantity'] for item in client.get('/api/expiring_medicines').get_json()] == [6]
+
+
+def test_alert_etag_changes_after_write(client, seed):
+    seed(medicines=2)
+    first = client.get('/api/low_stock_medicines')
+    assert client.get('/api/low_stock_medicines', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    client.post('/api/remove_medicine', json={'national_code': 'C0000', 'quantity_to_remove': 9})
+    response = client.get('/api/low_stock_medicines', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert [item['national_code'] for item in response.get_json()] == ['C0000']
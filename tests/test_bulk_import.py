@@ -0,0 +1,52 @@
+import pytest
+
+from app import db
+from app.bulk_import import BulkImporter, IMPORTERS
+from app.models import Member
+
+
+class IncompleteImporter(BulkImporter):
+    def prepare(self, row):
+        return row
+
+
+def test_incomplete_importer_cannot_be_created():
+    with pytest.raises(TypeError):
+        IncompleteImporter()
+
+
+@pytest.mark.parametrize('kind', sorted(IMPORTERS))
+def test_importers_implement_every_step(app, database, kind):
+    with app.app_context():
+        IMPORTERS[kind]()
+
+
+def test_import_reports_row_errors(client, seed):
+    seed(medicines=0)
+    response = client.post('/api/import/members?format=ndjson',
+                           data='{"security_id": "M2", "name": "李四", "gender": "F", "age": 40}\nnot json\n')
+    report = response.get_json()
+    assert response.status_code == 200, report
+    assert report['inserted'] == 1
+    assert report['errors'] == [{'line': 2, 'error': '不是有效的 JSON'}]
+
+
+def test_failed_batch_keeps_valid_rows(app, client, seed, monkeypatch):
+    seed(medicines=0)
+    rows = ''.join(f'{{"security_id": "N{i}", "name": "成员{i}"}}\n' for i in range(3))
+    original_run = IMPORTERS['members'].run
+
+    def run_after_concurrent_insert(importer, rows):
+        # 导入器加载已有成员之后，另一个请求插入了 N1：校验通过，写入时主键冲突
+        with db.engine.begin() as conn:
+            conn.execute(Member.__table__.insert(), {'security_id': 'N1', 'name': '已有成员'})
+        return original_run(importer, rows)
+
+    monkeypatch.setattr(IMPORTERS['members'], 'run', run_after_concurrent_insert)
+    report = client.post('/api/import/members?format=ndjson', data=rows).get_json()
+    assert report['inserted'] == 2, report
+    assert [error['line'] for error in report['errors']] == [2]
+
+    with app.app_context():
+        assert {member.security_id: member.name for member in Member.query.filter(Member.security_id.like('N%'))} == {
+            'N0': '成员0', 'N1': '已有成员', 'N2': '成员2'}
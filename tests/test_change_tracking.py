@@ -0,0 +1,52 @@
+from app import db
+from app.cache import _PENDING_KEY, _statement_keys
+from app.models import Manufacture, Medicine
+
+
+def _pending_changes(app, execute):
+    """在会话中执行 execute(session)，返回登记的修改（不提交）"""
+    with app.app_context():
+        try:
+            execute(db.session)
+            return dict(db.session.info.get(_PENDING_KEY, {}))
+        finally:
+            db.session.rollback()
+
+
+def test_primary_key_update_records_key(app, seed):
+    seed(medicines=2)
+    table = Medicine.__table__
+    changes = _pending_changes(app, lambda session: session.execute(
+        table.update().where(table.c.national_code == 'C0001').values(remaining_quantity=1)))
+    assert changes == {'medicine': {'C0001'}}
+
+
+def test_executemany_update_records_every_key(app, seed):
+    seed(medicines=0)
+    table = Manufacture.__table__
+    statement = table.update().where(table.c.manufacture_name == db.bindparam('b_name')) \
+        .values(address=db.bindparam('b_address'))
+    changes = _pending_changes(app, lambda session: session.execute(
+        statement, [{'b_name': '辉瑞', 'b_address': '北京'}, {'b_name': '厂B', 'b_address': '天津'}]))
+    assert changes == {'manufacture': {'辉瑞', '厂B'}}
+
+
+def test_unbound_primary_key_is_unknown_scope():
+    table = Manufacture.__table__
+    statement = table.update().where(table.c.manufacture_name == db.bindparam('b_name')).values(address='北京')
+    assert _statement_keys(statement, table) is None
+    # 只有部分参数组提供了主键
+    assert _statement_keys(statement, table, [{'b_name': '辉瑞'}, {}]) is None
+    assert _statement_keys(statement, table, {'b_name': '辉瑞'}) == ['辉瑞']
+
+
+def test_manufacture_import_updates_search_index(client, seed):
+    seed(medicines=0)
+    assert client.get('/api/search?q=辉瑞&type=manufacture').get_json()[0]['address'] == '上海'
+
+    response = client.post('/api/import/manufactures?format=ndjson',
+                           data='{"manufacture_name": "辉瑞", "address": "北京"}\n')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['updated'] == 1
+
+    assert client.get('/api/search?q=辉瑞&type=manufacture').get_json()[0]['address'] == '北京'
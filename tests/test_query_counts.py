@@ -0,0 +1,52 @@
+import pytest
+
+
+def _statements(client, count_statements, url):
+    response, count = count_statements(lambda: client.get(url))
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json(), count
+
+
+@pytest.mark.parametrize('url', ['/api/medicines', '/api/medicines?limit=100', '/api/medicines?type=OTC'])
+def test_medicine_list_statement_count_does_not_grow_with_rows(app, client, seed, count_statements, url):
+    seed(medicines=4)
+    small, small_count = _statements(client, count_statements, url)
+    seed_more(app, 40)
+    large, large_count = _statements(client, count_statements, url)
+
+    assert len(large if isinstance(large, list) else large['items']) > \
+        len(small if isinstance(small, list) else small['items'])
+    assert large_count == small_count
+
+
+def test_medicine_list_resolves_type_in_query(client, seed):
+    seed(medicines=4)
+    medicines = client.get('/api/medicines').get_json()
+    assert {m['national_code']: m['medicine_type'] for m in medicines} == {
+        'C0000': '处方药', 'C0001': 'OTC', 'C0002': '处方药', 'C0003': 'OTC'
+    }
+
+
+def test_medicine_details_statement_count_is_constant(app, client, seed, count_statements):
+    seed(medicines=4)
+    otc, otc_count = _statements(client, count_statements, '/api/medicine_details/C0001')
+    prescription, prescription_count = _statements(client, count_statements, '/api/medicine_details/C0000')
+    seed_more(app, 40)
+    _, large_count = _statements(client, count_statements, '/api/medicine_details/C0001')
+
+    assert otc['medicine_type'] == 'OTC'
+    assert prescription['medicine_type'] == '处方药'
+    assert otc_count == prescription_count == large_count
+
+
+def seed_more(app, medicines):
+    """在 seed 的数据之外再添加药品（编码从 C1000 开始）"""
+    from app import db
+    from app.models import Medicine, OTC
+
+    with app.app_context():
+        for i in range(medicines):
+            code = f'C{1000 + i:04d}'
+            db.session.add(Medicine(national_code=code, name=f'新药{i}', cabinet_id=1, remaining_quantity=5))
+            db.session.add(OTC(national_code=code))
+        db.session.commit()
@@ -0,0 +1,37 @@
+from app import db
+from app.models import Manufacture, Medicine
+
+
+def _add(client, **data):
+    payload = {'national_code': 'A1', 'name': '阿莫西林', 'medicine_type': 'OTC', 'cabinet_id': 1}
+    payload.update(data)
+    return client.post('/api/add_medicine', json=payload)
+
+
+def test_add_existing_medicine_with_new_manufacture(app, client, seed):
+    seed(medicines=0)
+    response = _add(client, manufacture_name='厂A', manufacture_address='北京', remaining_quantity=5)
+    assert response.status_code == 200, response.get_json()
+
+    # 第二次请求中新厂家先被添加，查询药品时自动 flush，之后的存在性检查仍须识别它，不能重复插入
+    response = _add(client, manufacture_name='厂B', manufacture_address='天津', remaining_quantity=3, expected_version=1)
+    assert response.status_code == 200, response.get_json()
+
+    with app.app_context():
+        medicine = db.session.get(Medicine, 'A1')
+        assert medicine.remaining_quantity == 8
+        assert medicine.manufacture_name == '厂B'
+        assert db.session.get(Manufacture, '厂B').address == '天津'
+
+
+def test_manufacture_added_elsewhere_is_not_duplicated(app, client, seed):
+    seed(medicines=0)
+    # 添加药品时加载并缓存生产厂家
+    assert _add(client, national_code='A0', manufacture_name='辉瑞', remaining_quantity=1).status_code == 200
+    with app.app_context():
+        # 不经过会话直接写入，本进程的缓存不会失效（相当于其他进程的写入）
+        with db.engine.begin() as conn:
+            conn.execute(Manufacture.__table__.insert().values(manufacture_name='厂C', address='广州'))
+
+    response = _add(client, manufacture_name='厂C', remaining_quantity=1)
+    assert response.status_code == 200, response.get_json()
@@ -0,0 +1,234 @@
+import threading
+
+import pytest
+from sqlalchemy.dialects import mysql
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from app import db
+from app.models import Medicine, MedicineConsumption, StockMovement
+from app.schema import backfill_consumptions
+from app.stock import StockError, _consumption_for_update, add_stock, dispense, take_stock
+
+
+def run_concurrently(app, threads, operations, operation):
+    """threads 个线程各执行 operations 次 operation(线程序号)，每次一个事务；返回成功与库存不足的次数
+
+    SQLite 同一时间只允许一个写事务，等待超时（database is locked）时重试，其他数据库不会出现这种情况。
+    """
+    counts = {'ok': 0, 'insufficient': 0}
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index):
+        with app.app_context():
+            try:
+                for _ in range(operations):
+                    while True:
+                        try:
+                            operation(index)
+                            db.session.commit()
+                            result = 'ok'
+                        except StockError:
+                            db.session.rollback()
+                            result = 'insufficient'
+                        except OperationalError as e:
+                            db.session.rollback()
+                            if 'locked' in str(e):
+                                continue
+                            raise
+                        break
+                    with lock:
+                        counts[result] += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    assert not errors, errors
+    return counts
+
+
+def test_consumption_is_read_with_row_lock(app, database):
+    with app.app_context():
+        statement = _consumption_for_update('C0000').statement.compile(dialect=mysql.dialect())
+    assert 'FOR UPDATE' in str(statement)
+
+
+def _consumption(app, national_code):
+    with app.app_context():
+        consumption = db.session.get(MedicineConsumption, national_code)
+        return consumption and (consumption.total_quantity, consumption.first_at)
+
+
+@pytest.mark.parametrize('url', ['/api/add_medicine', '/api/add_new_medicine'])
+def test_consumption_row_is_created_with_medicine(app, client, seed, url):
+    seed(medicines=0)
+    response = client.post(url, json={'national_code': 'N1', 'name': '新药', 'medicine_type': 'OTC', 'cabinet_id': 1,
+                                      'remaining_quantity': 5})
+    assert response.status_code == 200, response.get_json()
+    # 第一次出库前已有这一行，出库时的加锁读取不会落在索引间隙上
+    total_quantity, created_at = _consumption(app, 'N1')
+    assert total_quantity == 0
+
+    assert client.post('/api/remove_medicine', json={'national_code': 'N1', 'quantity_to_remove': 2}).status_code == 200
+    total_quantity, first_at = _consumption(app, 'N1')
+    # 统计时长仍从第一次出库算起
+    assert total_quantity == 2 and first_at > created_at
+
+
+def test_consumption_rows_are_created_by_import_and_upgrade(app, client, seed):
+    seed(medicines=0)
+    response = client.post('/api/import/medicines?format=ndjson',
+                           data='{"national_code": "I1", "name": "导入药", "medicine_type": "OTC"}\n')
+    assert response.get_json()['inserted'] == 1, response.get_json()
+    assert _consumption(app, 'I1')[0] == 0
+
+    with app.app_context():
+        # 升级前已有的药品没有消耗统计
+        db.session.add(Medicine(national_code='OLD', name='旧药', remaining_quantity=1))
+        db.session.commit()
+        assert backfill_consumptions() == 1
+        assert backfill_consumptions() == 0
+    assert _consumption(app, 'OLD')[0] == 0
+
+
+def test_concurrent_removes_keep_consumption_consistent(app, seed):
+    seed(medicines=1, quantity=100)
+    counts = run_concurrently(app, threads=6, operations=20, operation=lambda index: take_stock('C0000', 1))
+
+    assert counts == {'ok': 100, 'insufficient': 20}
+    with app.app_context():
+        assert db.session.get(Medicine, 'C0000').remaining_quantity == 0
+        assert db.session.query(StockMovement).filter_by(national_code='C0000').count() == 100
+        consumption = db.session.get(MedicineConsumption, 'C0000')
+        assert consumption.total_quantity == 100
+
+
+def test_concurrent_removes_and_refills_do_not_lose_updates(app, seed):
+    seed(medicines=1, quantity=1000)
+
+    def operation(index):
+        # 偶数线程每次扣减 3 个，奇数线程每次补充 2 个
+        if index % 2:
+            add_stock('C0000', 2)
+        else:
+            take_stock('C0000', 3)
+
+    counts = run_concurrently(app, threads=6, operations=30, operation=operation)
+
+    assert counts == {'ok': 180, 'insufficient': 0}
+    with app.app_context():
+        assert db.session.get(Medicine, 'C0000').remaining_quantity == 1000 - 3 * 90 + 2 * 90
+
+
+def test_remove_never_oversells(client, seed):
+    seed(medicines=1, quantity=2)
+    response = client.post('/api/remove_medicine', json={'national_code': 'C0000', 'quantity_to_remove': 3})
+    assert response.status_code == 400
+    assert client.get('/api/medicine_details/C0000').get_json()['remaining_quantity'] == 2
+
+
+def test_concurrent_edit_is_rejected_by_version(app, client, seed):
+    seed(medicines=1)
+    with app.app_context():
+        # 另一个会话先读到版本 1，随后本次请求修改了同一药品
+        other = Session(db.engine)
+        stale = other.get(Medicine, 'C0000')
+        response = client.put('/api/update_low_stock_threshold',
+                              json={'national_code': 'C0000', 'low_stock_threshold': 5, 'expected_version': 1})
+        assert response.status_code == 200, response.get_json()
+        assert response.get_json()['version'] == 2
+
+        stale.low_stock_threshold = 7
+        with pytest.raises(StaleDataError):
+            other.commit()
+        other.close()
+        assert db.session.get(Medicine, 'C0000').low_stock_threshold == 5
+
+
+def test_edit_requires_version_read_by_client(client, seed):
+    seed(medicines=1)
+    version = client.get('/api/medicine_details/C0000').get_json()['version']
+    assert client.get('/api/medicines?fields=national_code,version').get_json() == [
+        {'national_code': 'C0000', 'version': version}]
+
+    url, body = '/api/update_low_stock_threshold', {'national_code': 'C0000', 'low_stock_threshold': 5}
+    assert client.put(url, json=body).status_code == 428
+    assert client.put(url, json=dict(body, expected_version=version)).status_code == 200
+    # 客户端读到的版本已过期
+    response = client.put(url, json=dict(body, low_stock_threshold=6, expected_version=version))
+    assert response.status_code == 409
+    assert response.get_json()['version'] == version + 1
+    assert client.get('/api/medicine_details/C0000').get_json()['low_stock_threshold'] == 5
+
+
+def test_add_medicine_checks_version_only_when_info_changes(client, seed):
+    seed(medicines=1, quantity=10)
+    body = {'national_code': 'C0000', 'name': '药0', 'medicine_type': 'OTC'}
+    # 只累加数量，不需要版本号
+    response = client.post('/api/add_medicine', json=dict(body, remaining_quantity=2))
+    assert response.status_code == 200, response.get_json()
+    version = response.get_json()['version']
+
+    assert client.post('/api/add_medicine', json=dict(body, price=9.5)).status_code == 428
+    assert client.post('/api/add_medicine', json=dict(body, price=9.5, expected_version=version + 1)).status_code == 409
+    response = client.post('/api/add_medicine', json=dict(body, price=9.5, expected_version=version))
+    assert response.status_code == 200, response.get_json()
+    details = client.get('/api/medicine_details/C0000').get_json()
+    assert (details['price'], details['remaining_quantity'], details['version']) == (9.5, 12, version + 1)
+
+
+def test_add_medicine_maps_concurrent_edit_to_conflict(app, client, seed, monkeypatch):
+    seed(medicines=1)
+    table = Medicine.__table__
+
+    def edited_after_check(medicine, data):
+        # 版本号校验通过后、提交前，另一个请求修改了同一药品
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.national_code == medicine.national_code)
+                         .values(version=table.c.version + 1))
+        return None
+
+    monkeypatch.setattr('app.routes._version_conflict', edited_after_check)
+    response = client.post('/api/add_medicine', json={'national_code': 'C0000', 'name': '药0', 'medicine_type': 'OTC',
+                                                       'price': 9.5, 'expected_version': 1})
+    assert response.status_code == 409
+
+
+def test_dispense_is_all_or_nothing(client, seed):
+    seed(medicines=2, quantity=5)
+    response = client.post('/api/dispense', json={'items': [{'national_code': 'C0000', 'quantity': 2},
+                                                            {'national_code': 'C0001', 'quantity': 6}]})
+    assert response.status_code == 400
+    assert {item['national_code']: item['status'] for item in response.get_json()['items']} == {
+        'C0000': 'not_applied', 'C0001': 'insufficient'
+    }
+    for code in ('C0000', 'C0001'):
+        assert client.get(f'/api/medicine_details/{code}').get_json()['remaining_quantity'] == 5
+
+
+def test_concurrent_dispenses_in_opposite_orders(app, seed):
+    seed(medicines=3, quantity=200)
+
+    def operation(index):
+        # 各线程给出的药品顺序不同，dispense 按编码顺序加锁，不会互相死锁
+        codes = ['C0000', 'C0001', 'C0002']
+        if index % 2:
+            codes.reverse()
+        _, succeeded = dispense({code: 1 for code in codes})
+        assert succeeded
+
+    counts = run_concurrently(app, threads=6, operations=20, operation=operation)
+
+    assert counts == {'ok': 120, 'insufficient': 0}
+    with app.app_context():
+        assert [medicine.remaining_quantity for medicine in db.session.query(Medicine).order_by(Medicine.national_code)] \
+            == [80, 80, 80]
+        assert db.session.query(StockMovement).filter_by(movement_type='dispense').count() == 360
@@ -0,0 +1,151 @@
+import pytest
+
+from app import db
+from app.cache import log_changes, table_versions
+from app.inventory import init_inventory, read_model
+from app.models import Manufacture, Medicine, TableChange
+
+OTHER_PROCESS = 'other-process'
+
+
+@pytest.fixture
+def poll_every_request(monkeypatch):
+    """每次读取版本号都读取变更日志，其他进程的写入立即可见"""
+    monkeypatch.setattr(table_versions, 'poll_seconds', 0)
+
+
+def _write_elsewhere(app, statement, table, keys):
+    """相当于另一个进程的写入：不经过本进程的会话，在同一事务中追加变更记录"""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(statement)
+            log_changes(conn, {table.name: keys}, origin=OTHER_PROCESS)
+
+
+def _set_quantity(app, national_code, quantity):
+    table = Medicine.__table__
+    _write_elsewhere(app, table.update().where(table.c.national_code == national_code)
+                     .values(remaining_quantity=quantity), table, {national_code})
+
+
+def test_etag_changes_after_write_in_other_process(app, client, seed, poll_every_request):
+    seed(medicines=2)
+    first = client.get('/api/medicine_details/C0000')
+    assert client.get('/api/medicine_details/C0000', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    _set_quantity(app, 'C0000', 7)
+    response = client.get('/api/medicine_details/C0000', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['remaining_quantity'] == 7
+
+
+def test_not_modified_between_polls_runs_no_sql(client, seed, count_statements):
+    seed(medicines=2)
+    first = client.get('/api/medicines')
+    response, count = count_statements(
+        lambda: client.get('/api/medicines', headers={'If-None-Match': first.headers['ETag']}))
+    assert response.status_code == 304
+    assert count == 0
+
+
+def test_write_appends_changed_keys_to_change_log(app, client, seed):
+    seed(medicines=2)
+    with app.app_context():
+        before = db.session.query(db.func.max(TableChange.id)).scalar()
+    response = client.post('/api/remove_medicine', json={'national_code': 'C0000', 'quantity_to_remove': 1})
+    assert response.status_code == 200, response.get_json()
+
+    with app.app_context():
+        rows = db.session.query(TableChange.table_name, TableChange.primary_key) \
+            .filter(TableChange.id > before).all()
+    assert ('medicine', '"C0000"') in rows
+    assert all(key is not None for table_name, key in rows if table_name != 'stock_movement')
+
+
+def test_search_index_sees_write_in_other_process(app, client, seed, poll_every_request):
+    seed(medicines=0)
+    assert client.get('/api/search?q=辉瑞&type=manufacture').get_json()[0]['address'] == '上海'
+
+    table = Manufacture.__table__
+    _write_elsewhere(app, table.update().where(table.c.manufacture_name == '辉瑞').values(address='北京'),
+                     table, {'辉瑞'})
+    assert client.get('/api/search?q=辉瑞&type=manufacture').get_json()[0]['address'] == '北京'
+
+
+def test_alert_snapshot_sees_write_in_other_process(app, client, seed, poll_every_request):
+    seed(medicines=2)
+    first = client.get('/api/low_stock_medicines')
+    assert first.get_json() == []
+
+    _set_quantity(app, 'C0001', 1)
+    response = client.get('/api/low_stock_medicines', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert [item['national_code'] for item in response.get_json()] == ['C0001']
+
+
+def test_inventory_reloads_only_changed_medicine(app, client, seed, monkeypatch, poll_every_request):
+    monkeypatch.setitem(app.config, 'INVENTORY_READ_MODEL', True)
+    seed(medicines=2)
+    assert client.get('/api/medicine_details/C0001').get_json()['remaining_quantity'] == 10
+    with app.app_context():
+        build_seconds, reloaded = read_model.build_seconds, read_model.reloaded
+
+    _set_quantity(app, 'C0001', 4)
+    assert client.get('/api/medicine_details/C0001').get_json()['remaining_quantity'] == 4
+    # 按主键重新加载，不整表重建
+    assert read_model.build_seconds == build_seconds
+    assert read_model.reloaded == reloaded + 1
+
+
+@pytest.fixture
+def start_inventory(app, monkeypatch):
+    """启用读模型并按启动流程初始化；本测试中注册的回调在结束后撤销"""
+    monkeypatch.setitem(app.config, 'INVENTORY_READ_MODEL', True)
+    monkeypatch.setattr(table_versions, '_listeners', list(table_versions._listeners))
+
+    def start():
+        with app.app_context():
+            init_inventory(app)
+    return start
+
+
+def test_inventory_is_built_at_startup(client, seed, count_statements, start_inventory):
+    seed(medicines=3)
+    start_inventory()
+    response, count = count_statements(lambda: client.get('/api/medicines'))
+    assert [item['national_code'] for item in response.get_json()] == ['C0000', 'C0001', 'C0002']
+    assert count == 0
+
+
+def test_inventory_is_built_on_first_read_when_startup_fails(app, client, start_inventory):
+    with app.app_context():
+        Medicine.__table__.drop(db.engine)
+    # 启动时还没有药品表：只记录警告，第一次读取时建立
+    start_inventory()
+    with app.app_context():
+        Medicine.__table__.create(db.engine)
+        # 不经过会话写入，读模型收不到通知，只有整表建立才能读到
+        with db.engine.begin() as conn:
+            conn.execute(Medicine.__table__.insert(), {'national_code': 'N1', 'name': '新药'})
+    assert [item['national_code'] for item in client.get('/api/medicines').get_json()] == ['N1']
+
+
+def test_change_committed_out_of_id_order_is_not_missed(app, client, seed, poll_every_request):
+    seed(medicines=2)
+    table = TableChange.__table__
+    with app.app_context():
+        last_id = db.session.query(db.func.max(TableChange.id)).scalar()
+        row = {'table_name': 'medicine', 'origin': OTHER_PROCESS, 'created_at': db.func.now()}
+        # 较大的 ID 先提交
+        with db.engine.begin() as conn:
+            conn.execute(table.insert().values(id=last_id + 2, primary_key='"C0001"', **row))
+    first = client.get('/api/medicine_details/C0000')
+
+    medicines = Medicine.__table__
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(medicines.update().where(medicines.c.national_code == 'C0000').values(remaining_quantity=3))
+            conn.execute(table.insert().values(id=last_id + 1, primary_key='"C0000"', **row))
+    response = client.get('/api/medicine_details/C0000', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()['remaining_quantity'] == 3